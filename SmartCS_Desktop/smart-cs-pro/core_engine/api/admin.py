@@ -2,19 +2,24 @@ from fastapi import APIRouter, Query, Request, Depends, HTTPException
 from core.models import User, Department, ViolationRecord, Role, Permission, RolePermission, PolicyCategory, SensitiveWord, KnowledgeBase, Notification, AuditLog, Product, Customer, Platform
 from api.auth import get_current_user, check_permission
 from core.constants import RoleID
+from core.session import sessions
+from utils.redis_utils import redis_mgr
+from core.revocation import revocations
+from core.token_cache import token_cache
+from core.roster import build_roster, roster
+from core.pinyin_index import pinyin_index
+from utils.pagination import keyset_page
+from utils.cache import static_cache
+from core.notifications import notification_center
+from core.audit import record_audit, audited_transaction
+from core.retention import retention, POLICIES
 from tortoise.expressions import Q
 from tortoise.functions import Count
-from tortoise.transactions import in_transaction
 import os, json, asyncio, time
 from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/api/admin", tags=["Admin"])
 
-# --- 战术审计助手 ---
-async def record_audit(operator: str, action: str, target: str, details: str):
-    """[物理审计] 记录操作足迹至 MySQL"""
-    await AuditLog.create(operator=operator, action=action, target=target, details=details)
-
 @router.get("/agents")
 async def get_agents(
     request: Request, 
@@ -24,7 +29,7 @@ async def get_agents(
 ):
     redis = request.app.state.redis
     offset = (page - 1) * size
-    online_usernames = await redis.smembers("online_agents_set") if redis else []
+    online_usernames = await redis_mgr.get_online_list() if redis else set()
     query = User.filter(is_deleted=0).select_related("role")
     
     if role_only: query = query.filter(role__code=role_only)
@@ -34,58 +39,61 @@ async def get_agents(
 
     # 核心：物理数据隔离与 HQ 穿透筛选
     actual_dept_id = dept_id if dept_id and dept_id != "" and dept_id != "undefined" else None
-    if role_id == RoleID.ADMIN or role_code == "ADMIN":
+    if not (role_id == RoleID.HQ or role_code == "HQ"): # 主管 / 坐席仅限本部门
         query = query.filter(department_id=current_user["dept_id"])
     elif actual_dept_id: # HQ 角色选了部门
         query = query.filter(department_id=actual_dept_id)
 
     # 核心：拼音检索增强
     if search:
-        from pypinyin import lazy_pinyin
-        # 1. 尝试直接搜索姓名或账号
-        # 2. 如果没有结果或为了更广匹配，可以结合数据库全文检索，或者这里采用 Python 端过滤（针对小数据量）
-        # 工业级方案：SQL 原生不支持拼音，需在 User 表增加 pinyin 字段。
-        # 战术方案：目前先执行 Q 模糊检索
-        query = query.filter(Q(username__icontains=search) | Q(real_name__icontains=search))
+        # V5.74: 拼音/首字母前缀索引 (账号、姓名、全拼、首字母)，非拼音检索词 / 无命中 / 命中过宽时回退 Q 模糊检索
+        ids = pinyin_index.match_ids(search)
+        if ids is not None:
+            query = query.filter(id__in=ids)
+        else:
+            query = query.filter(Q(username__icontains=search) | Q(real_name__icontains=search))
 
     total = await query.count()
     agents_data = await query.order_by("-id").limit(size).offset(offset).values("id", "username", "real_name", "role_id", "role__name", "role__code", "tactical_score", "department_id")
     
-    from utils.redis_utils import redis_mgr
-    async def process_agent(a):
-        dept = await Department.get_or_none(id=a["department_id"]) if a["department_id"] else None
-        last_v = await ViolationRecord.filter(user_id=a["id"], is_deleted=0).order_by("-timestamp").first()
-        from core.models import UserReward, TrainingSession
-        r_count = await UserReward.filter(user_id=a["id"]).count()
-        t_session = await TrainingSession.filter(user_id=a["id"]).order_by("-updated_at").first()
-        m_count = await Department.filter(manager_id=a["id"], is_deleted=0).count()
-        
-        # 实时拉取活跃度与锁定状态
-        last_activity = await redis_mgr.get_last_activity(a["username"])
-        is_locked = await redis_mgr.client.get(f"agent_lock_status:{a['username']}") == "1"
-        
-        return {
-            "id": a["id"], # 显式包含 ID 用于管理
-            "username": a["username"], "real_name": a["real_name"],
-            "role_id": a["role_id"], "role_name": a["role__name"], "role_code": a["role__code"],
-            "dept_name": dept.name if dept else "全域节点",
-            "department_id": a["department_id"], # 核心修复：确保回传 ID 用于前端回填
-            "is_manager": m_count > 0, "is_online": a["username"] in online_usernames,
-            "is_locked": is_locked,
-            "tactical_score": a["tactical_score"], "reward_count": r_count,
-            "training_progress": t_session.progress if t_session else 0,
-            "last_violation_type": last_v.keyword if last_v else None,
-            "last_activity": last_activity # 返回活跃时间戳
-        }
-    result = await asyncio.gather(*[process_agent(a) for a in agents_data])
+    # V5.72: 集合查询批量组装，消除逐行 N+1 查询
+    result = await build_roster(agents_data, online_usernames)
     return {"status": "ok", "data": result, "total": total}
 
+@router.get("/roster")
+async def get_roster(
+    current_user: dict = Depends(get_current_user),
+    dept_id: str = Query(None), since_version: int = Query(None)
+):
+    """
+    [实时花名册] 直接读取 Redis 快照；携带 since_version 时仅返回此后变更的行
+    full=True 表示返回的是全量快照，客户端应整体替换本地数据
+    """
+    role_id, role_code = current_user.get("role_id"), current_user.get("role_code")
+    actual_dept_id = dept_id if dept_id and dept_id != "" and dept_id != "undefined" else None
+    if (role_id == RoleID.HQ or role_code == "HQ") and actual_dept_id: # 仅总部可穿透查看其它部门
+        target_dept = int(actual_dept_id)
+    else:
+        target_dept = current_user.get("dept_id")
+
+    if not redis_mgr.client:
+        # Redis 脱机：回源 MySQL 全量组装
+        query = User.filter(is_deleted=0)
+        query = query.filter(department_id=target_dept) if target_dept else query.filter(department_id__isnull=True)
+        agents = await query.order_by("-id").values("id", "username", "real_name", "role_id", "role__name", "role__code", "tactical_score", "department_id")
+        return {"status": "ok", "data": {"version": 0, "full": True, "rows": await build_roster(agents, set())}}
+    return {"status": "ok", "data": await roster.read(target_dept, since_version)}
+
 @router.get("/departments/users")
 async def get_dept_users(dept_id: int = Query(...), search: str = Query(""), current_user: dict = Depends(get_current_user)):
     """[物理检索] 获取指定部门的所有成员，用于指派主管"""
     query = User.filter(department_id=dept_id, is_deleted=0)
     if search:
-        query = query.filter(Q(real_name__icontains=search) | Q(username__icontains=search))
+        ids = pinyin_index.match_ids(search)
+        if ids is not None:
+            query = query.filter(id__in=ids)
+        else:
+            query = query.filter(Q(real_name__icontains=search) | Q(username__icontains=search))
     
     data = await query.values("id", "username", "real_name")
     return {"status": "ok", "data": data}
@@ -100,7 +108,8 @@ async def update_agent_info(data: dict, user: dict = Depends(check_permission("a
     # 核心修正：防止前端传 '' 导致数据库 Int 转换崩溃
     final_dept_id = dept_id if dept_id and dept_id != "" else None
     
-    async with in_transaction() as conn:
+    old = await User.get_or_none(username=username).values("id", "department_id")
+    async with audited_transaction() as conn:
         await User.filter(username=username).using_db(conn).update(
             real_name=real_name, 
             department_id=final_dept_id
@@ -111,14 +120,27 @@ async def update_agent_info(data: dict, user: dict = Depends(check_permission("a
             username, 
             f"重校基础信息: 姓名->{real_name}, 部门ID->{final_dept_id}"
         )
+    await sessions.refresh(username)
+    # V5.71: 令牌载荷携带 dept_id (数据权限范围)，部门调整后作废旧令牌
+    if old and old["department_id"] != final_dept_id:
+        await token_cache.bump([username])
+    await roster.invalidate(final_dept_id, *([old["department_id"]] if old else []))
+    await static_cache.invalidate("depts") # 部门成员数变化
+    if old: await pinyin_index.publish_upsert(old["id"], username, real_name)
     return {"status": "ok"}
 
 @router.post("/agents/delete")
 async def delete_agent(data: dict, user: dict = Depends(check_permission("admin:user:delete"))):
     username = data.get("username")
-    async with in_transaction() as conn:
+    target = await User.get_or_none(username=username).values("id", "department_id")
+    async with audited_transaction() as conn:
         await User.filter(username=username).using_db(conn).update(is_deleted=1)
         await record_audit(user["real_name"], "USER_DELETE", username, "物理注销操作员节点")
+    await token_cache.bump([username])
+    if target:
+        await roster.invalidate(target["department_id"])
+        await pinyin_index.publish_remove(target["id"])
+        await static_cache.invalidate("depts")
     return {"status": "ok"}
 
 @router.post("/command")
@@ -132,6 +154,7 @@ async def send_command(data: dict, request: Request, user: dict = Depends(check_
     if cmd_type == 'LOCK' and redis:
         lock_val = "1" if cmd_payload.get("lock") else "0"
         await redis.set(f"agent_lock_status:{target_username}", lock_val)
+        await roster.patch(target_username, {"is_locked": lock_val == "1"})
     
     # V3.88: 指令历史持久化 - 如果是 SOP 指令，存入 Redis 列表
     if cmd_type == 'SOP' and redis:
@@ -162,21 +185,25 @@ async def force_kill_link(data: dict, request: Request, user: dict = Depends(che
     # 1. 如果需要封禁，执行物理拉黑
     if duration > 0:
         expiry_dt = datetime.now() + timedelta(seconds=duration)
-        # A. 写入 Redis (极速拦截)
-        if redis:
-            await redis.setex(f"blacklist:{target_username}", duration, "1")
-        
-        # B. 写入 MySQL (持久化)
+        # A. 写入 MySQL (持久化)
         # 注意：此处需先在 core.models 定义 Blacklist 模型或使用原生 SQL
         from tortoise import Tortoise
         conn = Tortoise.get_connection("default")
         sql = "INSERT INTO blacklist (username, expired_at, reason) VALUES (%s, %s, %s)"
         await conn.execute_query(sql, [target_username, expiry_dt.strftime('%Y-%m-%d %H:%M:%S'), f"指挥部手动干预 - 时长: {duration}s"])
 
-    # 2. 物理标记离线
+        # B. V5.70: 写入进程内封禁表并广播至全部 worker (极速拦截)
+        await revocations.revoke(target_username, expiry_dt)
+
+    # V5.71: 作废目标此前签发的全部令牌 (强制重新登录)
+    await token_cache.bump([target_username])
+
+    # 2. 物理标记离线 (同时丢弃本 worker 尚未刷新的心跳，避免被重新标记为在线)
+    from core.presence import presence
+    presence.forget(target_username)
     if redis:
-        await redis.srem("online_agents_set", target_username)
-        await redis.delete(f"agent_heartbeat:{target_username}")
+        await redis_mgr.mark_offline(target_username)
+        await roster.patch(target_username, {"is_online": False})
 
     # 3. 发送物理下线指令
     if ws_manager:
@@ -220,7 +247,7 @@ async def get_blacklist(current_user: dict = Depends(check_permission("admin:bla
 
 @router.post("/blacklist/delete")
 async def delete_blacklist_item(data: dict, request: Request, user: dict = Depends(check_permission("admin:blacklist:delete"))):
-    """[战术解封] 物理移除黑名单记录并刷新 Redis 链路"""
+    """[战术解封] 物理移除黑名单记录并同步全部 worker 的封禁表"""
     username = data.get("username")
     if not username: return {"status": "error", "message": "未指定目标"}
     
@@ -228,13 +255,12 @@ async def delete_blacklist_item(data: dict, request: Request, user: dict = Depen
     from tortoise import Tortoise
     conn = Tortoise.get_connection("default")
     
-    async with in_transaction() as db_conn:
+    async with audited_transaction() as db_conn:
         # 1. 物理移除 MySQL 记录
         await conn.execute_query("DELETE FROM blacklist WHERE username = %s", [username])
         
-        # 2. 同步清理 Redis 缓存
-        if redis:
-            await redis.delete(f"blacklist:{username}")
+        # 2. V5.70: 同步解除全部 worker 的进程内封禁
+        await revocations.restore(username)
             
         await record_audit(user["real_name"], "UNBAN_USER", username, "手动解除战术封禁，恢复链路权限")
         
@@ -252,130 +278,146 @@ async def get_sop_history(request: Request, current_user: dict = Depends(get_cur
     return {"status": "ok", "data": history}
 
 @router.get("/departments")
-async def get_departments(request: Request, page: int = 1, size: int = 10, current_user: dict = Depends(get_current_user)):
-    redis = request.app.state.redis
+async def get_departments(page: int = 1, size: int = 10, current_user: dict = Depends(get_current_user)):
     role_id = current_user.get("role_id")
     role_code = current_user.get("role_code")
 
-    # 针对 HQ 角色获取全量列表（size=100）进行战术缓存
-    is_hq_full_fetch = (role_id == RoleID.HQ or role_code == "HQ") and size >= 100
-    cache_key = "cache:static:depts_full"
-    
-    if is_hq_full_fetch and redis:
-        cached = await redis.get(cache_key)
-        if cached: return {"status": "ok", "data": json.loads(cached), "total": len(json.loads(cached)), "source": "tactical_cache"}
+    async def load():
+        offset = (page - 1) * size
+        query = Department.filter(is_deleted=0).select_related("manager")
+        if role_id == RoleID.ADMIN or role_code == "ADMIN": query = query.filter(id=current_user["dept_id"])
+        total = await query.count()
+        depts_data = await query.limit(size).offset(offset).annotate(member_count=Count("users")).values("id", "name", "member_count", "manager__username", "manager__real_name")
+        return {"data": depts_data, "total": total}
 
-    offset = (page - 1) * size
-    query = Department.filter(is_deleted=0).select_related("manager")
-    if role_id == RoleID.ADMIN or role_code == "ADMIN": query = query.filter(id=current_user["dept_id"])
-    total = await query.count()
-    depts_data = await query.limit(size).offset(offset).annotate(member_count=Count("users")).values("id", "name", "member_count", "manager__username", "manager__real_name")
-    
-    if is_hq_full_fetch and redis:
-        await redis.setex(cache_key, 1800, json.dumps(depts_data)) # 缓存 30 分钟
-        
-    return {"status": "ok", "data": depts_data, "total": total}
+    # V5.78: 两级缓存 (主管只见本部门，缓存键按部门区分)
+    scope = current_user["dept_id"] if role_id == RoleID.ADMIN or role_code == "ADMIN" else "all"
+    cached = await static_cache.get_or_load(f"depts:{scope}:{page}:{size}", load, ttl=1800, tags=("depts",))
+    return {"status": "ok", **cached}
 
 @router.post("/departments")
-async def save_department(data: dict, request: Request, user: dict = Depends(check_permission("admin:dept:create"))):
+async def save_department(data: dict, user: dict = Depends(check_permission("admin:dept:create"))):
     name = data.get("name")
-    redis = request.app.state.redis
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         await Department.create(name=name, using_db=conn)
         await record_audit(user["real_name"], "DEPT_CREATE", name, "录入新战术单元")
-    if redis: await redis.delete("cache:static:depts_full")
+    await static_cache.invalidate("depts")
     return {"status": "ok"}
 
 @router.post("/departments/update")
-async def update_department(data: dict, request: Request, user: dict = Depends(check_permission("admin:dept:update"))):
+async def update_department(data: dict, user: dict = Depends(check_permission("admin:dept:update"))):
     dept_id, name, manager_id = data.get("id"), data.get("name"), data.get("manager_id")
-    redis = request.app.state.redis
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         await Department.filter(id=dept_id).using_db(conn).update(name=name, manager_id=manager_id)
         await record_audit(user["real_name"], "DEPT_UPDATE", name, f"调整组织架构, 主管ID: {manager_id}")
-    if redis: await redis.delete("cache:static:depts_full")
+    await static_cache.invalidate("depts")
+    await roster.invalidate() # 部门名称与主管标记可能涉及多个部门的快照
     return {"status": "ok"}
 
 @router.post("/departments/delete")
-async def delete_department(data: dict, request: Request, user: dict = Depends(check_permission("admin:dept:delete"))):
+async def delete_department(data: dict, user: dict = Depends(check_permission("admin:dept:delete"))):
     dept_id = data.get("id")
-    redis = request.app.state.redis
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         dept = await Department.get(id=dept_id)
         await Department.filter(id=dept_id).using_db(conn).update(is_deleted=1)
         await record_audit(user["real_name"], "DEPT_DELETE", dept.name, "物理注销战术单元")
-    if redis: await redis.delete("cache:static:depts_full")
+    await static_cache.invalidate("depts")
+    await roster.invalidate()
     return {"status": "ok"}
 
 @router.get("/products")
 async def get_products(page: int = 1, size: int = 12, current_user: dict = Depends(get_current_user)):
-    query = Product.filter(is_deleted=0)
-    total = await query.count()
-    data = await query.offset((page - 1) * size).limit(size).order_by("-id").values()
-    return {"status": "ok", "data": data, "total": total}
+    async def load():
+        query = Product.filter(is_deleted=0)
+        total = await query.count()
+        data = await query.offset((page - 1) * size).limit(size).order_by("-id").values()
+        return {"data": data, "total": total}
+    return {"status": "ok", **await static_cache.get_or_load(f"products:{page}:{size}", load, ttl=600, tags=("products",))}
 
 @router.post("/products")
 async def save_product(data: dict, user: dict = Depends(check_permission("admin:asset:create"))):
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         p = await Product.create(**data, using_db=conn)
         await record_audit(user["real_name"], "PROD_CREATE", p.name, "同步新商品资产")
+    await static_cache.invalidate("products")
     return {"status": "ok"}
 
 @router.post("/products/delete")
 async def delete_product(data: dict, user: dict = Depends(check_permission("admin:asset:delete"))):
     p_id = data.get("id")
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         p = await Product.get(id=p_id)
         await Product.filter(id=p_id).using_db(conn).update(is_deleted=1)
         await record_audit(user["real_name"], "PROD_DELETE", p.name, "物理注销商品资产")
+    await static_cache.invalidate("products")
     return {"status": "ok"}
 
 @router.post("/platforms/delete")
 async def delete_platform(data: dict, user: dict = Depends(check_permission("admin:platform:delete"))):
     p_id = data.get("id")
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         p = await Platform.get(id=p_id)
         await Platform.filter(id=p_id).using_db(conn).update(is_deleted=1)
         await record_audit(user["real_name"], "PLATFORM_DELETE", p.name, "注销监控目标软件")
+    await static_cache.invalidate("platforms")
     return {"status": "ok"}
 
 @router.get("/platforms")
 async def get_platforms(page: int = 1, size: int = 12, current_user: dict = Depends(get_current_user)):
-    query = Platform.filter(is_deleted=0)
-    total = await query.count()
-    data = await query.offset((page - 1) * size).limit(size).order_by("-id").values()
-    return {"status": "ok", "data": data, "total": total}
+    async def load():
+        query = Platform.filter(is_deleted=0)
+        total = await query.count()
+        data = await query.offset((page - 1) * size).limit(size).order_by("-id").values()
+        return {"data": data, "total": total}
+    return {"status": "ok", **await static_cache.get_or_load(f"platforms:{page}:{size}", load, ttl=600, tags=("platforms",))}
 
 @router.get("/audit-logs")
-async def get_audit_logs(page: int = 1, size: int = 15, current_user: dict = Depends(get_current_user)):
+async def get_audit_logs(page: int = 1, size: int = 15, cursor: str = Query(None), approx_total: bool = False, current_user: dict = Depends(get_current_user)):
     query = AuditLog.filter(is_deleted=0)
+    if cursor is not None: # V5.75: keyset 分页
+        return {"status": "ok", **await keyset_page(query, cursor, size, (), ts_field="created_at", approx_total=approx_total)}
     total = await query.count()
     data = await query.order_by("-id").offset((page - 1) * size).limit(size).values()
     return {"status": "ok", "data": data, "total": total}
 
+@router.get("/archive")
+async def query_archive(
+    table: str = Query(...),
+    start: str = Query(...),
+    end: str = Query(...),
+    user_id: int = Query(None),
+    keyword: str = "",
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user)
+):
+    """[冷档审计] V5.84: 检索已归档的历史记录 (仅总部)，start / end 为 YYYY-MM-DD (均含当日)"""
+    if not (current_user.get("role_id") == RoleID.HQ or current_user.get("role_code") == "HQ"):
+        raise HTTPException(status_code=403, detail="越权拦截：冷档审计仅限总部")
+    if table not in POLICIES:
+        raise HTTPException(status_code=400, detail=f"不支持的归档表: {table}")
+    try:
+        start_at = datetime.strptime(start, "%Y-%m-%d")
+        end_at = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) # 开区间上界
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日期格式应为 YYYY-MM-DD")
+    result = await retention.query(table, start_at, end_at, {"user_id": user_id}, keyword, limit)
+    return {"status": "ok", **result}
+
+@router.get("/archive/months")
+async def get_archive_months(table: str = Query(...), current_user: dict = Depends(get_current_user)):
+    if not (current_user.get("role_id") == RoleID.HQ or current_user.get("role_code") == "HQ"):
+        raise HTTPException(status_code=403, detail="越权拦截：冷档审计仅限总部")
+    return {"status": "ok", "data": retention.months(table)}
+
 @router.get("/roles")
-async def get_roles(request: Request, current_user: dict = Depends(get_current_user)):
-    redis = request.app.state.redis
-    cache_key = "cache:static:roles"
-    if redis:
-        cached = await redis.get(cache_key)
-        if cached: return {"status": "ok", "data": json.loads(cached), "source": "tactical_cache"}
-    
-    data = await Role.filter(is_deleted=0).values("id", "name", "code")
-    if redis: await redis.setex(cache_key, 3600, json.dumps(data))
+async def get_roles(current_user: dict = Depends(get_current_user)):
+    data = await static_cache.get_or_load("roles", lambda: Role.filter(is_deleted=0).values("id", "name", "code"), ttl=3600, tags=("roles",))
     return {"status": "ok", "data": data}
 
 @router.get("/permissions")
-async def get_permissions(request: Request, current_user: dict = Depends(get_current_user)):
+async def get_permissions(current_user: dict = Depends(get_current_user)):
     """[物理拉取] 获取全量原子级权限定义清单"""
-    redis = request.app.state.redis
-    cache_key = "cache:static:permissions"
-    if redis:
-        cached = await redis.get(cache_key)
-        if cached: return {"status": "ok", "data": json.loads(cached), "source": "tactical_cache"}
-
-    data = await Permission.filter(is_deleted=0).values("id", "code", "name", "module")
-    if redis: await redis.setex(cache_key, 3600, json.dumps(data))
+    data = await static_cache.get_or_load("permissions", lambda: Permission.filter(is_deleted=0).values("id", "code", "name", "module"), ttl=3600, tags=("permissions",))
     return {"status": "ok", "data": data}
 
 @router.get("/role/permissions")
@@ -387,32 +429,62 @@ async def get_role_permissions(role_id: int, current_user: dict = Depends(get_cu
 async def update_role_permissions(data: dict, request: Request, user: dict = Depends(check_permission("admin:user:update"))):
     role_id, new_perms = data.get("role_id"), data.get("permissions", [])
     redis = request.app.state.redis
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         await RolePermission.filter(role_id=role_id).update(is_deleted=1)
         if new_perms:
             objs = [RolePermission(role_id=role_id, permission_code=p) for p in new_perms]
             await RolePermission.bulk_create(objs, using_db=conn)
         await record_audit(user["real_name"], "RBAC_SYNC", f"RoleID:{role_id}", f"全量重构权责矩阵: {len(new_perms)}项")
+    # V5.71: 令牌载荷携带权限集，改为验签时按角色当前权限集覆盖 (不作废该角色下全部用户的令牌)
+    await token_cache.set_role_permissions(role_id, new_perms)
     if redis:
         role = await Role.get_or_none(id=role_id)
         await redis.set(f"cache:role_perms:{role.code if role else 'UNKNOWN'}", json.dumps(new_perms))
-        # 关键：清除全量权限缓存
-        await redis.delete("cache:static:permissions")
+    # 关键：清除全量权限缓存
+    await static_cache.invalidate("permissions")
     return {"status": "ok"}
 
 @router.get("/notifications")
-async def get_notifications(page: int = 1, size: int = 10, search: str = "", current_user: dict = Depends(get_current_user)):
+async def get_notifications(page: int = 1, size: int = 10, search: str = "", cursor: str = Query(None), approx_total: bool = False, current_user: dict = Depends(get_current_user)):
+    """[通知中心] V5.81: 仅返回对当前用户可见的通知，is_read 按本人已读水位计算"""
     offset = (page - 1) * size
-    query = Notification.filter(is_deleted=0)
+    query = notification_center.visibility_filter(Notification.filter(is_deleted=0), current_user)
     if search:
         query = query.filter(Q(title__icontains=search) | Q(content__icontains=search))
-    total = await query.count()
-    data = await query.order_by("-created_at").limit(size).offset(offset).values()
-    return {"status": "ok", "data": data, "total": total}
+    if cursor is not None: # V5.75: keyset 分页
+        result = await keyset_page(query, cursor, size, (), ts_field="created_at", approx_total=approx_total)
+        data, extra = result.pop("data"), result
+    else:
+        extra = {"total": await query.count()}
+        data = await query.order_by("-created_at").limit(size).offset(offset).values()
+
+    mark, read_ids = await notification_center.read_state(current_user.get("id"))
+    for n in data:
+        if n["seq"] is not None: n["is_read"] = int(n["seq"] <= mark or n["seq"] in read_ids)
+    return {"status": "ok", "data": data, **extra}
+
+@router.get("/notifications/unread")
+async def get_unread_count(current_user: dict = Depends(get_current_user)):
+    """[角标轮询] 未读数由 Redis 统计，不访问 MySQL (Redis 不可用时回源旧版全局已读标记)"""
+    unread = await notification_center.unread(current_user)
+    if unread is None:
+        # 带序号的通知已读状态只记录在 Redis (is_read 恒为 0)，回源时仅统计旧版全局通知
+        unread = await notification_center.visibility_filter(Notification.filter(is_deleted=0, is_read=0, seq__isnull=True), current_user).count()
+    return {"status": "ok", "data": {"unread": unread}}
 
 @router.post("/notifications/read")
 async def mark_notification_read(data: dict, user: dict = Depends(get_current_user)):
+    """V5.81: 已读状态按用户记录在 Redis，不再改写通知行 (无序号的历史通知沿用旧版全局标记)"""
     notif_id = data.get("id")
-    if notif_id == "ALL": await Notification.filter(is_read=0).update(is_read=1)
-    else: await Notification.filter(id=notif_id).update(is_read=1)
+    if notif_id == "ALL":
+        await Notification.filter(seq__isnull=True, is_read=0).update(is_read=1) # 历史通知沿用全局标记
+        if not await notification_center.mark_all_read(user.get("id")):
+            return {"status": "error", "message": "已读状态服务暂不可用，请稍后重试"}
+        return {"status": "ok"}
+    n = await Notification.get_or_none(id=notif_id).values("seq")
+    if not n: return {"status": "error", "message": "通知不存在"}
+    if n["seq"] is None:
+        await Notification.filter(id=notif_id).update(is_read=1)
+    elif not await notification_center.mark_read(user.get("id"), n["seq"]):
+        return {"status": "error", "message": "已读状态服务暂不可用，请稍后重试"}
     return {"status": "ok"}
\ No newline at end of file
@@ -1,15 +1,16 @@
 from fastapi import APIRouter, Depends, Request, Query, HTTPException
 from core.models import SensitiveWord, KnowledgeBase, PolicyCategory, AuditLog, CustomerSentiment, DeptSensitiveWord, DeptComplianceLog, VoiceAlert, BusinessSOP, Department
 from api.auth import get_current_user, check_permission
-from tortoise.transactions import in_transaction
 from tortoise.expressions import Q
+from core.word_dict import word_dict
+from core.knowledge import knowledge_matcher
+from utils.pagination import keyset_page
+from utils.cache import static_cache
+from core.audit import record_audit, audited_transaction
 import json
 
 router = APIRouter(prefix="/api/ai", tags=["AI Policy"])
 
-async def record_audit(operator: str, action: str, target: str, details: str):
-    await AuditLog.create(operator=operator, action=action, target=target, details=details)
-
 from fastapi import APIRouter, Depends, Request, Query, HTTPException, UploadFile, File
 import shutil, os, uuid
 # ... (保持原有导入)
@@ -71,7 +72,7 @@ async def save_voice_alert(data: dict, user: dict = Depends(check_permission("ad
     if item_id and "admin:voice:update" not in user.get("permissions", []):
         raise HTTPException(status_code=403, detail="越权拦截：缺失语音更新权限")
 
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         if item_id:
             v_old = await VoiceAlert.get_or_none(id=item_id)
             if not v_old: return {"status": "error", "message": "语音节点不存在"}
@@ -95,7 +96,7 @@ async def delete_voice_alert(data: dict, user: dict = Depends(check_permission("
     item_id = data.get("id")
     dept_id = user.get("dept_id")
     
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         v = await VoiceAlert.get_or_none(id=item_id)
         if not v: return {"status": "error", "message": "语音项不存在"}
         
@@ -155,7 +156,7 @@ async def save_sop(data: dict, user: dict = Depends(check_permission("admin:sop:
         "department_id": dept_id
     }
 
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         if item_id:
             s_old = await BusinessSOP.get_or_none(id=item_id)
             if not s_old: return {"status": "error", "message": "SOP 节点不存在"}
@@ -174,7 +175,7 @@ async def delete_sop(data: dict, user: dict = Depends(check_permission("admin:so
     item_id = data.get("id")
     dept_id = user.get("dept_id")
     
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         s = await BusinessSOP.get_or_none(id=item_id)
         if not s: return {"status": "error", "message": "SOP 不存在"}
         
@@ -191,7 +192,7 @@ async def get_sentiments(current_user: dict = Depends(get_current_user)):
     """[物理拉取] 获取动态客户情绪标签集 - 降级鉴权以确保实战稳定性"""
     try:
         print(f"📡 [SENTIMENT] 用户 {current_user.get('username')} 发起数据请求")
-        data = await CustomerSentiment.filter(is_deleted=0).order_by("id").values()
+        data = await static_cache.get_or_load("sentiments", lambda: CustomerSentiment.filter(is_deleted=0).order_by("id").values(), ttl=600, tags=("sentiments",))
         print(f"✅ [SENTIMENT] 成功返回 {len(data)} 条维度数据")
         return {"status": "ok", "data": data}
     except Exception as e:
@@ -238,39 +239,45 @@ async def save_dept_word(data: dict, user: dict = Depends(check_permission("admi
         "department_id": target_dept_id
     }
 
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         if item_id: await DeptSensitiveWord.filter(id=item_id).update(**payload)
         else: await DeptSensitiveWord.create(**payload)
         await record_audit(user["real_name"], "DEPT_WORD_SAVE", data.get("word"), "更新部门合规词库")
+    await word_dict.invalidate()
     return {"status": "ok"}
 
 @router.post("/dept-words/delete")
 async def delete_dept_word(data: dict, user: dict = Depends(check_permission("admin:dept_word:delete"))):
     item_id = data.get("id")
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         await DeptSensitiveWord.filter(id=item_id).update(is_deleted=1)
         await record_audit(user["real_name"], "DEPT_WORD_DELETE", f"ID:{item_id}", "移除部门合规词")
+    await word_dict.invalidate()
     return {"status": "ok"}
 
 @router.get("/compliance-logs")
-async def get_compliance_logs(page: int = 1, size: int = 15, current_user: dict = Depends(check_permission("audit:dept:log:view"))):
+async def get_compliance_logs(page: int = 1, size: int = 15, cursor: str = Query(None), approx_total: bool = False, current_user: dict = Depends(check_permission("audit:dept:log:view"))):
     query = DeptComplianceLog.filter()
     if current_user.get("role_id") != 3:
         query = query.filter(department_id=current_user.get("dept_id"))
     
+    fields = ("id", "word", "context", "timestamp", "user__real_name", "department__name")
+    if cursor is not None: # V5.75: keyset 分页
+        return {"status": "ok", **await keyset_page(query.select_related("user", "department"), cursor, size, fields, approx_total=approx_total)}
+
     total = await query.count()
-    data = await query.select_related("user", "department").offset((page - 1) * size).limit(size).order_by("-timestamp").values(
-        "id", "word", "context", "timestamp", "user__real_name", "department__name"
-    )
+    data = await query.select_related("user", "department").offset((page - 1) * size).limit(size).order_by("-timestamp").values(*fields)
     return {"status": "ok", "data": data, "total": total}
 
 @router.get("/categories")
 async def get_categories(page: int = 1, size: int = 10, type: str = None, current_user: dict = Depends(check_permission("admin:cat:view"))):
-    query = PolicyCategory.filter(is_deleted=0)
-    if type: query = query.filter(type=type)
-    total = await query.count()
-    data = await query.offset((page - 1) * size).limit(size).order_by("-id").values()
-    return {"status": "ok", "data": data, "total": total}
+    async def load():
+        query = PolicyCategory.filter(is_deleted=0)
+        if type: query = query.filter(type=type)
+        total = await query.count()
+        data = await query.offset((page - 1) * size).limit(size).order_by("-id").values()
+        return {"data": data, "total": total}
+    return {"status": "ok", **await static_cache.get_or_load(f"categories:{type or '*'}:{page}:{size}", load, ttl=600, tags=("categories",))}
 
 @router.post("/categories")
 async def save_category(data: dict, user: dict = Depends(check_permission("admin:cat:create"))):
@@ -279,18 +286,20 @@ async def save_category(data: dict, user: dict = Depends(check_permission("admin
         raise HTTPException(status_code=403, detail="权限熔断：缺失分类更新权限")
         
     payload = {"name": data.get("name"), "type": data.get("type"), "description": data.get("description")}
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         if cat_id: await PolicyCategory.filter(id=cat_id).update(**payload)
         else: await PolicyCategory.create(**payload)
         await record_audit(user["real_name"], "CAT_SAVE", data.get("name"), "固化策略分类节点")
+    await static_cache.invalidate("categories")
     return {"status": "ok"}
 
 @router.post("/categories/delete")
 async def delete_category(data: dict, user: dict = Depends(check_permission("admin:cat:delete"))):
     cat_id = data.get("id")
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         await PolicyCategory.filter(id=cat_id).update(is_deleted=1)
         await record_audit(user["real_name"], "CAT_DELETE", f"ID:{cat_id}", "注销策略分类")
+    await static_cache.invalidate("categories")
     return {"status": "ok"}
 
 @router.get("/sensitive-words")
@@ -309,29 +318,23 @@ async def save_sensitive_word(data: dict, request: Request, user: dict = Depends
         raise HTTPException(status_code=403, detail="权限熔断：缺失策略更新权限")
 
     payload = {"word": data.get("word"), "category_id": data.get("category_id"), "risk_level": data.get("risk_level", 5)}
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         if word_id: await SensitiveWord.filter(id=word_id).update(**payload)
         else: await SensitiveWord.create(**payload)
         
-        redis = request.app.state.redis
-        if redis:
-            all_words = await SensitiveWord.filter(is_active=1, is_deleted=0).values("word", "risk_level")
-            await redis.set("cache:sensitive_words", json.dumps(all_words))
         await record_audit(user["real_name"], "WORD_SAVE", data.get("word"), "更新全域敏感词库")
+    await word_dict.invalidate()
     return {"status": "ok"}
 
 @router.post("/sensitive-words/delete")
 async def delete_sensitive_word(data: dict, request: Request, user: dict = Depends(check_permission("admin:ai:delete"))):
     w_id = data.get("id")
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         w = await SensitiveWord.get(id=w_id)
         await SensitiveWord.filter(id=w_id).update(is_deleted=1)
         
-        redis = request.app.state.redis
-        if redis:
-            all_words = await SensitiveWord.filter(is_active=1, is_deleted=0).values("word", "risk_level")
-            await redis.set("cache:sensitive_words", json.dumps(all_words))
         await record_audit(user["real_name"], "WORD_DELETE", w.word, "注销全域敏感词")
+    await word_dict.invalidate()
     return {"status": "ok"}
 
 @router.get("/knowledge-base")
@@ -378,7 +381,7 @@ async def delete_knowledge_item(data: dict, request: Request, user: dict = Depen
     role_id = user.get("role_id")
     dept_id = user.get("dept_id")
     
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         k = await KnowledgeBase.get_or_none(id=item_id)
         if not k: return {"status": "error", "message": "话术不存在"}
         
@@ -386,12 +389,8 @@ async def delete_knowledge_item(data: dict, request: Request, user: dict = Depen
             raise HTTPException(status_code=403, detail="越权拦截：严禁删除非本部门或全局话术")
 
         await KnowledgeBase.filter(id=item_id).update(is_deleted=1)
-        
-        redis = request.app.state.redis
-        if redis:
-            kb_data = await KnowledgeBase.filter(is_active=1, is_deleted=0).values("keyword", "answer")
-            await redis.set("cache:knowledge_base", json.dumps(kb_data))
         await record_audit(user["real_name"], "KB_DELETE", k.keyword, "注销智能话术节点")
+    await knowledge_matcher.invalidate()
     return {"status": "ok"}
 
 @router.post("/knowledge-base")
@@ -414,7 +413,7 @@ async def save_knowledge_item(data: dict, request: Request, user: dict = Depends
         "department_id": target_dept_id
     }
 
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         if item_id: 
             k_old = await KnowledgeBase.get_or_none(id=item_id)
             if role_id != 3 and k_old and k_old.department_id != dept_id:
@@ -422,11 +421,7 @@ async def save_knowledge_item(data: dict, request: Request, user: dict = Depends
             await KnowledgeBase.filter(id=item_id).update(**payload)
         else: 
             await KnowledgeBase.create(**payload)
-
-        redis = request.app.state.redis
-        if redis:
-            kb_data = await KnowledgeBase.filter(is_active=1, is_deleted=0).values("keyword", "answer")
-            await redis.set("cache:knowledge_base", json.dumps(kb_data))
         await record_audit(user["real_name"], "KB_SAVE", data.get("keyword"), "固化智能话术矩阵")
+    await knowledge_matcher.invalidate()
 
     return {"status": "ok"}
\ No newline at end of file
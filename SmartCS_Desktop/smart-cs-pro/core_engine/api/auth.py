@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from core.models import User, Role, RolePermission, AuditLog
-import hashlib, secrets, json, logging, traceback, jwt, os
+from core.models import User, Role, RolePermission
+from core.audit import record_audit
+from core.revocation import revocations
+from core.token_cache import token_cache, TokenRevoked
+import hashlib, secrets, json, time, logging, traceback, jwt, os
 from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/api/auth", tags=["Auth"])
@@ -15,40 +18,39 @@ JWT_ALGORITHM = "HS256"
 def get_hash(p: str, s: str):
     return hashlib.sha256((p + s).encode()).hexdigest()
 
+def _ensure_not_revoked(username: str):
+    if revocations.is_revoked(username):
+        logger.warning(f"🚫 [物理拦截] 处于黑名单的用户尝试访问: {username}")
+        raise HTTPException(status_code=401, detail="您的战术链路已被指挥部物理切断")
+
 async def get_current_user(request: Request, creds: HTTPAuthorizationCredentials = Depends(security)):
     token = creds.credentials
     try:
-        # 1. 物理校验 JWT 签名
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        
-        # 2. V5.20: 引入黑名单拦截 (物理撤回权)
-        redis = request.app.state.redis
-        if redis:
-            is_blocked = await redis.get(f"blacklist:{payload['username']}")
-            if is_blocked:
-                logger.warning(f"🚫 [物理拦截] 处于 Redis 黑名单的用户尝试访问: {payload['username']}")
-                raise HTTPException(status_code=401, detail="您的战术链路已被指挥部物理切断")
+        # 1. 物理校验 JWT 签名 (V5.71: 命中验签缓存时跳过 HMAC 与解析)
+        payload = token_cache.verify(token, JWT_SECRET, JWT_ALGORITHM)
         
-        # V5.42: 数据库兜底校验 (防止 Redis 重启后同步间隙)
-        from tortoise import Tortoise
-        conn = Tortoise.get_connection("default")
-        sql = "SELECT id FROM blacklist WHERE username = %s AND expired_at > NOW() LIMIT 1"
-        res = await conn.execute_query_dict(sql, [payload['username']])
-        if res:
-            logger.warning(f"🚫 [物理拦截] 处于 DB 黑名单的用户尝试访问: {payload['username']}")
-            if redis: await redis.setex(f"blacklist:{payload['username']}", 3600, "1") # 自动同步回缓存
-            raise HTTPException(status_code=401, detail="战术封禁中，禁止建立链路")
+        # 2. V5.20: 黑名单拦截 (物理撤回权)
+        # V5.70: 改为进程内封禁表判定，MySQL 仅在启动与定时对账时读取
+        _ensure_not_revoked(payload["username"])
                 
         return payload
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         logger.warning(f"🚨 [鉴权失效] 令牌已过期")
         raise HTTPException(status_code=401, detail="令牌已过期")
+    except TokenRevoked:
+        logger.warning(f"🚨 [鉴权失效] 令牌已被撤销: {token[:10]}...")
+        raise HTTPException(status_code=401, detail="令牌已被撤销，请重新登录")
     except jwt.InvalidTokenError:
         # 为了兼容性，尝试在 Redis 中找旧版 token (过渡期)
         redis = request.app.state.redis
         if redis:
             cached = await redis.get(f"token:{token}")
-            if cached: return json.loads(cached)
+            if cached:
+                payload = json.loads(cached)
+                _ensure_not_revoked(payload.get("username"))
+                return payload
         
         logger.warning(f"🚨 [鉴权失败] 无效令牌: {token[:10]}...")
         raise HTTPException(status_code=401, detail="身份凭证无效")
@@ -94,6 +96,7 @@ async def login(data: dict, request: Request):
             "dept_id": dept_id,
             "dept_name": dept_name,
             "permissions": perms,
+            "iat": time.time(), # V5.71: 签发时间 (保留小数，与撤销纪元同精度)，用于按撤销纪元批量作废
             "exp": datetime.utcnow() + timedelta(days=7) # 延长有效期至 7 天
         }
         
@@ -103,7 +106,7 @@ async def login(data: dict, request: Request):
         if redis: 
             # 记录活跃映射（用于统计，但不作为鉴权唯一依据）
             await redis.setex(f"active_token:{user.username}", 3600 * 24 * 7, token)
-            await AuditLog.create(operator=user.real_name or user.username, action="LOGIN", target=user.username, details="JWT 链路建立成功")
+            await record_audit(user.real_name or user.username, "LOGIN", user.username, "JWT 链路建立成功")
 
         return {
             "status": "ok", 
@@ -152,12 +155,7 @@ async def logout(request: Request, user_info: dict = Depends(get_current_user)):
             token = auth_header.split(" ")[1]
             await redis.delete(f"token:{token}")
             await redis.delete(f"active_token:{user_info['username']}")
-            await AuditLog.create(
-                operator=user_info.get("real_name", user_info["username"]),
-                action="LOGOUT",
-                target=user_info["username"],
-                details="操作员主动销毁令牌"
-            )
+            await record_audit(user_info.get("real_name", user_info["username"]), "LOGOUT", user_info["username"], "操作员主动销毁令牌")
     return {"status": "ok"}
 
 @router.get("/me")
@@ -1,42 +1,41 @@
-from fastapi import APIRouter, Request
-from core.models import KnowledgeBase
-from tortoise.expressions import Q
-import json
+from fastapi import APIRouter, Query, Depends
+from api.auth import get_current_user
+from core.constants import RoleID
+from core.knowledge import knowledge_matcher
 
 router = APIRouter(prefix="/api/coach", tags=["Coach"])
 
 @router.get("/advice")
-async def get_coach_advice(request: Request, customer_msg: str):
+async def get_coach_advice(customer_msg: str, dept_id: int = Query(None), limit: int = Query(3, ge=1, le=10),
+                           current_user: dict = Depends(get_current_user)):
     """
-    [ORM + Cache 版] 动态知识库检索
+    [自动机版] 动态知识库检索：单次扫描命中 全局 + 本部门 话术，按相关度排序
+    data 为最佳命中 (兼容旧版单条结构)，matches 为排序后的全部候选
+    部门取自令牌 (部门私有话术不对外部门开放)，仅总部可通过 dept_id 指定部门
     """
-    redis = request.app.state.redis
-    kb_items = None
-    
-    # 1. 尝试从缓存获取
-    if redis:
-        cached = await redis.get("cache:knowledge_base")
-        if cached:
-            kb_items = json.loads(cached)
+    if not (current_user.get("role_id") == RoleID.HQ or current_user.get("role_code") == "HQ") or dept_id is None:
+        dept_id = current_user.get("dept_id") or None
+    await knowledge_matcher.ensure_ready()
+    hits = knowledge_matcher.match(customer_msg, dept_id, limit)
+    if not hits:
+        return {"status": "ok", "data": None, "matches": []}
 
-    # 2. 缓存未命中则查库
-    if kb_items is None:
-        kb_items_obj = await KnowledgeBase.filter(is_active=1, is_deleted=0).all().values("keyword", "answer", "category")
-        kb_items = kb_items_obj
-        if redis:
-            await redis.setex("cache:knowledge_base", 600, json.dumps(kb_items))
-    
-    # 3. 在内存中进行关键词匹配
-    for item in kb_items:
-        if item["keyword"] in customer_msg:
-            return {
-                "status": "ok",
-                "data": {
-                    "type": "COACH_ADVICE",
-                    "title": f"带教指引：{item['category']}",
-                    "content": item["answer"],
-                    "voice_alert": "检测到相关业务咨询，已调取标准战术话术。"
-                }
-            }
-    
-    return {"status": "ok", "data": None}
\ No newline at end of file
+    matches = [{
+        "id": h["id"],
+        "keyword": h["keyword"],
+        "category": h["category__name"] or "未分类",
+        "content": h["answer"],
+        "scope": "DEPT" if h["department_id"] else "GLOBAL",
+        "hits": h["hits"]
+    } for h in hits]
+    best = matches[0]
+    return {
+        "status": "ok",
+        "data": {
+            "type": "COACH_ADVICE",
+            "title": f"带教指引：{best['category']}",
+            "content": best["content"],
+            "voice_alert": "检测到相关业务咨询，已调取标准战术话术。"
+        },
+        "matches": matches
+    }
@@ -1,12 +1,12 @@
 from fastapi import APIRouter
-from core.models import User, Role, AuditLog
-from tortoise.transactions import in_transaction
+from core.models import User, Role
+from core.session import sessions
+from core.token_cache import token_cache
+from core.roster import roster
+from core.audit import record_audit, audited_transaction
 
 router = APIRouter(prefix="/api/hq", tags=["RBAC"])
 
-async def record_audit(operator: str, action: str, target: str, details: str):
-    await AuditLog.create(operator=operator, action=action, target=target, details=details)
-
 @router.post("/user/update-role")
 async def update_user_role(data: dict):
     # ... 原有校验逻辑
@@ -21,9 +21,13 @@ async def update_user_role(data: dict):
 
     old_role_id = user.role_id
     user.role_id = new_role_id
-    async with in_transaction() as conn:
+    async with audited_transaction() as conn:
         await user.save(using_db=conn)
         # 强制审计：记录角色变更
         await record_audit("SYSTEM_HQ", "ROLE_CHANGE", target_username, f"权重重校: ID {old_role_id} -> {new_role_id} ({role.name})")
+    await sessions.refresh(target_username)
+    # V5.71: 令牌载荷携带角色与权限集，角色变更后作废旧令牌
+    await token_cache.bump([target_username])
+    await roster.invalidate(user.department_id)
     
     return {"status": "ok", "message": "角色权重已更新"}
\ No newline at end of file
@@ -1,12 +1,65 @@
 from fastapi import APIRouter, Depends, Query, Request
-from core.models import ViolationRecord, User, SensitiveWord
+from core.models import ViolationRecord, ViolationRollup, User, SensitiveWord
 from api.auth import get_current_user
-from core.constants import RoleID
+from core.constants import RoleID, RiskBucket
 from tortoise.expressions import Q
-import json
+from utils.pagination import keyset_page
+from pypika_tortoise.terms import Term, ValueWrapper
+from pypika_tortoise.utils import format_alias_sql
+from tortoise.functions import Sum
+from datetime import date, timedelta
+from tortoise import Tortoise
+from core.pinyin_index import pinyin_index
+import json, re, time
 
 router = APIRouter(prefix="/api/admin", tags=["Violation"])
 
+# V5.76: 全文检索 (FULLTEXT ngram 索引，见 migrate_v8.py)；索引不存在时回退 icontains
+FULLTEXT_INDEX = "ft_violation_text"
+_BOOLEAN_OPERATORS = re.compile(r"[\\'\"+\-<>()~*@%]")
+_fulltext_state = {"ready": False, "checked_at": 0.0}
+
+async def fulltext_available() -> bool:
+    """探测 FULLTEXT 索引是否已建立 (结果缓存 5 分钟，迁移后无需重启)"""
+    if time.time() - _fulltext_state["checked_at"] > 300:
+        try:
+            conn = Tortoise.get_connection("default")
+            rows = await conn.execute_query_dict(
+                "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'violation_records' AND INDEX_NAME = %s LIMIT 1",
+                [FULLTEXT_INDEX]
+            )
+            _fulltext_state["ready"] = bool(rows)
+        except Exception:
+            _fulltext_state["ready"] = False
+        _fulltext_state["checked_at"] = time.time()
+    return _fulltext_state["ready"]
+
+class _FulltextMatch(Term):
+    """MATCH(...) AGAINST (? IN BOOLEAN MODE)：检索短语经 ValueWrapper 作为绑定参数传入，不拼接进 SQL"""
+
+    def __init__(self, phrase: str):
+        super().__init__()
+        self.phrase = ValueWrapper(phrase)
+
+    def get_sql(self, ctx) -> str:
+        sql = f"MATCH(`violation_records`.`context`, `violation_records`.`keyword`, `violation_records`.`solution`) AGAINST ({self.phrase.get_sql(ctx)} IN BOOLEAN MODE)"
+        return format_alias_sql(sql, self.alias, ctx) if ctx.with_alias else sql
+
+def _filter_text(query, text: str, fulltext: bool):
+    """关键词检索：FULLTEXT 可用时在 context / keyword / solution 上做短语匹配，否则回退关键词 icontains"""
+    term = " ".join(_BOOLEAN_OPERATORS.sub(" ", text).split())
+    if not fulltext or len(term) < 2: # ngram 默认 2 字切分，单字无法命中索引
+        return query.filter(keyword__icontains=text)
+    # 去除布尔运算符只为保证短语语义 (引号内整体匹配)，检索词本身以参数绑定
+    return query.annotate(ft_score=_FulltextMatch(f'"{term}"')).filter(ft_score__gt=0)
+
+def _filter_user(query, username: str):
+    """按人检索：拼音索引命中时转为 user_id IN (...)，避免关联表前置通配 LIKE；否则回退 icontains"""
+    ids = pinyin_index.match_ids(username)
+    if ids is not None:
+        return query.filter(user_id__in=ids)
+    return query.filter(Q(user__username__icontains=username) | Q(user__real_name__icontains=username))
+
 @router.get("/violations")
 async def get_violations(
     request: Request,
@@ -17,7 +70,9 @@ async def get_violations(
     status: str = Query(None),
     risk_level: str = Query("ALL"),
     page: int = 1,
-    size: int = 20
+    size: int = 20,
+    cursor: str = Query(None), # V5.75: 传入游标 (首页为空串) 切换为 keyset 分页
+    approx_total: bool = False
 ):
     """
     [实战审计] 违规记录隔离：主管锁定部门，总部全域穿透，坐席强制自看 (RESOLVED 状态允许全域战术共享)
@@ -33,36 +88,68 @@ async def get_violations(
             # 战术共享：允许坐席检索全域已解决的方案作为“战术对策”
             pass
         else:
-            # 坐席身份：强制锁定本人 username
-            query = query.filter(user__username=current_user["username"])
+            # 坐席身份：强制锁定本人 (V5.76: 按 user_id 过滤以命中 (user_id, timestamp) 索引)
+            if current_user.get("id"): query = query.filter(user_id=current_user["id"])
+            else: query = query.filter(user__username=current_user["username"])
     elif role_id == RoleID.ADMIN or role_code == "ADMIN":
         # 主管身份：锁定本部门
         query = query.filter(user__department_id=current_user["dept_id"])
         if username: # 主管可在部门内搜人
-            query = query.filter(Q(user__username__icontains=username) | Q(user__real_name__icontains=username))
+            query = _filter_user(query, username)
     elif (role_id == RoleID.HQ or role_code == "HQ") and dept_id:
         # 总部身份：全域穿透
         query = query.filter(user__department_id=dept_id)
         if username:
-            query = query.filter(Q(user__username__icontains=username) | Q(user__real_name__icontains=username))
+            query = _filter_user(query, username)
     
     if keyword:
-        query = query.filter(keyword__icontains=keyword)
+        query = _filter_text(query, keyword, await fulltext_available())
     if status:
         query = query.filter(status=status)
     
-    if risk_level == "SERIOUS": query = query.filter(risk_score__gte=8)
-    elif risk_level == "MEDIUM": query = query.filter(risk_score__range=(5, 7))
-    elif risk_level == "LOW": query = query.filter(risk_score__lt=5)
+    if risk_level == RiskBucket.SERIOUS: query = query.filter(risk_score__gte=RiskBucket.SERIOUS_MIN)
+    elif risk_level == RiskBucket.MEDIUM: query = query.filter(risk_score__range=(RiskBucket.MEDIUM_MIN, RiskBucket.SERIOUS_MIN - 1))
+    elif risk_level == RiskBucket.LOW: query = query.filter(risk_score__lt=RiskBucket.MEDIUM_MIN)
 
-    total = await query.count()
-    violations = await query.order_by("-timestamp").limit(size).offset((page - 1) * size).values(
+    fields = (
         "id", "keyword", "context", "risk_score", "timestamp", "status", "solution",
         "user__username", "user__real_name", "user__department__name"
     )
+    if cursor is not None:
+        return {"status": "ok", **await keyset_page(query, cursor, size, fields, approx_total=approx_total)}
+
+    total = await query.count()
+    violations = await query.order_by("-timestamp").limit(size).offset((page - 1) * size).values(*fields)
 
     return {"status": "ok", "data": violations, "total": total}
 
+@router.get("/violations/stats")
+async def get_violation_stats(
+    current_user: dict = Depends(get_current_user),
+    days: int = Query(7, ge=1, le=366),
+    dept_id: int = Query(None)
+):
+    """
+    [态势统计] 读取预聚合表 violation_rollups，代价与天数相关而与原始记录量无关
+    返回 按日 × 风险分级 的命中趋势，以及关键词 / 坐席 Top 10；隔离规则与违规检索一致
+    """
+    query = ViolationRollup.filter(day__gte=date.today() - timedelta(days=days - 1))
+    role_id, role_code = current_user.get("role_id"), current_user.get("role_code")
+    if role_id == RoleID.AGENT or role_code == "AGENT":
+        query = query.filter(user_id=current_user.get("id"))
+    elif role_id == RoleID.ADMIN or role_code == "ADMIN":
+        query = query.filter(department_id=current_user["dept_id"] or 0)
+    elif dept_id:
+        query = query.filter(department_id=dept_id)
+
+    trend = await query.annotate(count=Sum("hits"), score=Sum("score_total")).group_by("day", "risk_bucket").order_by("day").values("day", "risk_bucket", "count", "score")
+    keywords = await query.annotate(count=Sum("hits")).group_by("keyword").order_by("-count").limit(10).values("keyword", "count")
+    agents = await query.annotate(count=Sum("hits"), score=Sum("score_total")).group_by("user_id").order_by("-count").limit(10).values("user_id", "count", "score")
+    names = dict(await User.filter(id__in=[a["user_id"] for a in agents]).values_list("id", "real_name")) if agents else {}
+    for a in agents: a["real_name"] = names.get(a["user_id"])
+
+    return {"status": "ok", "data": {"days": days, "trend": trend, "keywords": keywords, "agents": agents}}
+
 @router.post("/violation/resolve")
 async def resolve_violation(
     data: dict,
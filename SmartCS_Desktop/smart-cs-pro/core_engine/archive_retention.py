@@ -0,0 +1,31 @@
+import os
+import sys
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+
+# V5.84: 冷数据归档 - 手动执行一次保留策略 (保留天数见 core/retention.py 中的 RETENTION_*_DAYS)
+# 用法: python archive_retention.py [表名 ...]  (缺省为全部策略表)
+
+async def run_archive(tables: list[str]):
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    from datetime import datetime, timedelta
+    from core.retention import retention, POLICIES, ARCHIVE_DIR
+
+    for table in tables or list(POLICIES):
+        if table not in POLICIES:
+            print(f"  ⏭️ [归档] 未配置保留策略的表: {table}")
+            continue
+        days = POLICIES[table][2]
+        count = await retention.archive_table(table, datetime.now() - timedelta(days=days))
+        print(f"  ✅ [归档] {table}: {count} 行 (保留 {days} 天)")
+
+    print(f"✅ [冷数据归档] 完成，冷档目录: {ARCHIVE_DIR}")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_archive(sys.argv[1:]))
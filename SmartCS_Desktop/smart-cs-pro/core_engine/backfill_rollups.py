@@ -0,0 +1,51 @@
+import os
+import sys
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+from migrate_v11 import CREATE_SQL
+
+# V5.77: 违规聚合回填 - 由历史 violation_records 重建 violation_rollups
+# 用法: python backfill_rollups.py [起始日期 YYYY-MM-DD]  (缺省为全量重建)
+# 注意：回填区间内的聚合会先清空再重建；请在落库管线低峰期执行，避免与实时累加交错
+
+async def run_backfill(since: str = None):
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    from core.constants import RiskBucket
+    from tortoise.transactions import in_transaction
+
+    conn = Tortoise.get_connection("default")
+    await conn.execute_script(CREATE_SQL)
+
+    where, params = "v.is_deleted = 0", [RiskBucket.SERIOUS_MIN, RiskBucket.SERIOUS, RiskBucket.MEDIUM_MIN, RiskBucket.MEDIUM, RiskBucket.LOW]
+    if since:
+        where += " AND v.timestamp >= %s"
+        params.append(since)
+
+    async with in_transaction() as tx:
+        if since:
+            await tx.execute_query("DELETE FROM violation_rollups WHERE day >= %s", [since])
+        else:
+            await tx.execute_query("DELETE FROM violation_rollups")
+        # 部门取坐席当前所属部门 (实时累加取命中时刻的会话部门)
+        await tx.execute_query(f"""
+            INSERT INTO violation_rollups (day, department_id, user_id, risk_bucket, keyword, hits, score_total, is_deleted)
+            SELECT DATE(v.timestamp), COALESCE(u.department_id, 0), v.user_id,
+                   CASE WHEN v.risk_score >= %s THEN %s WHEN v.risk_score >= %s THEN %s ELSE %s END,
+                   v.keyword, COUNT(*), SUM(v.risk_score), 0
+            FROM violation_records v JOIN users u ON u.id = v.user_id
+            WHERE {where}
+            GROUP BY DATE(v.timestamp), COALESCE(u.department_id, 0), v.user_id,
+                     CASE WHEN v.risk_score >= %s THEN %s WHEN v.risk_score >= %s THEN %s ELSE %s END, v.keyword
+        """, params + params[:5])
+
+    rows = await conn.execute_query_dict("SELECT COUNT(*) AS n, COALESCE(SUM(hits), 0) AS hits FROM violation_rollups")
+    print(f"✅ [违规聚合] 回填完成: {rows[0]['n']} 个聚合桶，覆盖 {rows[0]['hits']} 条违规记录")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_backfill(sys.argv[1] if len(sys.argv) > 1 else None))
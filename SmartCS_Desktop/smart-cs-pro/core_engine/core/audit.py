@@ -0,0 +1,131 @@
+import os, time, asyncio, logging
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+from tortoise import Tortoise, timezone
+from tortoise.transactions import in_transaction
+from core.models import AuditLog
+
+logger = logging.getLogger("SmartCS")
+
+# 当前 audited_transaction 内暂存的审计 (事务提交后才入队)
+_deferred: ContextVar[Optional[list]] = ContextVar("audit_deferred", default=None)
+
+
+class AuditSink:
+    """
+    [审计缓冲] 审计足迹先进入内存缓冲，由后台任务按 条数 / 时间 阈值以一次 bulk_create 批量落库
+    请求只做入队，不再为每条审计单独往返 MySQL；进程退出时由 lifespan 排空缓冲
+    审计时间取入队时刻；缓冲超过上限时丢弃最旧记录并计数
+    批量落库失败时先探测数据库：不可达则整批放回等待重试；可达则逐条写入，只丢弃无法落库的记录 (如字段超长)
+    """
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("AUDIT_FLUSH_SIZE", 200))
+        self.interval = float(os.getenv("AUDIT_FLUSH_INTERVAL", 2))
+        self.limit = int(os.getenv("AUDIT_BUFFER_LIMIT", 10000))
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 运行指标
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    def record(self, operator: str, action: str, target: Optional[str], details: str):
+        if len(self._buffer) >= self.limit:
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append((operator, action, target, details, timezone.now()))
+        if len(self._buffer) >= self.batch_size: self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🧾 [审计缓冲] 已启动: 每 {self.interval:g}s 或 {self.batch_size} 条批量落库")
+
+    async def stop(self):
+        if self._task is None: return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        while self._buffer and await self.flush(): pass
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer and await self.flush(): pass
+
+    async def flush(self) -> bool:
+        """落库一批 (至多 batch_size 条)；数据库不可达时放回缓冲头部等待下次重试，返回是否成功"""
+        if not self._buffer: return True
+        batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        started = time.perf_counter()
+        try:
+            await AuditLog.bulk_create([
+                AuditLog(operator=op, action=action, target=target, details=details, created_at=ts)
+                for op, action, target, details, ts in batch
+            ])
+        except Exception as e:
+            self.failures += 1
+            try:
+                await Tortoise.get_connection("default").execute_query("SELECT 1")
+            except Exception:
+                self._buffer.extendleft(reversed(batch))
+                logger.error(f"❌ [审计缓冲] 批量落库失败 ({len(batch)} 条)，数据库不可达，等待重试: {e}")
+                return False
+            logger.error(f"⚠️ [审计缓冲] 批量落库失败 ({len(batch)} 条)，转为逐条写入: {e}")
+            await self._flush_rows(batch)
+        else:
+            self.flushed += len(batch)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        return True
+
+    async def _flush_rows(self, batch: list):
+        for op, action, target, details, ts in batch:
+            try:
+                await AuditLog.create(operator=op, action=action, target=target, details=details, created_at=ts)
+                self.flushed += 1
+            except Exception as e:
+                self.dropped += 1
+                logger.error(f"🗑️ [审计缓冲] 审计记录无法落库，已丢弃: {op} {action} {target!r} ({e})")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._buffer),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "last_flush_ms": round(self.last_flush_ms, 1)
+        }
+
+
+audit_sink = AuditSink()
+
+
+async def record_audit(operator: str, action: str, target: str, details: str):
+    """[物理审计] 记录操作足迹 (入队即返回，由 audit_sink 批量落库)；在 audited_transaction 内调用时待事务提交后再入队"""
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred.append((operator, action, target, details))
+    else:
+        audit_sink.record(operator, action, target, details)
+
+
+@asynccontextmanager
+async def audited_transaction():
+    """in_transaction 的审计版本：块内记录的审计仅在事务成功提交后入队，回滚时一并丢弃"""
+    deferred = []
+    token = _deferred.set(deferred)
+    try:
+        async with in_transaction() as conn:
+            yield conn
+    finally:
+        _deferred.reset(token)
+    for entry in deferred: audit_sink.record(*entry)
@@ -0,0 +1,75 @@
+import os, socket, secrets, logging
+from typing import Awaitable, Callable, Optional
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+BUS_CHANNEL = "ws_bus"
+ROUTE_KEY = "ws:route" # username -> 持有该链路的 worker ID
+
+
+class MessageBus:
+    """
+    [跨进程总线] 多 worker / 多主机部署时，通过 Redis Pub/Sub 转发 WS 定向消息与会话事件
+    - 广播类消息发往公共频道 ws_bus，各 worker 在本地按作用域投递
+    - 点对点消息按 ws:route 查到目标所在 worker，只发往该 worker 的专属频道 ws_bus:{worker}
+    所有信封带 origin，worker 忽略自己发出的消息 (本地已直接投递)
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self.enabled = False
+        self._handlers: dict[str, Callable[[dict], Awaitable[None]]] = {}
+
+    @property
+    def worker_channel(self) -> str:
+        return f"{BUS_CHANNEL}:{self.worker_id}"
+
+    def on(self, op: str, handler: Callable[[dict], Awaitable[None]]):
+        self._handlers[op] = handler
+
+    def attach(self):
+        """在 redis_mgr.listen() 启动前调用；WS_BUS=0 时退化为单进程模式"""
+        if os.getenv("WS_BUS", "1") == "0": return
+        redis_mgr.subscribe(BUS_CHANNEL, self._dispatch)
+        redis_mgr.subscribe(self.worker_channel, self._dispatch)
+        self.enabled = True
+        logger.info(f"🛰️ [跨进程总线] 已挂载: {self.worker_id}")
+
+    async def _dispatch(self, envelope: dict):
+        if envelope.get("origin") == self.worker_id: return
+        handler = self._handlers.get(envelope.get("op"))
+        if handler: await handler(envelope)
+
+    async def publish(self, op: str, worker: Optional[str] = None, **fields) -> int:
+        """发往公共频道，或指定 worker 的专属频道；返回收到消息的订阅者数量"""
+        if not self.enabled or not redis_mgr.client: return 0
+        channel = f"{BUS_CHANNEL}:{worker}" if worker else BUS_CHANNEL
+        try:
+            return await redis_mgr.publish(channel, {"op": op, "origin": self.worker_id, **fields})
+        except Exception as e:
+            logger.error(f"⚠️ [跨进程总线] 发布失败 ({op}): {e}")
+            return 0
+
+    # --- 链路路由表 ---
+    async def claim_route(self, username: str):
+        if self.enabled and redis_mgr.client:
+            await redis_mgr.client.hset(ROUTE_KEY, username, self.worker_id)
+
+    async def release_route(self, username: str):
+        client = redis_mgr.client
+        if self.enabled and client and await client.hget(ROUTE_KEY, username) == self.worker_id:
+            await client.hdel(ROUTE_KEY, username)
+
+    async def route_of(self, username: str) -> Optional[str]:
+        if not self.enabled or not redis_mgr.client: return None
+        return await redis_mgr.client.hget(ROUTE_KEY, username)
+
+    async def drop_route(self, username: str, worker: str):
+        """目标 worker 已无订阅者 (进程已退出)，清理残留路由"""
+        client = redis_mgr.client
+        if client and await client.hget(ROUTE_KEY, username) == worker:
+            await client.hdel(ROUTE_KEY, username)
+
+
+bus = MessageBus()
@@ -0,0 +1,439 @@
+import os, json, base64, asyncio, logging
+from collections import deque
+from typing import Optional
+from fastapi import WebSocket
+from core.constants import RoleID
+from core.session import AgentSession
+from core.bus import bus
+from core.events import event_log
+
+logger = logging.getLogger("SmartCS")
+
+# 单链路出站缓冲上限，以及缓冲溢出且写协程停滞多久后判定为慢消费者 (秒)
+OUTBOX_LIMIT = int(os.getenv("WS_OUTBOX_LIMIT", 256))
+SLOW_CONSUMER_TIMEOUT = float(os.getenv("WS_SLOW_CONSUMER_TIMEOUT", 10))
+
+
+def encode_message(message: dict) -> str:
+    """与 WebSocket.send_json 相同的编码方式，广播时只编码一次"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+def _sniff_mime(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff": return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n": return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP": return "image/webp"
+    return "application/octet-stream"
+
+
+class ScreenFrame:
+    """
+    [画面帧] 一帧坐席画面，按需生成两种下行格式 (每帧最多各编码一次，所有观看者共享同一对象)：
+    - 二进制帧: [1 字节用户名长度][用户名 UTF-8][图像字节]，发给已订阅的指挥节点
+    - 旧版 JSON: {"type": "SCREEN_SYNC", "username", "payload": dataURL}，发给尚未启用订阅的旧客户端
+    """
+    __slots__ = ("username", "_image", "_data_url", "_binary", "_legacy")
+
+    def __init__(self, username: str, image: Optional[bytes] = None, data_url: Optional[str] = None):
+        self.username = username
+        self._image = image
+        self._data_url = data_url
+        self._binary = None
+        self._legacy = None
+
+    def binary(self):
+        if self._binary is None:
+            image = self._image
+            if image is None and self._data_url and ";base64," in self._data_url:
+                try:
+                    image = base64.b64decode(self._data_url.split(";base64,", 1)[1])
+                except ValueError:
+                    image = None
+            if image is None:
+                self._binary = self.legacy() # 无法解码的旧版载荷原样转发
+            else:
+                name = self.username.encode("utf-8")[:255]
+                self._binary = bytes([len(name)]) + name + image
+        return self._binary
+
+    def legacy(self) -> str:
+        if self._legacy is None:
+            payload = self._data_url
+            if payload is None:
+                payload = f"data:{_sniff_mime(self._image)};base64,{base64.b64encode(self._image).decode()}"
+            self._legacy = encode_message({"type": "SCREEN_SYNC", "username": self.username, "payload": payload})
+        return self._legacy
+
+
+class ClientLink:
+    """
+    [单节点链路] 一个 WS 连接的有界出站队列 + 专属写协程
+    广播方只做入队，慢节点只拖慢自己；队列溢出时丢弃最旧消息降级，
+    溢出时写协程已停滞超过 SLOW_CONSUMER_TIMEOUT 则判定失联并断开
+    画面帧走独立的 frames 槽位：每个坐席只保留最新一帧，慢观看者直接跳过过期帧，不形成积压
+    """
+
+    def __init__(self, username: str, websocket: WebSocket, session: AgentSession):
+        self.username = username
+        self.websocket = websocket
+        self.session = session
+        self.outbox: deque = deque()
+        self.frames: dict[str, object] = {} # 坐席 -> 待发送的最新画面帧 (str 或 bytes)
+        self.screen_subscribed = False # 是否已启用按需订阅 (否则按旧版逻辑接收可见坐席的全部画面)
+        self.frames_skipped = 0
+        self.overflows = 0
+        self.last_progress = 0.0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    def enqueue(self, text: str) -> bool:
+        if self.closed: return False
+        now = asyncio.get_running_loop().time()
+        if not self.outbox:
+            self.last_progress = now
+        elif len(self.outbox) >= OUTBOX_LIMIT:
+            if now - self.last_progress > SLOW_CONSUMER_TIMEOUT:
+                logger.warning(f"🐢 [WS] 慢消费者已断开: {self.username} (积压 {len(self.outbox)} 条)")
+                self.close(code=1013)
+                return False
+            self.outbox.popleft()
+            self.overflows += 1
+        self.outbox.append(text)
+        self._wakeup.set()
+        return True
+
+    def offer_frame(self, agent: str, frame):
+        """最新帧覆盖旧帧 (latest-frame-wins)"""
+        if self.closed: return
+        if agent in self.frames: self.frames_skipped += 1
+        self.frames[agent] = frame
+        self._wakeup.set()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.outbox or self.frames:
+                    # 控制消息优先，画面帧在空档中发送
+                    if self.outbox:
+                        await self.websocket.send_text(self.outbox.popleft())
+                    else:
+                        agent = next(iter(self.frames))
+                        frame = self.frames.pop(agent)
+                        if isinstance(frame, bytes): await self.websocket.send_bytes(frame)
+                        else: await self.websocket.send_text(frame)
+                    self.last_progress = asyncio.get_running_loop().time()
+                self.overflows = 0 # 已追平积压，重置溢出计数
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ [WS] 出站写入中断: {self.username} ({e})")
+            self.closed = True
+
+    def close(self, code: Optional[int] = None):
+        """停止写协程；指定 code 时同时关闭底层连接，由接收循环完成后续清理"""
+        if self.closed and code is None: return
+        self.closed = True
+        self.outbox.clear()
+        self.frames.clear()
+        if self._writer: self._writer.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+def _role_key(role_id) -> Optional[int]:
+    # V5.52: 兼容性加固 - 处理数字或字符串形式的 RoleID
+    try:
+        return int(role_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class ConnectionManager:
+    """
+    [链路注册表] 在线连接按 角色 / 部门 / (角色, 部门) 三级索引，
+    定向广播只触达有权查看该坐席的节点，无需逐个扫描全部连接
+    V5.67: 多 worker 部署时，广播先在本地投递，再经 MessageBus 转发给其它 worker 在其本地按相同作用域投递
+    """
+
+    def __init__(self):
+        self.active_connections: dict[str, ClientLink] = {}
+        self._by_role: dict[Optional[int], set[str]] = {}
+        self._by_dept: dict[Optional[int], set[str]] = {}
+        self._by_role_dept: dict[tuple, set[str]] = {}
+        # 画面订阅：坐席 -> 观看者，观看者 -> 坐席
+        self._screen_viewers: dict[str, set[str]] = {}
+        self._viewer_targets: dict[str, set[str]] = {}
+        # 其它 worker 上的观看者：坐席 -> {观看者: worker}
+        self._remote_viewers: dict[str, dict[str, str]] = {}
+        # 其它 worker 上尚未启用订阅的旧版指挥节点：观看者 -> (worker, 角色, 部门)
+        self._remote_legacy: dict[str, tuple] = {}
+
+    def attach_bus(self):
+        """注册跨进程总线处理器 (需在 bus.attach() 之前调用)"""
+        bus.on("broadcast", self._on_bus_broadcast)
+        bus.on("personal", self._on_bus_personal)
+        bus.on("screen_sub", self._on_bus_screen_sub)
+        bus.on("screen_frame", self._on_bus_screen_frame)
+        bus.on("screen_legacy", self._on_bus_screen_legacy)
+
+    # --- 索引维护 ---
+    def _index(self, username: str, role_id, dept_id):
+        role = _role_key(role_id)
+        self._by_role.setdefault(role, set()).add(username)
+        self._by_dept.setdefault(dept_id, set()).add(username)
+        self._by_role_dept.setdefault((role, dept_id), set()).add(username)
+
+    def _unindex(self, username: str, role_id, dept_id):
+        role = _role_key(role_id)
+        for index, key in ((self._by_role, role), (self._by_dept, dept_id), (self._by_role_dept, (role, dept_id))):
+            members = index.get(key)
+            if members is None: continue
+            members.discard(username)
+            if not members: del index[key]
+
+    def reindex(self, session: AgentSession, old_role_id, old_dept_id):
+        """会话资料变更回调 (SessionRegistry listener)：迁移索引位置"""
+        link = self.active_connections.get(session.username)
+        if not link or link.session is not session: return
+        self._unindex(session.username, old_role_id, old_dept_id)
+        self._index(session.username, session.role_id, session.dept_id)
+
+    async def connect(self, username: str, websocket: WebSocket, session: AgentSession):
+        await websocket.accept()
+        old = self.active_connections.get(username)
+        if old:
+            old.close(code=4001) # 被同名新链路顶替：关闭旧连接，客户端收到 4001 后不再重连
+            self._unindex(username, old.session.role_id, old.session.dept_id)
+        link = ClientLink(username, websocket, session)
+        link.start()
+        self.active_connections[username] = link
+        self._index(username, session.role_id, session.dept_id)
+        try:
+            await bus.claim_route(username)
+        except Exception as e:
+            logger.error(f"⚠️ [WS] 链路路由登记失败 ({username}): {e}")
+        if _role_key(session.role_id) in (RoleID.ADMIN, RoleID.HQ):
+            await self._announce_legacy(link, True)
+        logger.info(f"📡 [WS] 节点已挂载: {username} ({session.role_id})")
+
+    async def disconnect(self, username: str, websocket: Optional[WebSocket] = None) -> bool:
+        """返回是否确实移除了链路；False 表示该连接已被重连后的新链路顶替，调用方不应再执行下线处理"""
+        link = self.active_connections.get(username)
+        # 仅移除同一连接，避免旧链路断开时误删重连后的新链路
+        if link and (websocket is None or link.websocket is websocket):
+            link.close()
+            del self.active_connections[username]
+            self._unindex(username, link.session.role_id, link.session.dept_id)
+            await self.unsubscribe_screens(username)
+            if not link.screen_subscribed and _role_key(link.session.role_id) in (RoleID.ADMIN, RoleID.HQ):
+                await self._announce_legacy(link, False)
+            try:
+                await bus.release_route(username)
+            except Exception as e:
+                logger.error(f"⚠️ [WS] 链路路由注销失败 ({username}): {e}")
+            logger.info(f"🔌 [WS] 节点已脱机: {username}")
+            return True
+        return False
+
+    # --- 作用域解析 ---
+    def command_of(self, dept_id: Optional[int]) -> set[str]:
+        """可查看该部门坐席的指挥节点：本部门 ADMIN + 全部 HQ"""
+        return self._by_role_dept.get((RoleID.ADMIN, dept_id), set()) | self._by_role.get(RoleID.HQ, set())
+
+    def _recipients(self, scope: str, dept_id: Optional[int] = None, also: Optional[str] = None) -> set[str]:
+        if scope == "all":
+            recipients = set(self.active_connections)
+        elif scope == "command":
+            recipients = self._by_role.get(RoleID.ADMIN, set()) | self._by_role.get(RoleID.HQ, set())
+        elif scope == "hq":
+            recipients = set(self._by_role.get(RoleID.HQ, set()))
+        elif scope == "dept":
+            recipients = set(self._by_dept.get(dept_id, set()))
+        else: # dept_command
+            recipients = self.command_of(dept_id)
+        if also: recipients.add(also)
+        return recipients
+
+    def _fanout(self, text: str, usernames) -> int:
+        delivered = 0
+        for username in list(usernames):
+            link = self.active_connections.get(username)
+            if link and link.enqueue(text): delivered += 1
+        return delivered
+
+    async def _broadcast(self, scope: str, message: dict, dept_id: Optional[int] = None, also: Optional[str] = None):
+        """本地投递一次，再交由总线转发给其它 worker (V5.82: 先追加到事件流并附带 event_id，供断线续传)"""
+        event_id = await event_log.append(scope, message, dept_id, also)
+        if event_id: message = {**message, "event_id": event_id}
+        self._fanout(encode_message(message), self._recipients(scope, dept_id, also))
+        await bus.publish("broadcast", scope=scope, message=message, dept_id=dept_id, also=also)
+
+    async def _on_bus_broadcast(self, envelope: dict):
+        self._fanout(encode_message(envelope["message"]),
+                     self._recipients(envelope.get("scope"), envelope.get("dept_id"), envelope.get("also")))
+
+    async def broadcast_to_command(self, message: dict):
+        """
+        [物理隔离] 仅向 ADMIN 和 HQ 节点推送 (不区分部门)
+        """
+        await self._broadcast("command", message)
+
+    async def broadcast_to_hq(self, message: dict):
+        """[总部专线] 仅向 HQ 节点推送"""
+        await self._broadcast("hq", message)
+
+    async def broadcast_to_dept(self, message: dict, dept_id: Optional[int]):
+        """[部门广播] 向指定部门的全部在线节点推送"""
+        await self._broadcast("dept", message, dept_id)
+
+    async def broadcast_to_dept_command(self, message: dict, dept_id: Optional[int], also: Optional[str] = None):
+        """
+        [定向推送] 坐席相关事件 (对话、违规、奖励、上下线) 仅推送给能看到该坐席的指挥节点，
+        also 指定的节点 (通常是坐席本人) 一并送达
+        """
+        await self._broadcast("dept_command", message, dept_id, also)
+
+    # --- 画面通道 ---
+    def _can_view(self, viewer: ClientLink, dept_id: Optional[int]) -> bool:
+        role = _role_key(viewer.session.role_id)
+        return role == RoleID.HQ or (role == RoleID.ADMIN and viewer.session.dept_id == dept_id)
+
+    async def subscribe_screens(self, viewer: str, targets):
+        """[按需订阅] 指挥节点声明当前打开的坐席画面；首次订阅后不再接收未订阅坐席的画面"""
+        link = self.active_connections.get(viewer)
+        if not link or _role_key(link.session.role_id) not in (RoleID.ADMIN, RoleID.HQ): return
+        if not link.screen_subscribed:
+            link.screen_subscribed = True
+            await self._announce_legacy(link, False)
+        targets = list(targets or [])
+        for agent in targets:
+            self._screen_viewers.setdefault(agent, set()).add(viewer)
+            self._viewer_targets.setdefault(viewer, set()).add(agent)
+        if targets: await bus.publish("screen_sub", viewer=viewer, targets=targets, add=True)
+
+    async def unsubscribe_screens(self, viewer: str, targets=None):
+        """targets 为空表示取消该节点的全部订阅"""
+        subscribed = self._viewer_targets.get(viewer, set())
+        if not subscribed: return
+        removed = list(subscribed if targets is None else targets)
+        for agent in removed:
+            viewers = self._screen_viewers.get(agent)
+            if viewers:
+                viewers.discard(viewer)
+                if not viewers: del self._screen_viewers[agent]
+            subscribed.discard(agent)
+        if not subscribed: self._viewer_targets.pop(viewer, None)
+        await bus.publish("screen_sub", viewer=viewer, targets=removed, add=False)
+
+    async def _on_bus_screen_sub(self, envelope: dict):
+        viewer, worker = envelope["viewer"], envelope["origin"]
+        for agent in envelope.get("targets") or []:
+            if envelope.get("add"):
+                self._remote_viewers.setdefault(agent, {})[viewer] = worker
+                continue
+            viewers = self._remote_viewers.get(agent)
+            if viewers and viewers.get(viewer) == worker:
+                del viewers[viewer]
+                if not viewers: del self._remote_viewers[agent]
+
+    async def _announce_legacy(self, link: ClientLink, add: bool):
+        """告知其它 worker 本地旧版指挥节点的上线 / 启用订阅 / 脱机，使其画面帧也转发到本 worker"""
+        await bus.publish("screen_legacy", viewer=link.username, role_id=_role_key(link.session.role_id),
+                          dept_id=link.session.dept_id, add=add)
+
+    async def _on_bus_screen_legacy(self, envelope: dict):
+        viewer, worker = envelope["viewer"], envelope["origin"]
+        if envelope.get("add"):
+            self._remote_legacy[viewer] = (worker, envelope.get("role_id"), envelope.get("dept_id"))
+        elif self._remote_legacy.get(viewer, (None,))[0] == worker:
+            del self._remote_legacy[viewer]
+
+    def _deliver_frame(self, frame: ScreenFrame, dept_id: Optional[int]):
+        agent = frame.username
+        for viewer in self._screen_viewers.get(agent, ()):
+            link = self.active_connections.get(viewer)
+            if link and self._can_view(link, dept_id):
+                link.offer_frame(agent, frame.binary())
+        for viewer in self.command_of(dept_id):
+            link = self.active_connections.get(viewer)
+            if link and not link.screen_subscribed:
+                link.offer_frame(agent, frame.legacy())
+
+    async def publish_screen(self, session: AgentSession, image: Optional[bytes] = None, data_url: Optional[str] = None):
+        """
+        [画面分发] 订阅者收二进制帧；未启用订阅的旧版指挥节点按部门可见性收 JSON 帧
+        每个 (坐席, 观看者) 仅缓存最新一帧
+        订阅者或可见该坐席的旧版指挥节点位于其它 worker 时，帧只发往这些 worker 的专属频道
+        """
+        if not image and not data_url: return # 空帧 (如无 payload 的 SCREEN_SYNC) 直接丢弃
+        frame = ScreenFrame(session.username, image=image, data_url=data_url)
+        self._deliver_frame(frame, session.dept_id)
+
+        remote = self._remote_viewers.get(session.username, {})
+        workers = set(remote.values()) | {
+            worker for worker, role, dept in self._remote_legacy.values()
+            if role == RoleID.HQ or (role == RoleID.ADMIN and dept == session.dept_id)
+        }
+        if not workers: return
+        payload = {"image": base64.b64encode(image).decode("ascii")} if image is not None else {"data_url": data_url}
+        for worker in workers:
+            received = await bus.publish("screen_frame", worker=worker, agent=session.username, dept_id=session.dept_id, **payload)
+            if not received:
+                # 目标 worker 已退出，清理其残留订阅与旧版节点登记
+                for viewer in [v for v, w in remote.items() if w == worker]: del remote[viewer]
+                for viewer in [v for v, entry in self._remote_legacy.items() if entry[0] == worker]: del self._remote_legacy[viewer]
+        if not remote: self._remote_viewers.pop(session.username, None)
+
+    async def _on_bus_screen_frame(self, envelope: dict):
+        image = envelope.get("image")
+        frame = ScreenFrame(envelope["agent"], image=base64.b64decode(image) if image else None, data_url=envelope.get("data_url"))
+        self._deliver_frame(frame, envelope.get("dept_id"))
+
+    async def broadcast(self, message: dict):
+        await self._broadcast("all", message)
+
+    async def send_personal_message(self, message: dict, username: str):
+        """
+        [战术点对点] 向指定操作员发送指令
+        目标不在本 worker 时，按路由表转发到持有该链路的 worker
+        """
+        link = self.active_connections.get(username)
+        if link:
+            link.enqueue(encode_message(message))
+            return
+        worker = await bus.route_of(username)
+        if worker and worker != bus.worker_id:
+            if await bus.publish("personal", worker=worker, username=username, message=message): return
+            await bus.drop_route(username, worker)
+        logger.warning(f"⚠️ [指令丢包] 目标节点 {username} 脱机，无法送达")
+
+    async def _on_bus_personal(self, envelope: dict):
+        link = self.active_connections.get(envelope["username"])
+        if link:
+            link.enqueue(encode_message(envelope["message"]))
+        else:
+            logger.warning(f"⚠️ [指令丢包] 目标节点 {envelope['username']} 已离开本 worker，无法送达")
+
+    def stats(self) -> dict:
+        links = list(self.active_connections.values())
+        return {
+            "worker": bus.worker_id,
+            "nodes": len(links),
+            "max_outbox": max((len(l.outbox) for l in links), default=0),
+            "lagging": sum(1 for l in links if l.overflows),
+            "screen_subscriptions": sum(len(v) for v in self._viewer_targets.values()),
+            "remote_screen_viewers": sum(len(v) for v in self._remote_viewers.values()),
+            "screen_frames_skipped": sum(l.frames_skipped for l in links)
+        }
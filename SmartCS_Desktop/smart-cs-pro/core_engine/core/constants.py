@@ -11,3 +11,21 @@ class RoleID:
     AGENT = 1
     ADMIN = 2
     HQ = 3
+
+class RiskBucket:
+    """
+    [风险分级] 违规风险分段，检索筛选与聚合统计共用
+    SERIOUS: >= 8, MEDIUM: 5 ~ 7, LOW: < 5
+    """
+    SERIOUS = "SERIOUS"
+    MEDIUM = "MEDIUM"
+    LOW = "LOW"
+
+    SERIOUS_MIN = 8
+    MEDIUM_MIN = 5
+
+    @classmethod
+    def of(cls, risk_score: int) -> str:
+        if risk_score >= cls.SERIOUS_MIN: return cls.SERIOUS
+        if risk_score >= cls.MEDIUM_MIN: return cls.MEDIUM
+        return cls.LOW
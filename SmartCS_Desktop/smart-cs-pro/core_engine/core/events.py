@@ -0,0 +1,99 @@
+import os, re, json, logging
+from typing import Optional
+from core.constants import RoleID
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+EVENT_STREAM = "ws_events"
+_EVENT_ID = re.compile(r"^\d+-\d+$")
+
+# 仅这些影响态势状态的事件可续传；聊天、求助截图等即时消息只做实时投递，不写入事件流
+REPLAYABLE_TYPES = {"VIOLATION", "REWARD", "TACTICAL_NODE_SYNC", "TACTICAL_NODE_DELTA"}
+_BULKY_FIELDS = ("image", "payload", "screenshot") # 事件流中剔除的大字段
+
+
+def in_scope(role_id, dept_id, username: str, scope: str, target_dept: Optional[int], also: Optional[str]) -> bool:
+    """单个节点是否属于广播作用域 (与 ConnectionManager._recipients 的规则一致)"""
+    if also and also == username: return True
+    try:
+        role = int(role_id)
+    except (TypeError, ValueError):
+        role = None
+    if scope == "all": return True
+    if scope == "command": return role in (RoleID.ADMIN, RoleID.HQ)
+    if scope == "hq": return role == RoleID.HQ
+    if scope == "dept": return dept_id == target_dept
+    return role == RoleID.HQ or (role == RoleID.ADMIN and dept_id == target_dept) # dept_command
+
+
+class EventLog:
+    """
+    [事件续传] 广播事件追加到定长 Redis Stream (ws_events)，Stream ID 即 event_id (单调递增)
+    客户端断线重连时在握手中携带 last_event_id，服务端按其身份作用域补发错过的事件
+    补发与实时推送可能有少量重叠，客户端按 event_id 去重
+    只记录 REPLAYABLE_TYPES 中的事件 (剔除图像等大字段、截断取证上下文)，其余消息不产生 Redis 往返
+    """
+
+    def __init__(self):
+        self.maxlen = int(os.getenv("WS_EVENT_STREAM_MAXLEN", 10000))
+        self.replay_limit = int(os.getenv("WS_EVENT_REPLAY_LIMIT", 500))
+        self.context_limit = int(os.getenv("WS_EVENT_CONTEXT_LIMIT", 200))
+        self.appended = 0
+        self.replayed = 0
+
+    async def append(self, scope: str, message: dict, dept_id: Optional[int] = None, also: Optional[str] = None) -> Optional[str]:
+        """返回分配的 event_id；不可续传的事件类型或 Redis 不可用时返回 None (事件仍实时投递，只是不可续传)"""
+        if message.get("type") not in REPLAYABLE_TYPES: return None
+        client = redis_mgr.client
+        if not client: return None
+        try:
+            fields = {"scope": scope, "message": json.dumps(self._compact(message), ensure_ascii=False)}
+            if dept_id is not None: fields["dept_id"] = dept_id
+            if also: fields["also"] = also
+            event_id = await client.xadd(EVENT_STREAM, fields, maxlen=self.maxlen, approximate=True)
+            self.appended += 1
+            return event_id
+        except Exception as e:
+            logger.error(f"⚠️ [事件续传] 事件追加失败: {e}")
+            return None
+
+    def _compact(self, message: dict) -> dict:
+        compact = {k: v for k, v in message.items() if k not in _BULKY_FIELDS}
+        context = compact.get("context")
+        if isinstance(context, str) and len(context) > self.context_limit:
+            compact["context"] = context[:self.context_limit] + "…"
+        return compact
+
+    async def replay(self, session, last_event_id: str) -> tuple[list[dict], bool]:
+        """
+        返回 (该节点可见的错过事件, 是否不完整)；last_event_id 已被裁剪出窗口或错过事件超过补发上限时
+        不完整为 True，客户端应回退为全量拉取
+        """
+        client = redis_mgr.client
+        if not client or not last_event_id or not _EVENT_ID.match(last_event_id): return [], False
+        entries = await client.xrange(EVENT_STREAM, min=f"({last_event_id}", count=self.replay_limit + 1)
+        truncated = len(entries) > self.replay_limit
+        if not truncated:
+            # 客户端最后收到的事件本身已被裁剪出窗口，说明其后的事件也可能已被裁剪
+            first = await client.xrange(EVENT_STREAM, count=1)
+            truncated = bool(first) and _id_tuple(first[0][0]) > _id_tuple(last_event_id)
+        messages = []
+        for event_id, data in entries[:self.replay_limit]:
+            dept = data.get("dept_id")
+            if not in_scope(session.role_id, session.dept_id, session.username, data.get("scope"), int(dept) if dept else None, data.get("also")):
+                continue
+            messages.append({**json.loads(data["message"]), "event_id": event_id})
+        self.replayed += len(messages)
+        return messages, truncated
+
+    def stats(self) -> dict:
+        return {"appended": self.appended, "replayed": self.replayed, "maxlen": self.maxlen}
+
+
+def _id_tuple(event_id: str) -> tuple:
+    ms, seq = event_id.split("-")
+    return int(ms), int(seq)
+
+
+event_log = EventLog()
@@ -0,0 +1,129 @@
+import asyncio, logging, time
+from typing import Optional
+from core.models import KnowledgeBase
+from core.word_dict import DICT_CHANNEL
+from utils.matcher import AhoCorasick
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+# 与词库引擎共用失效频道，以 name 区分
+KB_VERSION_KEY = "dict:knowledge_base:version"
+KB_DICT_NAME = "knowledge_base"
+
+
+class _CompiledKB:
+    """
+    [只读快照] 话术自动机：dept[None] 仅含全局话术，dept[部门ID] = 全局话术 + 本部门话术
+    载荷为 (话术ID, 是否部门专属)，话术正文存于 items
+    """
+    __slots__ = ("items", "dept")
+
+    def __init__(self, rows: list[dict]):
+        self.items = {r["id"]: r for r in rows}
+        shared, by_dept = [], {}
+        for r in rows:
+            if r["department_id"] is None: shared.append((r["keyword"], (r["id"], False)))
+            else: by_dept.setdefault(r["department_id"], []).append((r["keyword"], (r["id"], True)))
+
+        self.dept = {None: AhoCorasick(shared)}
+        for dept_id, items in by_dept.items():
+            self.dept[dept_id] = AhoCorasick(shared + items)
+
+
+class KnowledgeMatcher:
+    """
+    [带教检索] 进程内常驻的版本化话术索引，单次扫描客户消息即可找出全部命中话术
+    写接口递增 Redis 版本号并广播失效信号，各进程后台重建后整体替换快照
+    """
+
+    def __init__(self):
+        self._compiled: Optional[_CompiledKB] = None
+        self._init_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self.version = 0
+        self.loaded_at = 0.0
+
+    async def _remote_version(self) -> int:
+        client = redis_mgr.client
+        if not client: return 0
+        return int(await client.get(KB_VERSION_KEY) or 0)
+
+    async def rebuild(self):
+        version = await self._remote_version()
+        rows = await KnowledgeBase.filter(is_active=1, is_deleted=0).values(
+            "id", "keyword", "answer", "department_id", "category__name"
+        )
+        compiled = await asyncio.to_thread(_CompiledKB, rows)
+        self._compiled, self.version, self.loaded_at = compiled, version, time.time()
+        logger.info(f"📚 [带教检索] 话术索引已重建 v{version}: {len(rows)} 条, 部门词表 {len(compiled.dept)} 组")
+
+    async def ensure_ready(self):
+        if self._compiled is not None: return
+        async with self._init_lock:
+            if self._compiled is None:
+                await self.rebuild()
+
+    def schedule_rebuild(self):
+        if self._rebuild_task and not self._rebuild_task.done():
+            self._dirty = True
+            return
+        self._rebuild_task = asyncio.create_task(self._rebuild_loop())
+
+    async def _rebuild_loop(self):
+        while True:
+            self._dirty = False
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error(f"❌ [带教检索] 重建失败，继续沿用旧快照: {e}")
+            if not self._dirty: break
+
+    async def invalidate(self):
+        """[写接口调用] 递增版本号并广播，所有进程 (含本进程) 据此重建"""
+        client = redis_mgr.client
+        if client:
+            try:
+                version = await client.incr(KB_VERSION_KEY)
+                await redis_mgr.publish(DICT_CHANNEL, {"name": KB_DICT_NAME, "version": version})
+            except Exception as e:
+                logger.error(f"⚠️ [带教检索] 失效广播失败，仅重建本进程: {e}")
+        self.schedule_rebuild()
+
+    async def on_invalidate(self, data: dict):
+        if data.get("name") == KB_DICT_NAME and data.get("version") != self.version:
+            self.schedule_rebuild()
+
+    async def reconcile_loop(self, interval: int = 60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await self._remote_version() != self.version:
+                    self.schedule_rebuild()
+            except Exception as e:
+                logger.error(f"⚠️ [带教检索] 版本校准失败: {e}")
+
+    def stats(self) -> dict:
+        compiled = self._compiled
+        return {"version": self.version, "items": len(compiled.items) if compiled else 0, "loaded_at": int(self.loaded_at)}
+
+    def match(self, text: str, dept_id: Optional[int] = None, limit: int = 3) -> list[dict]:
+        """
+        返回按相关度排序的命中话术 (同一话术只出现一次)：
+        部门专属优先于全局，其次关键词越长越具体，再次命中次数越多、位置越靠前越优先
+        """
+        compiled = self._compiled
+        if not compiled or not text: return []
+        automaton = compiled.dept.get(dept_id) or compiled.dept[None]
+        found: dict[int, list] = {}
+        for hit in automaton.iter_matches(text):
+            item_id, scoped = hit.payload
+            entry = found.get(item_id)
+            if entry is None: found[item_id] = [scoped, len(hit.word), 1, hit.start]
+            else: entry[2] += 1
+        ranked = sorted(found.items(), key=lambda kv: (not kv[1][0], -kv[1][1], -kv[1][2], kv[1][3]))
+        return [{**compiled.items[item_id], "hits": e[2]} for item_id, e in ranked[:limit]]
+
+
+knowledge_matcher = KnowledgeMatcher()
@@ -47,6 +47,7 @@ class UserReward(BaseModel):
     type = fields.CharField(max_length=20)
     title = fields.CharField(max_length=100)
     value = fields.IntField(default=0)
+    ledger_id = fields.CharField(max_length=32, null=True, unique=True) # V5.80: 积分流水 ID，重放写回时去重
     created_at = fields.DatetimeField(auto_now_add=True)
 
     class Meta:
@@ -127,6 +128,24 @@ class ViolationRecord(BaseModel):
 
     class Meta:
         table = "violation_records"
+        # V5.76: 角色隔离筛选所需的复合索引 (坐席自看 / 按状态检索)；FULLTEXT(ngram) 索引见 migrate_v8.py
+        indexes = (("user_id", "timestamp"), ("status", "timestamp"))
+
+class ViolationRollup(BaseModel):
+    """[违规聚合] 按 日 / 部门 / 坐席 / 风险分级 / 关键词 预聚合的命中计数，由落库管线同批次累加"""
+    id = fields.IntField(pk=True)
+    day = fields.DateField()
+    department_id = fields.IntField(default=0) # 0 表示未分配部门
+    user_id = fields.IntField()
+    risk_bucket = fields.CharField(max_length=10)
+    keyword = fields.CharField(max_length=100)
+    hits = fields.IntField(default=0)
+    score_total = fields.IntField(default=0)
+
+    class Meta:
+        table = "violation_rollups"
+        unique_together = (("day", "department_id", "user_id", "risk_bucket", "keyword"),)
+        indexes = (("department_id", "day"), ("day",))
 
 class Customer(BaseModel):
     name = fields.CharField(max_length=100, pk=True)
@@ -144,11 +163,15 @@ class Notification(BaseModel):
     title = fields.CharField(max_length=255)
     content = fields.TextField()
     type = fields.CharField(max_length=50, default="INFO")
-    is_read = fields.IntField(default=0)
+    is_read = fields.IntField(default=0) # 旧版全局已读标记，仅对无序号的历史通知生效
+    seq = fields.BigIntField(null=True, index=True) # V5.81: 全局投递序号
+    target_user_id = fields.IntField(null=True) # 目标用户与目标部门均为空表示全员广播
+    target_dept_id = fields.IntField(null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
 
     class Meta:
         table = "notifications"
+        indexes = (("target_user_id", "created_at"), ("target_dept_id", "created_at"))
 
 class AuditLog(BaseModel):
     id = fields.IntField(pk=True)
@@ -0,0 +1,152 @@
+import os, logging
+from typing import Optional
+from tortoise.expressions import Q
+from core.constants import RoleID
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+SEQ_KEY = "notif:seq" # 全局通知序号 (单调递增)
+
+# KEYS[1]=notif:read:{uid} KEYS[2]=notif:read_ids:{uid} KEYS[3..]=可见投递通道
+# 统计序号高于已读水位、且未被单条标记已读的通知数 (跨通道去重)
+_UNREAD_SCRIPT = """
+local mark = redis.call('GET', KEYS[1]) or '0'
+local seen, n = {}, 0
+for i = 3, #KEYS do
+    for _, s in ipairs(redis.call('ZRANGEBYSCORE', KEYS[i], '(' .. mark, '+inf')) do
+        if not seen[s] then
+            seen[s] = true
+            if redis.call('SISMEMBER', KEYS[2], s) == 0 then n = n + 1 end
+        end
+    end
+end
+return n
+"""
+
+
+def _is_role(user: dict, role_id: int, code: str) -> bool:
+    return user.get("role_id") == role_id or user.get("role_code") == code
+
+
+class NotificationCenter:
+    """
+    [通知投递] 通知按 目标用户 / 目标部门 定向投递 (均为空即全员广播)，已读状态不再改写通知行
+    - notif:seq                 全局序号，每条通知落库前分配
+    - notif:ch:{通道}           ZSET 序号 -> 序号，通道为 global / dept:{id} / user:{id} / all，仅保留最近 cap 条
+    - notif:read:{uid}          已读水位：序号不高于水位的通知视为已读 ("全部已读" 只移动水位)
+    - notif:read_ids:{uid}      SET 水位之上单条标记已读的序号
+    未读数由一次 Lua 调用在 Redis 内完成统计，角标轮询不访问 MySQL
+    可见性：总部可见全部；主管可见 全员 + 本部门 + 本人；坐席可见 全员 + 本人
+    """
+
+    def __init__(self):
+        self.cap = int(os.getenv("NOTIF_CHANNEL_CAP", 1000))
+        self.read_ttl = int(os.getenv("NOTIF_READ_TTL", 90 * 86400))
+
+    # --- 投递 ---
+    @staticmethod
+    def channels_for(target_user_id: Optional[int], target_dept_id: Optional[int]) -> list[str]:
+        channels = ["all"]
+        if target_user_id: channels.append(f"user:{target_user_id}")
+        if target_dept_id: channels.append(f"dept:{target_dept_id}")
+        if not target_user_id and not target_dept_id: channels.append("global")
+        return channels
+
+    @staticmethod
+    def visible_channels(user: dict) -> list[str]:
+        if _is_role(user, RoleID.HQ, "HQ"): return ["all"]
+        channels = ["global", f"user:{user.get('id')}"]
+        if _is_role(user, RoleID.ADMIN, "ADMIN") and user.get("dept_id"):
+            channels.append(f"dept:{user['dept_id']}")
+        return channels
+
+    @staticmethod
+    def visibility_filter(query, user: dict):
+        if _is_role(user, RoleID.HQ, "HQ"): return query
+        cond = Q(target_user_id__isnull=True, target_dept_id__isnull=True) | Q(target_user_id=user.get("id"))
+        if _is_role(user, RoleID.ADMIN, "ADMIN") and user.get("dept_id"):
+            cond |= Q(target_dept_id=user["dept_id"])
+        return query.filter(cond)
+
+    async def allocate(self, n: int) -> list[Optional[int]]:
+        """为 n 条待落库通知分配序号；Redis 不可用时返回空序号 (按旧版全局已读标记处理)"""
+        client = redis_mgr.client
+        if not client or n <= 0: return [None] * n
+        try:
+            last = await client.incrby(SEQ_KEY, n)
+            return list(range(last - n + 1, last + 1))
+        except Exception as e:
+            logger.error(f"⚠️ [通知投递] 序号分配失败: {e}")
+            return [None] * n
+
+    async def index(self, items: list[tuple]):
+        """[事务提交后] 将 (序号, 目标用户, 目标部门) 写入各投递通道"""
+        client = redis_mgr.client
+        items = [i for i in items if i[0] is not None]
+        if not client or not items: return
+        try:
+            touched = set()
+            async with client.pipeline(transaction=False) as pipe:
+                for seq, user_id, dept_id in items:
+                    for ch in self.channels_for(user_id, dept_id):
+                        pipe.zadd(f"notif:ch:{ch}", {seq: seq})
+                        touched.add(ch)
+                for ch in touched:
+                    pipe.zremrangebyrank(f"notif:ch:{ch}", 0, -(self.cap + 1))
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"⚠️ [通知投递] 通道索引失败 ({len(items)} 条): {e}")
+
+    async def bootstrap(self):
+        """[启动自检] Redis 数据丢失时，以 MySQL 为准恢复全局序号与各通道最近的通知"""
+        client = redis_mgr.client
+        if not client or await client.exists(SEQ_KEY): return
+        from core.models import Notification
+        rows = await Notification.filter(is_deleted=0, seq__isnull=False).order_by("-seq").limit(self.cap * 4).values_list("seq", "target_user_id", "target_dept_id")
+        if not rows: return
+        await client.set(SEQ_KEY, rows[0][0], nx=True)
+        await self.index(list(rows))
+        logger.info(f"📨 [通知投递] 已从 MySQL 恢复序号 {rows[0][0]} 与 {len(rows)} 条通道索引")
+
+    # --- 已读状态 ---
+    async def read_state(self, user_id: int) -> tuple[int, set]:
+        client = redis_mgr.client
+        if not client: return 0, set()
+        mark, ids = await client.get(f"notif:read:{user_id}"), await client.smembers(f"notif:read_ids:{user_id}")
+        return int(mark or 0), {int(s) for s in ids}
+
+    async def unread(self, user: dict) -> Optional[int]:
+        """Redis 不可用时返回 None，由调用方回源"""
+        client = redis_mgr.client
+        if not client: return None
+        uid = user.get("id")
+        keys = [f"notif:read:{uid}", f"notif:read_ids:{uid}"] + [f"notif:ch:{ch}" for ch in self.visible_channels(user)]
+        return int(await client.eval(_UNREAD_SCRIPT, len(keys), *keys))
+
+    async def mark_read(self, user_id: int, seq: int) -> bool:
+        """返回是否已记录；Redis 不可用时返回 False，由调用方告知客户端"""
+        client = redis_mgr.client
+        if not client: return False
+        mark = int(await client.get(f"notif:read:{user_id}") or 0)
+        if seq > mark:
+            key = f"notif:read_ids:{user_id}"
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.sadd(key, seq)
+                pipe.expire(key, self.read_ttl)
+                await pipe.execute()
+        return True
+
+    async def mark_all_read(self, user_id: int) -> bool:
+        """水位推进到当前最新序号，并清空单条已读集合；Redis 不可用时返回 False"""
+        client = redis_mgr.client
+        if not client: return False
+        latest = int(await client.get(SEQ_KEY) or 0)
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.set(f"notif:read:{user_id}", latest)
+            pipe.delete(f"notif:read_ids:{user_id}")
+            await pipe.execute()
+        return True
+
+
+notification_center = NotificationCenter()
@@ -0,0 +1,178 @@
+import os, re, time, asyncio, logging
+from typing import Optional
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+PINYIN_CHANNEL = "pinyin_index_sync"
+_PINYIN_TERM = re.compile(r"^[a-z]+$") # 仅由字母构成的检索词才可能是全拼 / 首字母
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError: # pypinyin 未安装时索引停用，检索回退到 icontains
+    lazy_pinyin = None
+
+
+class _Node:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        self.ids: set[int] = set()
+
+
+def index_keys(username: str, real_name: Optional[str]) -> set[str]:
+    """
+    一个操作员的全部检索键 (小写)：账号 (仅前缀检索，不展开后缀以控制索引体积)、姓名的全部后缀，
+    以及从每个音节起始处开始的 全拼 / 首字母 串
+    例：张三 -> zhangsan, san, zs, s, 张三, 三；因此 "zs"、"zhangs"、"san" 均可前缀命中
+    """
+    keys = {username.lower()}
+    name = (real_name or "").strip()
+    if name:
+        keys.add(name.lower())
+        syllables = [s.strip().lower() for s in lazy_pinyin(name) if s.strip()] if lazy_pinyin else []
+        for i in range(len(syllables)):
+            keys.add("".join(syllables[i:]))
+            keys.add("".join(s[0] for s in syllables[i:]))
+        for i in range(1, len(name)):
+            keys.add(name[i:].lower())
+    keys.discard("")
+    return keys
+
+
+class PinyinIndex:
+    """
+    [拼音检索索引] 进程内前缀树：检索键 -> 用户 ID，前缀查询只遍历命中子树，无需扫描 users 表
+    启动时全量构建；改名 / 注销经 Redis Pub/Sub 增量同步到全部 worker，
+    定期只补录新增的操作员 (脚本导入)；全量重建默认关闭 (PINYIN_FULL_REBUILD_INTERVAL 秒，0 为关闭)
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._keys: dict[int, set[str]] = {}
+        self.ready = False
+        self.built_at = 0.0
+        self.max_ids = int(os.getenv("PINYIN_SEARCH_MAX_IDS", 500)) # 命中超过该数量时交回 SQL 过滤，避免超长 IN 列表
+        self.full_interval = float(os.getenv("PINYIN_FULL_REBUILD_INTERVAL", 0))
+        self._max_id = 0 # 已索引的最大用户 ID，增量补录从此处继续
+
+    # --- 前缀树维护 ---
+    def _insert(self, root: _Node, key: str, user_id: int):
+        node = root
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+        node.ids.add(user_id)
+
+    def _discard(self, key: str, user_id: int):
+        path, node = [], self._root
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None: return
+            path.append((node, ch))
+            node = child
+        node.ids.discard(user_id)
+        # 自底向上剪除空节点
+        for parent, ch in reversed(path):
+            child = parent.children[ch]
+            if child.ids or child.children: break
+            del parent.children[ch]
+
+    def upsert(self, user_id: int, username: str, real_name: Optional[str]):
+        self.remove(user_id)
+        keys = index_keys(username, real_name)
+        for key in keys: self._insert(self._root, key, user_id)
+        self._keys[user_id] = keys
+        self._max_id = max(self._max_id, user_id)
+
+    def remove(self, user_id: int):
+        for key in self._keys.pop(user_id, ()):
+            self._discard(key, user_id)
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> Optional[set[int]]:
+        """前缀命中的用户 ID；指定 limit 时命中数超过上限即停止遍历并返回 None"""
+        node = self._root
+        for ch in prefix.strip().lower():
+            node = node.children.get(ch)
+            if node is None: return set()
+        result, stack = set(), [node]
+        while stack:
+            n = stack.pop()
+            result |= n.ids
+            if limit is not None and len(result) > limit: return None
+            stack.extend(n.children.values())
+        return result
+
+    def match_ids(self, term: str) -> Optional[set[int]]:
+        """
+        [检索入口] 返回可直接用于 id__in 的用户 ID 集合；以下情况返回 None，由调用方回退 icontains：
+        索引未就绪、检索词不是全拼 / 首字母、索引无命中、命中数超过 max_ids (宽泛前缀)
+        """
+        term = term.strip().lower()
+        if not self.ready or not _PINYIN_TERM.match(term): return None
+        return self.search(term, self.max_ids) or None
+
+    # --- 构建与同步 ---
+    async def rebuild(self):
+        if lazy_pinyin is None:
+            logger.warning("⚠️ [拼音索引] 未安装 pypinyin，检索回退到模糊匹配")
+            return
+        from core.models import User
+        rows = await User.filter(is_deleted=0).values_list("id", "username", "real_name")
+
+        # 纯 Python 构建受 GIL 约束，放入线程并不能让出事件循环；改为分片构建，每片之间主动让出
+        root, keys = _Node(), {}
+        for i, (user_id, username, real_name) in enumerate(rows):
+            keys[user_id] = index_keys(username, real_name)
+            for key in keys[user_id]: self._insert(root, key, user_id)
+            if i % 500 == 499: await asyncio.sleep(0)
+
+        self._root, self._keys = root, keys
+        self._max_id = max(keys, default=0)
+        self.ready = True
+        self.built_at = time.time()
+        logger.info(f"🔤 [拼音索引] 已构建: {len(rows)} 名操作员")
+
+    async def catch_up(self):
+        """增量补录 ID 高于已索引上限的新操作员 (脚本导入等未经接口的新增)"""
+        from core.models import User
+        rows = await User.filter(is_deleted=0, id__gt=self._max_id).values_list("id", "username", "real_name")
+        for user_id, username, real_name in rows: self.upsert(user_id, username, real_name)
+        if rows: logger.info(f"🔤 [拼音索引] 已补录 {len(rows)} 名新操作员")
+
+    async def reconcile_loop(self, interval: float = 600):
+        """[常驻任务] 定期增量补录；配置 full_interval 时按该间隔全量重建 (吸收脚本改名 / 删除)"""
+        last_full = time.time()
+        while True:
+            await asyncio.sleep(interval)
+            if not self.ready: continue
+            try:
+                if self.full_interval > 0 and time.time() - last_full >= self.full_interval:
+                    await self.rebuild()
+                    last_full = time.time()
+                else:
+                    await self.catch_up()
+            except Exception as e:
+                logger.error(f"⚠️ [拼音索引] 对账失败: {e}")
+
+    async def publish_upsert(self, user_id: int, username: str, real_name: Optional[str]):
+        """本进程立即生效，并通知其它 worker"""
+        if self.ready: self.upsert(user_id, username, real_name)
+        await redis_mgr.publish(PINYIN_CHANNEL, {"action": "UPSERT", "id": user_id, "username": username, "real_name": real_name})
+
+    async def publish_remove(self, user_id: int):
+        if self.ready: self.remove(user_id)
+        await redis_mgr.publish(PINYIN_CHANNEL, {"action": "REMOVE", "id": user_id})
+
+    async def on_message(self, data: dict):
+        if not self.ready: return
+        if data.get("action") == "UPSERT":
+            self.upsert(data["id"], data["username"], data.get("real_name"))
+        elif data.get("action") == "REMOVE":
+            self.remove(data["id"])
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "users": len(self._keys), "built_at": int(self.built_at)}
+
+
+pinyin_index = PinyinIndex()
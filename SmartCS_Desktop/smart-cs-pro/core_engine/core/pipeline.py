@@ -0,0 +1,259 @@
+import os, json, time, asyncio, logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+from core.models import ViolationRecord, Notification, DeptComplianceLog
+from core.constants import RiskBucket
+from utils.redis_utils import redis_mgr
+from core.roster import roster
+from core.score_ledger import score_ledger
+from core.notifications import notification_center
+
+logger = logging.getLogger("SmartCS")
+
+
+class ViolationHit:
+    """[命中载荷] 扫描命中后入队的一条待落库记录 (RISK: 全域敏感词, DEPT: 部门规避词)"""
+    __slots__ = ("kind", "record_id", "user_id", "username", "real_name", "dept_id", "keyword", "context", "risk_score", "timestamp")
+
+    RISK = "RISK"
+    DEPT = "DEPT"
+
+    def __init__(self, kind: str, record_id: str, session, keyword: str, context: str, risk_score: int = 0):
+        self.kind = kind
+        self.record_id = record_id
+        self.user_id = session.user_id
+        self.username = session.username
+        self.real_name = session.real_name
+        self.dept_id = session.dept_id
+        self.keyword = keyword
+        self.context = context
+        self.risk_score = risk_score
+        self.timestamp = datetime.now() # 以命中时刻为准，而非落库时刻
+
+
+class ViolationPipeline:
+    """
+    [异步落库管线] 命中记录进入有界队列，由后台 worker 攒批写入：
+    违规/通知/合规日志各一次 bulk_create，同一批次内每个用户只更新一次战术分
+    队列写满时 submit 挂起等待 (背压)，使 WS 接收循环随 DB 速度自然放缓而非无限堆积
+    """
+
+    def __init__(self):
+        self.maxsize = int(os.getenv("VIOLATION_QUEUE_SIZE", 5000))
+        self.batch_size = int(os.getenv("VIOLATION_BATCH_SIZE", 200))
+        self.linger = float(os.getenv("VIOLATION_BATCH_LINGER", 0.05)) # 攒批等待窗口 (秒)
+        self.worker_count = int(os.getenv("VIOLATION_WORKERS", 2))
+        self.queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        # 运行指标
+        self.committed = 0
+        self.dropped = 0
+        self.rollup_failures = 0
+        self.backpressure_waits = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = 0.0
+        self.avg_commit_ms = 0.0
+
+    def start(self):
+        if self.queue is not None: return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        logger.info(f"🚚 [落库管线] 已启动: {self.worker_count} workers, 队列上限 {self.maxsize}, 批量 {self.batch_size}")
+
+    async def stop(self, timeout: float = 10):
+        """[优雅停机] 等待队列排空后回收 worker"""
+        if self.queue is None: return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"⚠️ [落库管线] 停机排空超时，仍有 {self.queue.qsize()} 条未落库")
+        for task in self._workers: task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers, self.queue = [], None
+
+    async def submit(self, hit: ViolationHit):
+        if hit.kind == ViolationHit.DEPT and not hit.dept_id:
+            # 合规日志的 department_id 不可为空，未归属部门的命中无法落库，直接丢弃
+            self.dropped += 1
+            logger.warning(f"🗑️ [落库管线] 坐席 {hit.username} 未归属部门，合规命中 [{hit.keyword}] 已丢弃")
+            return
+        if self.queue is None:
+            # 管线未启动 (脚本/测试场景)：直接同步落库
+            await self._commit([hit])
+            return
+        if self.queue.full():
+            self.backpressure_waits += 1
+            logger.warning(f"🐢 [落库管线] 队列已满 ({self.queue.qsize()})，触发背压")
+        await self.queue.put(hit)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0: break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._commit_with_retry(batch)
+            finally:
+                for _ in batch: self.queue.task_done()
+
+    async def _commit_with_retry(self, batch: list[ViolationHit], attempts: int = 3):
+        """只重试落库事务本身；事务提交后的扇出 (通知索引 / 聚合 / 扣分 / 花名册 / 同步信号) 每批只执行一次"""
+        for attempt in range(1, attempts + 1):
+            try:
+                seqs = await self._persist(batch)
+            except Exception as e:
+                logger.error(f"❌ [落库管线] 批次写入失败 ({attempt}/{attempts}, {len(batch)} 条): {e}")
+                if attempt < attempts: await asyncio.sleep(0.5 * attempt)
+                continue
+            await self._after_commit(batch, seqs)
+            return
+        await self._isolate(batch)
+
+    async def _isolate(self, batch: list[ViolationHit]):
+        """[故障隔离] 整批重试仍失败时二分拆批写入，只丢弃确实无法落库的单条命中"""
+        if len(batch) == 1:
+            h = batch[0]
+            self.dropped += 1
+            logger.error(f"🗑️ [落库管线] 命中无法落库，已丢弃: {h.kind} {h.record_id} ({h.username} / {h.keyword})")
+            return
+        mid = len(batch) // 2
+        for half in (batch[:mid], batch[mid:]):
+            try:
+                seqs = await self._persist(half)
+            except Exception:
+                await self._isolate(half)
+                continue
+            await self._after_commit(half, seqs)
+
+    async def _commit(self, batch: list[ViolationHit]):
+        """落库并执行提交后扇出 (管线未启动时的同步路径)"""
+        await self._after_commit(batch, await self._persist(batch))
+
+    async def _persist(self, batch: list[ViolationHit]) -> list[Optional[int]]:
+        """单个落库事务 (可安全重试)，返回各 RISK 命中对应的通知序号"""
+        started = time.perf_counter()
+        risk_hits = [h for h in batch if h.kind == ViolationHit.RISK]
+        dept_hits = [h for h in batch if h.kind == ViolationHit.DEPT]
+
+        seqs = await notification_center.allocate(len(risk_hits))
+        async with in_transaction() as conn:
+            if risk_hits:
+                await ViolationRecord.bulk_create([
+                    ViolationRecord(id=h.record_id, user_id=h.user_id, keyword=h.keyword, context=h.context,
+                                    risk_score=h.risk_score, timestamp=h.timestamp)
+                    for h in risk_hits
+                ], using_db=conn)
+                await Notification.bulk_create([
+                    Notification(id=h.record_id, title="战术拦截：触发高危行为",
+                                 content=f"坐席 {h.real_name} 命中关键词 [{h.keyword}]，系统已自动扣除 {h.risk_score} 战术分并完成取证。",
+                                 type="ALERT", created_at=h.timestamp,
+                                 seq=seq, target_user_id=h.user_id, target_dept_id=h.dept_id) # V5.81: 定向投递给本人及部门主管
+                    for h, seq in zip(risk_hits, seqs)
+                ], using_db=conn)
+
+            if dept_hits:
+                await DeptComplianceLog.bulk_create([
+                    DeptComplianceLog(id=h.record_id, user_id=h.user_id, word=h.keyword, context=h.context,
+                                      department_id=h.dept_id, timestamp=h.timestamp)
+                    for h in dept_hits
+                ], using_db=conn)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self.committed += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_commit_ms = elapsed
+        self.avg_commit_ms = elapsed if not self.avg_commit_ms else self.avg_commit_ms * 0.8 + elapsed * 0.2
+        logger.info(f"🛡️ [落库管线] 批次已提交: {len(batch)} 条 ({elapsed:.1f} ms)")
+        return seqs
+
+    async def _after_commit(self, batch: list[ViolationHit], seqs: list[Optional[int]]):
+        """[提交后扇出] 记录已落库，各步骤独立兜底：任一步失败只记录日志，不影响其余步骤、不触发重试"""
+        risk_hits = [h for h in batch if h.kind == ViolationHit.RISK]
+        if not risk_hits: return
+        try:
+            await notification_center.index([(seq, h.user_id, h.dept_id) for h, seq in zip(risk_hits, seqs)])
+        except Exception as e:
+            logger.error(f"⚠️ [落库管线] 通知索引失败: {e}")
+        await self._rollup(risk_hits)
+
+        # V5.80: 取证落库后经积分账本扣分 (同一批次内按用户合并，只减不加，合并后与逐条截断到 0 等价)
+        # V5.73: 修补实时花名册 (违规类型取批次内最新一条)
+        penalties, latest, names = defaultdict(int), {}, {}
+        for h in risk_hits:
+            penalties[h.user_id] += h.risk_score
+            latest[h.user_id] = h.keyword
+            names[h.user_id] = h.username
+        scores = {}
+        for uid, p in penalties.items():
+            try:
+                scores[uid] = await score_ledger.apply(uid, names[uid], -p)
+            except Exception as e:
+                logger.error(f"❌ [落库管线] 坐席 {names[uid]} 扣分 {p} 失败: {e}")
+        try:
+            await roster.patch_many([(names[uid], {"last_violation_type": latest[uid], **({"tactical_score": scores[uid]} if uid in scores else {})}, None) for uid in penalties])
+        except Exception as e:
+            logger.error(f"⚠️ [落库管线] 花名册修补失败: {e}")
+
+        # Redis 同步信号 (事务提交后发出)
+        client = redis_mgr.client
+        if client:
+            try:
+                for username in {h.username for h in risk_hits}:
+                    await client.publish("notif_channel", json.dumps({"type": "ALERT", "target": username}))
+            except Exception as e:
+                logger.error(f"⚠️ [落库管线] 通知同步信号发送失败: {e}")
+
+    async def _rollup(self, risk_hits: list[ViolationHit]):
+        """
+        V5.77: 累加违规聚合 (按唯一键排序写入，避免并发批次死锁)
+        在明细事务提交后单独执行：聚合写入失败只记录日志，不回滚明细、不触发整批重试 (可用 backfill_rollups.py 修复)
+        """
+        rollups = defaultdict(lambda: [0, 0])
+        for h in risk_hits:
+            key = (h.timestamp.date(), h.dept_id or 0, h.user_id, RiskBucket.of(h.risk_score), h.keyword)
+            rollups[key][0] += 1
+            rollups[key][1] += h.risk_score
+        keys = sorted(rollups)
+        try:
+            await Tortoise.get_connection("default").execute_query(
+                "INSERT INTO violation_rollups (day, department_id, user_id, risk_bucket, keyword, hits, score_total, is_deleted) VALUES "
+                + ",".join(["(%s, %s, %s, %s, %s, %s, %s, 0)"] * len(keys))
+                + " ON DUPLICATE KEY UPDATE hits = hits + VALUES(hits), score_total = score_total + VALUES(score_total)",
+                [v for k in keys for v in (*k, *rollups[k])]
+            )
+        except Exception as e:
+            self.rollup_failures += 1
+            logger.error(f"⚠️ [落库管线] 违规聚合累加失败 ({len(risk_hits)} 条)，明细已落库: {e}")
+
+    def stats(self) -> dict:
+        depth = self.queue.qsize() if self.queue else 0
+        return {
+            "queue_depth": depth,
+            "queue_limit": self.maxsize,
+            "congested": depth >= self.maxsize * 0.8,
+            "last_batch_size": self.last_batch_size,
+            "last_commit_ms": round(self.last_commit_ms, 1),
+            "avg_commit_ms": round(self.avg_commit_ms, 1),
+            "committed": self.committed,
+            "dropped": self.dropped,
+            "rollup_failures": self.rollup_failures,
+            "backpressure_waits": self.backpressure_waits
+        }
+
+
+violation_pipeline = ViolationPipeline()
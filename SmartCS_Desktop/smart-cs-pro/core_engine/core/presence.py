@@ -0,0 +1,106 @@
+import os, time, asyncio, logging
+from typing import Optional
+from utils.redis_utils import redis_mgr, PRESENCE_KEY
+from core.roster import roster
+
+logger = logging.getLogger("SmartCS")
+
+ACTIVITY_TTL = 86400
+
+
+class PresenceWriter:
+    """
+    [心跳合并写入] 在线心跳与活跃时间先记录在内存，由后台任务按固定间隔以一次 pipeline 批量刷入 Redis
+    同一操作员在一个间隔内无论收到多少帧只写一次；心跳 TTL (90s) 远大于刷新间隔，在线状态不受影响
+    在线索引 score 记录的是最后收帧时间，而非刷新时间
+    """
+
+    def __init__(self):
+        self.interval = float(os.getenv("PRESENCE_FLUSH_INTERVAL", 5))
+        self._seen: dict[str, float] = {}
+        self._activity: dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._pending_since = 0.0 # 当前缓冲区中最早一条记录的时间
+        # 运行指标
+        self.last_flush_at = 0.0
+        self.last_flush_ms = 0.0
+        self.last_flush_size = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def touch(self, username: str):
+        """收到任意帧时调用：仅记录内存，不产生 Redis 往返"""
+        now = time.time()
+        if not self._seen: self._pending_since = now
+        self._seen[username] = now
+
+    def activity(self, username: str):
+        """ACTIVITY_SYNC：记录最后一次物理动作时间"""
+        self._activity[username] = int(time.time())
+        self.touch(username)
+
+    def forget(self, username: str):
+        """链路下线时丢弃未刷新的记录，避免刷新时把已下线节点重新标记为在线"""
+        self._seen.pop(username, None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"💓 [心跳合并] 已启动: 每 {self.interval:g}s 批量刷新")
+
+    async def stop(self):
+        if self._task is None: return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        client = redis_mgr.client
+        if not client or not (self._seen or self._activity): return
+        seen, self._seen = self._seen, {}
+        pending_since, self._pending_since = self._pending_since, 0.0
+        activity, self._activity = self._activity, {}
+        started = time.perf_counter()
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                if seen: pipe.zadd(PRESENCE_KEY, seen)
+                for username, ts in activity.items():
+                    pipe.setex(f"last_activity:{username}", ACTIVITY_TTL, str(ts))
+                await pipe.execute()
+        except Exception as e:
+            # 写入失败：合并回缓冲区，等待下一轮 (期间新记录优先)
+            self.failures += 1
+            for username, ts in seen.items(): self._seen.setdefault(username, ts)
+            if seen: self._pending_since = pending_since
+            for username, ts in activity.items(): self._activity.setdefault(username, ts)
+            logger.error(f"⚠️ [心跳合并] 批量刷新失败，下轮重试 ({len(seen)} 条心跳): {e}")
+            return
+        # V5.73: 同步修补实时花名册的活跃时间 (一次脚本调用)
+        if activity:
+            await roster.patch_many([(username, {"last_activity": ts}, None) for username, ts in activity.items()])
+        self.flushes += 1
+        self.last_flush_at = time.time()
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        self.last_flush_size = len(seen) + len(activity)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "interval": self.interval,
+            "pending": len(self._seen) + len(self._activity),
+            "flush_lag": round(now - self.last_flush_at, 1) if self.last_flush_at else None, # 距上次成功刷新 (秒)
+            "oldest_pending": round(now - self._pending_since, 1) if self._seen else 0, # 最早一条未刷新记录的等待时长 (秒)
+            "last_flush_size": self.last_flush_size,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+            "flushes": self.flushes,
+            "failures": self.failures
+        }
+
+
+presence = PresenceWriter()
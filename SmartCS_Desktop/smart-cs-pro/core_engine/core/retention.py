@@ -0,0 +1,178 @@
+import os, json, gzip, time, heapq, secrets, asyncio, logging
+from itertools import count
+from datetime import datetime, timedelta
+from typing import Optional
+from tortoise import Tortoise
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+LOCK_KEY = "retention:lock"
+
+# 持有者续期 / 持有者释放
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "archive"))
+
+# 表名 -> (时间列, 主键, 保留天数)
+# user_rewards 不归档：坐席花名册与 /admin/agents 的 reward_count 直接统计在线表，归档会使其悄然变少
+POLICIES = {
+    "violation_records": ("timestamp", "id", int(os.getenv("RETENTION_VIOLATION_DAYS", 180))),
+    "dept_compliance_logs": ("timestamp", "id", int(os.getenv("RETENTION_COMPLIANCE_DAYS", 180))),
+    "audit_logs": ("created_at", "id", int(os.getenv("RETENTION_AUDIT_DAYS", 365))),
+}
+
+
+def _encode(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _month_file(table: str, month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, table, f"{month}.jsonl.gz")
+
+
+def _append_archive(table: str, by_month: dict[str, list[dict]]):
+    """追加为新的 gzip 成员 (同一月份文件可多次追加，读取时整体解压)，写完即落盘"""
+    os.makedirs(os.path.join(ARCHIVE_DIR, table), exist_ok=True)
+    for month, rows in by_month.items():
+        with open(_month_file(table, month), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+                for row in rows:
+                    gz.write((json.dumps(row, ensure_ascii=False, default=_encode) + "\n").encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+class RetentionEngine:
+    """
+    [冷数据归档] 超过保留期的取证 / 合规 / 审计记录按月导出为 gzip JSONL 冷档
+    (archive/{表}/{YYYY-MM}.jsonl.gz)，导出落盘后再按主键分批删除，在线表只保留热数据
+    - 先写档后删库：中途崩溃最多导致冷档中出现重复行，读取时按主键去重
+    - 多 worker 部署时经 Redis 短锁保证同一时刻只有一个进程执行归档；每处理一批续期一次，锁丢失即中止
+    - 违规统计由 violation_rollups 预聚合表承接，不受明细归档影响
+    """
+
+    def __init__(self):
+        self.chunk = int(os.getenv("RETENTION_CHUNK", 1000))
+        self.interval = float(os.getenv("RETENTION_INTERVAL", 86400))
+        self.enabled = os.getenv("RETENTION_ENABLED", "0") == "1"
+        self.lock_ttl = int(os.getenv("RETENTION_LOCK_TTL", 600))
+        self._lock_token: Optional[str] = None
+        self.last_run_at = 0.0
+        self.last_result: dict = {}
+
+    async def archive_table(self, table: str, cutoff: datetime) -> int:
+        ts_col, pk, _ = POLICIES[table]
+        conn = Tortoise.get_connection("default")
+        archived = 0
+        while True:
+            await self._renew_lock()
+            rows = await conn.execute_query_dict(
+                f"SELECT * FROM {table} WHERE {ts_col} < %s ORDER BY {ts_col}, {pk} LIMIT %s",
+                [cutoff.strftime('%Y-%m-%d %H:%M:%S'), self.chunk]
+            )
+            if not rows: break
+            by_month: dict[str, list[dict]] = {}
+            for row in rows:
+                by_month.setdefault(row[ts_col].strftime("%Y-%m"), []).append(row)
+            await asyncio.to_thread(_append_archive, table, by_month)
+            ids = [row[pk] for row in rows]
+            await conn.execute_query(f"DELETE FROM {table} WHERE {pk} IN ({','.join(['%s'] * len(ids))})", ids)
+            archived += len(rows)
+            if len(rows) < self.chunk: break
+        return archived
+
+    async def run(self, now: Optional[datetime] = None) -> dict:
+        """对全部策略执行一次归档，返回 表 -> 归档行数"""
+        now = now or datetime.now()
+        result = {}
+        for table, (_, _, days) in POLICIES.items():
+            try:
+                result[table] = await self.archive_table(table, now - timedelta(days=days))
+                if result[table]: logger.info(f"🗄️ [冷数据归档] {table}: 已归档 {result[table]} 行 (保留 {days} 天)")
+            except Exception as e:
+                result[table] = None
+                logger.error(f"❌ [冷数据归档] {table} 归档失败: {e}")
+        self.last_run_at, self.last_result = time.time(), result
+        return result
+
+    async def _renew_lock(self):
+        """持有归档锁时续期；锁已过期被其它进程接管则中止本轮归档"""
+        client = redis_mgr.client
+        if not self._lock_token or not client: return
+        if not await client.eval(_RENEW_SCRIPT, 1, LOCK_KEY, self._lock_token, self.lock_ttl):
+            raise RuntimeError("归档锁已丢失，中止本轮归档")
+
+    async def schedule_loop(self):
+        """[常驻任务] 定期归档 (RETENTION_ENABLED=1 时启用)"""
+        while True:
+            await asyncio.sleep(self.interval)
+            client = redis_mgr.client
+            token = secrets.token_hex(8)
+            try:
+                if client and not await client.set(LOCK_KEY, token, nx=True, ex=self.lock_ttl): continue
+                self._lock_token = token if client else None
+                try:
+                    await self.run()
+                finally:
+                    self._lock_token = None
+                    if client: await client.eval(_RELEASE_SCRIPT, 1, LOCK_KEY, token)
+            except Exception as e:
+                logger.error(f"⚠️ [冷数据归档] 定时任务异常: {e}")
+
+    # --- 冷档查询 ---
+    @staticmethod
+    def months(table: str) -> list[str]:
+        folder = os.path.join(ARCHIVE_DIR, table)
+        if table not in POLICIES or not os.path.isdir(folder): return []
+        return sorted(f[:-len(".jsonl.gz")] for f in os.listdir(folder) if f.endswith(".jsonl.gz"))
+
+    async def query(self, table: str, start: datetime, end: datetime, filters: Optional[dict] = None,
+                    keyword: str = "", limit: int = 100) -> dict:
+        """
+        [冷档检索] 扫描 [start, end) 覆盖的月份文件，按字段精确匹配 (filters) 与全文子串 (keyword) 过滤
+        结果按时间倒序，至多 limit 条 (以 limit 大小的最小堆保留最新命中)；scanned 为实际扫描的行数
+        - 主键去重只针对堆内的行：重复行时间相同，未入堆或已被挤出的行其副本同样进不了堆，内存始终为 O(limit)
+        - end 为开区间，末秒内带微秒的记录不会被漏掉
+        """
+        ts_col, pk, _ = POLICIES[table]
+        last = end - timedelta(microseconds=1)
+        months = [m for m in self.months(table) if start.strftime("%Y-%m") <= m <= last.strftime("%Y-%m")]
+        lo, hi = start.isoformat(), end.isoformat()
+        filters = {k: str(v) for k, v in (filters or {}).items() if v not in (None, "")}
+
+        def _scan():
+            kept, heap, scanned, order = set(), [], 0, count() # kept: 堆内行的主键
+            for month in reversed(months):
+                with gzip.open(_month_file(table, month), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        scanned += 1
+                        if keyword and keyword not in line: continue
+                        row = json.loads(line)
+                        if row[pk] in kept or not (lo <= row[ts_col] < hi): continue
+                        if any(str(row.get(k)) != v for k, v in filters.items()): continue
+                        item = (row[ts_col], next(order), row) # 序号保证同一时刻的行无需比较 dict
+                        if len(heap) < limit:
+                            heapq.heappush(heap, item)
+                        elif heap and item[0] > heap[0][0]:
+                            kept.discard(heapq.heapreplace(heap, item)[2][pk])
+                        else:
+                            continue
+                        kept.add(row[pk])
+            return [row for _, _, row in sorted(heap, reverse=True)], scanned
+
+        rows, scanned = await asyncio.to_thread(_scan)
+        return {"data": rows, "months": months, "scanned": scanned}
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "last_run_at": int(self.last_run_at), "last_result": self.last_result}
+
+
+retention = RetentionEngine()
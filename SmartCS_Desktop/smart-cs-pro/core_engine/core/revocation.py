@@ -0,0 +1,82 @@
+import os, time, asyncio, logging
+from datetime import datetime
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+REVOCATION_CHANNEL = "revocation_sync"
+
+
+class RevocationStore:
+    """
+    [进程内封禁表] username -> 封禁到期时间戳，鉴权时纯内存判定，无需逐请求查询 MySQL / Redis
+    - 启动时从 MySQL 全量加载未过期封禁，之后按固定间隔对账
+    - 封禁 / 解封经 Redis Pub/Sub 即时同步到全部 worker
+    - 条目到期后自动失效 (查询时惰性清理)
+    """
+
+    def __init__(self):
+        self._bans: dict[str, float] = {}
+        self.loaded_at = 0.0
+
+    def is_revoked(self, username: str) -> bool:
+        expires_at = self._bans.get(username)
+        if expires_at is None: return False
+        if expires_at > time.time(): return True
+        self._bans.pop(username, None)
+        return False
+
+    async def load(self):
+        """[全量对账] 以 MySQL blacklist 表为准重建封禁表"""
+        from tortoise import Tortoise
+        conn = Tortoise.get_connection("default")
+        rows = await conn.execute_query_dict(
+            "SELECT username, expired_at FROM blacklist WHERE expired_at > %s",
+            [datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
+        )
+        bans = {}
+        for row in rows:
+            expires_at = row["expired_at"].timestamp()
+            bans[row["username"]] = max(expires_at, bans.get(row["username"], 0))
+        self._bans = bans
+        self.loaded_at = time.time()
+        return len(bans)
+
+    async def revoke(self, username: str, expires_at: datetime):
+        """封禁至 expires_at (调用方负责写入 MySQL)，并通知其它 worker"""
+        ts = expires_at.timestamp()
+        self._bans[username] = max(ts, self._bans.get(username, 0))
+        await redis_mgr.publish(REVOCATION_CHANNEL, {"action": "REVOKE", "username": username, "expires_at": ts})
+
+    async def restore(self, username: str):
+        """解除封禁 (调用方负责删除 MySQL 记录)，并通知其它 worker"""
+        self._bans.pop(username, None)
+        await redis_mgr.publish(REVOCATION_CHANNEL, {"action": "RESTORE", "username": username})
+
+    async def on_message(self, data: dict):
+        username = data.get("username")
+        if not username: return
+        if data.get("action") == "REVOKE":
+            self._bans[username] = max(float(data.get("expires_at", 0)), self._bans.get(username, 0))
+        elif data.get("action") == "RESTORE":
+            self._bans.pop(username, None)
+
+    async def reconcile_loop(self, interval: float = None):
+        """[常驻任务] 兜底对账：弥补 Redis 断线期间错过的同步信号"""
+        interval = interval or float(os.getenv("REVOCATION_RECONCILE_INTERVAL", 300))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"⚠️ [封禁表] 对账失败: {e}")
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "active": sum(1 for ts in self._bans.values() if ts > now),
+            "loaded_at": int(self.loaded_at)
+        }
+
+
+revocations = RevocationStore()
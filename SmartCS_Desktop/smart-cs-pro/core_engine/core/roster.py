@@ -0,0 +1,193 @@
+import os, json, logging
+from typing import Optional
+from tortoise import Tortoise
+from tortoise.functions import Count
+from core.models import User, Department, UserReward
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+# 每个用户取最新一条记录 (按时间列)；同一时刻多条时任取其一，与原 order_by().first() 语义一致
+_LATEST_VIOLATION_SQL = """
+SELECT v.user_id, v.keyword AS value FROM violation_records v
+JOIN (
+    SELECT user_id, MAX(timestamp) AS ts FROM violation_records
+    WHERE is_deleted = 0 AND user_id IN ({ids}) GROUP BY user_id
+) m ON v.user_id = m.user_id AND v.timestamp = m.ts
+WHERE v.is_deleted = 0
+"""
+
+_LATEST_TRAINING_SQL = """
+SELECT t.user_id, t.progress AS value FROM training_sessions t
+JOIN (
+    SELECT user_id, MAX(updated_at) AS ts FROM training_sessions
+    WHERE user_id IN ({ids}) GROUP BY user_id
+) m ON t.user_id = m.user_id AND t.updated_at = m.ts
+"""
+
+
+async def _latest_per_user(sql: str, ids: list[int]) -> dict:
+    conn = Tortoise.get_connection("default")
+    rows = await conn.execute_query_dict(sql.format(ids=",".join(["%s"] * len(ids))), list(ids))
+    return {row["user_id"]: row["value"] for row in rows}
+
+
+async def load_live_state(usernames: list[str]) -> tuple[dict, dict]:
+    """一次 MGET 取回 活跃时间 与 锁定状态：返回 (username -> last_activity, username -> is_locked)"""
+    client = redis_mgr.client
+    if not client or not usernames: return {}, {}
+    values = await client.mget([f"last_activity:{u}" for u in usernames] + [f"agent_lock_status:{u}" for u in usernames])
+    n = len(usernames)
+    activity = {u: int(v) for u, v in zip(usernames, values[:n]) if v}
+    locked = {u: v == "1" for u, v in zip(usernames, values[n:])}
+    return activity, locked
+
+
+async def build_roster(agents: list[dict], online: set) -> list[dict]:
+    """
+    [批量组装] 花名册一页数据由固定数量的集合查询拼装，查询次数与分页大小无关：
+    部门名称 / 奖励计数 / 主管标记 各一次分组查询，最新违规 / 最新培训各一次 latest-per-user 原生查询，
+    活跃度与锁定状态一次 MGET
+    agents 为 User.values(id, username, real_name, role_id, role__name, role__code, tactical_score, department_id)
+    """
+    if not agents: return []
+    ids = [a["id"] for a in agents]
+    dept_ids = {a["department_id"] for a in agents if a["department_id"]}
+
+    dept_names = dict(await Department.filter(id__in=dept_ids).values_list("id", "name")) if dept_ids else {}
+    reward_counts = dict(await UserReward.filter(user_id__in=ids).annotate(c=Count("id")).group_by("user_id").values_list("user_id", "c"))
+    managers = set(await Department.filter(manager_id__in=ids, is_deleted=0).values_list("manager_id", flat=True))
+    last_violation = await _latest_per_user(_LATEST_VIOLATION_SQL, ids)
+    training = await _latest_per_user(_LATEST_TRAINING_SQL, ids)
+    activity, locked = await load_live_state([a["username"] for a in agents])
+
+    return [{
+        "id": a["id"], # 显式包含 ID 用于管理
+        "username": a["username"], "real_name": a["real_name"],
+        "role_id": a["role_id"], "role_name": a["role__name"], "role_code": a["role__code"],
+        "dept_name": dept_names.get(a["department_id"], "全域节点") if a["department_id"] else "全域节点",
+        "department_id": a["department_id"], # 确保回传 ID 用于前端回填
+        "is_manager": a["id"] in managers, "is_online": a["username"] in online,
+        "is_locked": locked.get(a["username"], False),
+        "tactical_score": a["tactical_score"], "reward_count": reward_counts.get(a["id"], 0),
+        "training_progress": training.get(a["id"], 0),
+        "last_violation_type": last_violation.get(a["id"]),
+        "last_activity": activity.get(a["username"]) # 返回活跃时间戳
+    } for a in agents]
+
+
+# KEYS[1]=roster:index KEYS[2]=roster:version; ARGV[1]=[[username, {字段: 新值}, {字段: 增量}], ...]
+# 仅修补已在快照中的行 (未构建的部门由首次读取时全量构建)；数值增量截断到 0
+_PATCH_SCRIPT = """
+local patches = cjson.decode(ARGV[1])
+local version = false
+for _, p in ipairs(patches) do
+    local dept = redis.call('HGET', KEYS[1], p[1])
+    if dept then
+        local key = 'roster:' .. dept
+        local raw = redis.call('HGET', key, p[1])
+        if raw then
+            local row = cjson.decode(raw)
+            if type(p[2]) == 'table' then
+                for k, v in pairs(p[2]) do row[k] = v end
+            end
+            if type(p[3]) == 'table' then
+                for k, v in pairs(p[3]) do
+                    local n = (tonumber(row[k]) or 0) + v
+                    if n < 0 then n = 0 end
+                    row[k] = n
+                end
+            end
+            version = redis.call('INCR', KEYS[2])
+            row['version'] = version
+            redis.call('HSET', key, p[1], cjson.encode(row))
+            redis.call('ZADD', 'roster:changes:' .. dept, version, p[1])
+        end
+    end
+end
+return version
+"""
+
+
+class RosterSnapshot:
+    """
+    [实时花名册] 按部门在 Redis 中维护花名册快照，指挥屏直接读取，无需每次轮询都回源 MySQL
+    - roster:{dept}          HASH  username -> 行 JSON (含该行最后修改的 version)
+    - roster:changes:{dept}  ZSET  username -> 最后修改 version，用于增量拉取
+    - roster:index           HASH  username -> dept，事件侧据此定位所在部门
+    - roster:version         全局单调版本号；roster:reset:{dept} 记录该部门最近一次全量构建的版本
+    违规落库、奖励、锁定指令、上下线等事件通过 Lua 脚本原子修补单行；人员变动时整部门作废，下次读取重建
+    """
+
+    def __init__(self):
+        self.ttl = int(os.getenv("ROSTER_SNAPSHOT_TTL", 600)) # 快照定期重建，兜底吸收未经事件修补的变更
+
+    @staticmethod
+    def _dept_key(dept_id) -> str:
+        return str(dept_id or 0)
+
+    async def build(self, dept_id) -> int:
+        """[全量构建] 从 MySQL 组装整个部门的花名册并写入快照"""
+        client = redis_mgr.client
+        query = User.filter(is_deleted=0)
+        query = query.filter(department_id=dept_id) if dept_id else query.filter(department_id__isnull=True)
+        agents = await query.order_by("-id").values("id", "username", "real_name", "role_id", "role__name", "role__code", "tactical_score", "department_id")
+        rows = await build_roster(agents, await redis_mgr.get_online_list())
+
+        d = self._dept_key(dept_id)
+        version = await client.incr("roster:version")
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.delete(f"roster:{d}", f"roster:changes:{d}")
+            if rows:
+                pipe.hset(f"roster:{d}", mapping={r["username"]: json.dumps({**r, "version": version}, ensure_ascii=False) for r in rows})
+                pipe.hset("roster:index", mapping={r["username"]: d for r in rows})
+                pipe.zadd(f"roster:changes:{d}", {r["username"]: version for r in rows})
+            pipe.set(f"roster:reset:{d}", version)
+            pipe.set(f"roster:built:{d}", 1, ex=self.ttl)
+            await pipe.execute()
+        logger.info(f"📋 [实时花名册] 部门 {d} 快照已构建: {len(rows)} 人 (v{version})")
+        return version
+
+    async def read(self, dept_id, since_version: Optional[int] = None) -> dict:
+        """
+        返回 {version, full, rows}：since_version 为空、早于最近一次全量构建或快照已过期时返回全量，
+        否则仅返回 version 大于 since_version 的行
+        """
+        client = redis_mgr.client
+        d = self._dept_key(dept_id)
+        if not await client.exists(f"roster:built:{d}"):
+            await self.build(dept_id)
+        version = int(await client.get("roster:version") or 0)
+        reset = int(await client.get(f"roster:reset:{d}") or 0)
+        if since_version is None or since_version < reset:
+            raw = await client.hvals(f"roster:{d}")
+            return {"version": version, "full": True, "rows": [json.loads(r) for r in raw]}
+        changed = await client.zrangebyscore(f"roster:changes:{d}", f"({since_version}", "+inf")
+        raw = await client.hmget(f"roster:{d}", changed) if changed else []
+        return {"version": version, "full": False, "rows": [json.loads(r) for r in raw if r]}
+
+    async def patch(self, username: str, values: Optional[dict] = None, delta: Optional[dict] = None):
+        await self.patch_many([(username, values, delta)])
+
+    async def patch_many(self, patches: list):
+        """[增量修补] patches 为 (username, {字段: 新值}, {字段: 增量}) 列表，一次脚本调用完成"""
+        client = redis_mgr.client
+        if not client or not patches: return
+        try:
+            await client.eval(_PATCH_SCRIPT, 2, "roster:index", "roster:version",
+                              json.dumps([[u, v or {}, d or {}] for u, v, d in patches], ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"⚠️ [实时花名册] 修补失败 ({len(patches)} 行): {e}")
+
+    async def invalidate(self, *dept_ids):
+        """人员增删 / 调岗 / 部门调整后作废快照；不传参数表示作废全部部门"""
+        client = redis_mgr.client
+        if not client: return
+        if dept_ids:
+            keys = [f"roster:built:{self._dept_key(d)}" for d in dept_ids]
+        else:
+            keys = [k async for k in client.scan_iter(match="roster:built:*")]
+        if keys: await client.delete(*keys)
+
+
+roster = RosterSnapshot()
@@ -0,0 +1,228 @@
+import os, time, secrets, asyncio, logging
+from datetime import datetime
+from typing import Optional
+from redis.exceptions import ResponseError
+from tortoise.transactions import in_transaction
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+LEDGER_STREAM = "score:ledger"    # 积分流水 (持久化 Stream，写回 MySQL 的唯一来源)
+LEDGER_GROUP = "score_writer"
+LEDGER_CONSUMER = "writer"        # 固定消费者名：新任写回者接管上一任未确认的条目
+LEADER_KEY = "score:writer:leader"
+SCORE_MIN, SCORE_MAX = 0, 100
+
+# KEYS[1]=score:{uid} KEYS[2]=score:ledger
+# ARGV[1]=增量 ARGV[2]=种子分 ('' 表示未提供) ARGV[3]=键 TTL ARGV[4..]=流水附加字段
+# 流水不在追加时按长度裁剪 (会裁掉写回者尚未确认的条目)，由写回者确认后按 MINID 裁剪
+# 缓存缺失且未提供种子时返回 nil，由调用方从 MySQL 取种子后重试
+_APPLY_SCRIPT = """
+local cur = redis.call('GET', KEYS[1])
+if not cur then
+    if ARGV[2] == '' then return false end
+    cur = ARGV[2]
+end
+local old = tonumber(cur)
+local new = old + tonumber(ARGV[1])
+if new > 100 then new = 100 elseif new < 0 then new = 0 end
+redis.call('SET', KEYS[1], new, 'EX', ARGV[3])
+local fields = {'score', tostring(new), 'applied', tostring(new - old)}
+for i = 4, #ARGV do fields[#fields + 1] = ARGV[i] end
+redis.call('XADD', KEYS[2], '*', unpack(fields))
+return new
+"""
+
+# 持有者续期，空闲时抢占
+_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) and 1 or 0
+"""
+
+
+class ScoreLedger:
+    """
+    [积分账本] 战术分变动在 Redis 中原子结算 (Lua 截断到 0..100 并返回新值)，同一坐席的突发扣分 / 奖励不再争抢 users 行锁
+    - score:{uid}    当前战术分，首次变动时以 MySQL 为种子
+    - score:ledger   每次变动追加一条流水 (含结算后的绝对分值与奖励明细)
+    - 写回者：全部 worker 中仅一个持有 leader 锁，经消费组批量读取流水，按用户写入最终绝对分值并补录 user_rewards；
+      写库成功后才 XACK，进程崩溃后由下一任写回者重放未确认条目 (绝对分值 + ledger_id 唯一键保证重放幂等)
+    Redis 不可用时退化为单条 UPDATE 直写 MySQL；Redis 恢复后把降级期间的增量补记到缓存分值 (缓存不存在时以 MySQL 为准)，
+    因此无论哪个 worker 先恢复结算，缓存分值都不会覆盖掉降级直写的变动
+    """
+
+    def __init__(self):
+        self.key_ttl = int(os.getenv("SCORE_KEY_TTL", 7 * 86400))
+        self.maxlen = int(os.getenv("SCORE_LEDGER_MAXLEN", 100000)) # 积压告警阈值 (未写回的流水条数)
+        self.batch_size = int(os.getenv("SCORE_FLUSH_BATCH", 500))
+        self._token = secrets.token_hex(8)
+        self._task: Optional[asyncio.Task] = None
+        self._pending: dict[int, list] = {} # 降级直写期间的增量：用户 -> [用户名, 累计增量]，Redis 恢复后补记
+        self.is_leader = False
+        self.flushed = 0
+        self.fallbacks = 0
+        self.last_flush_ms = 0.0
+
+    # --- 结算 ---
+    async def apply(self, user_id: int, username: str, delta: int, reward: Optional[tuple] = None) -> int:
+        """结算一次分值变动并返回新分值；reward 为 (类型, 标题, 数值)，写回时补录到 user_rewards"""
+        client = redis_mgr.client
+        if client:
+            try:
+                if self._pending: await self._replay_fallbacks(client)
+                extra = ["uid", user_id, "username", username, "delta", delta, "ts", time.time()]
+                if reward: extra += ["reward_type", reward[0], "title", reward[1], "value", reward[2]]
+                keys = (f"score:{user_id}", LEDGER_STREAM)
+                score = await client.eval(_APPLY_SCRIPT, 2, *keys, delta, "", self.key_ttl, *extra)
+                if score is None:
+                    seed = await self._db_score(user_id)
+                    score = await client.eval(_APPLY_SCRIPT, 2, *keys, delta, seed, self.key_ttl, *extra)
+                return int(score)
+            except Exception as e:
+                logger.error(f"⚠️ [积分账本] Redis 结算失败，降级直写 MySQL: {e}")
+        return await self._apply_db(user_id, username, delta, reward)
+
+    async def _db_score(self, user_id: int) -> int:
+        from core.models import User
+        score = await User.filter(id=user_id).first().values_list("tactical_score", flat=True)
+        return score or 0
+
+    async def _apply_db(self, user_id: int, username: str, delta: int, reward: Optional[tuple]) -> int:
+        from core.models import UserReward
+        self.fallbacks += 1
+        async with in_transaction() as conn:
+            await conn.execute_query(
+                "UPDATE users SET tactical_score = LEAST(%s, GREATEST(%s, tactical_score + %s)) WHERE id = %s",
+                [SCORE_MAX, SCORE_MIN, delta, user_id]
+            )
+            if reward:
+                await UserReward.create(user_id=user_id, type=reward[0], title=reward[1], value=reward[2], using_db=conn)
+            rows = await conn.execute_query_dict("SELECT tactical_score FROM users WHERE id = %s", [user_id])
+        pending = self._pending.setdefault(user_id, [username, 0])
+        pending[1] += delta
+        return rows[0]["tactical_score"] if rows else 0
+
+    async def _replay_fallbacks(self, client):
+        """
+        [降级补记] 降级期间的增量以不带种子的结算脚本补记：缓存分值存在时叠加增量并追加流水 (写回者随后覆盖 MySQL)，
+        缓存不存在时脚本不做任何事，后续结算从 MySQL (已含该增量) 取种子；奖励已在降级时直接入库，补记流水不再携带
+        """
+        for user_id in list(self._pending):
+            username, delta = self._pending[user_id]
+            extra = ["uid", user_id, "username", username, "delta", delta, "ts", time.time()]
+            await client.eval(_APPLY_SCRIPT, 2, f"score:{user_id}", LEDGER_STREAM, delta, "", self.key_ttl, *extra)
+            del self._pending[user_id]
+        logger.info("📒 [积分账本] Redis 已恢复，降级期间的分值变动已补记")
+
+    # --- 写回 ---
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        client = redis_mgr.client
+        if client and self.is_leader:
+            try:
+                if await client.get(LEADER_KEY) == self._token: await client.delete(LEADER_KEY)
+            except Exception:
+                pass
+        self.is_leader = False
+
+    async def _acquire(self, client) -> bool:
+        self.is_leader = bool(await client.eval(_LEADER_SCRIPT, 1, LEADER_KEY, self._token, 15))
+        return self.is_leader
+
+    async def _run(self):
+        while True:
+            try:
+                client = redis_mgr.client
+                if client and self._pending: await self._replay_fallbacks(client)
+                if not client or not await self._acquire(client):
+                    await asyncio.sleep(5)
+                    continue
+                try:
+                    await client.xgroup_create(LEDGER_STREAM, LEDGER_GROUP, id="0", mkstream=True)
+                except ResponseError as e:
+                    if "BUSYGROUP" not in str(e): raise
+                logger.info("📒 [积分账本] 已接管写回，开始重放未确认流水")
+
+                cursor = "0" # 先重放已投递未确认的条目，再消费新条目
+                while await self._acquire(client):
+                    if self._pending: await self._replay_fallbacks(client)
+                    resp = await client.xreadgroup(LEDGER_GROUP, LEDGER_CONSUMER, {LEDGER_STREAM: cursor},
+                                                   count=self.batch_size, block=None if cursor == "0" else 1000)
+                    entries = resp[0][1] if resp else []
+                    if not entries:
+                        cursor = ">"
+                        continue
+                    await self._flush(client, entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.is_leader = False
+                logger.error(f"⚠️ [积分账本] 写回异常，3 秒后重试: {e}")
+                await asyncio.sleep(3)
+
+    async def _flush(self, client, entries: list):
+        started = time.perf_counter()
+        scores, rewards, ids = {}, [], []
+        for entry_id, data in entries:
+            ids.append(entry_id)
+            if not data: continue # 已被裁剪的条目 (旧版追加时按 MAXLEN 裁剪的遗留)
+            user_id = int(data["uid"])
+            scores[user_id] = int(data["score"]) # 流水按序读取，最后一条即最新绝对分值
+            if data.get("reward_type"):
+                rewards.append((entry_id, user_id, data["reward_type"], data["title"], int(data["value"]),
+                                datetime.fromtimestamp(float(data["ts"]))))
+
+        async with in_transaction() as conn:
+            for user_id in sorted(scores):
+                await conn.execute_query("UPDATE users SET tactical_score = %s WHERE id = %s", [scores[user_id], user_id])
+            if rewards:
+                await conn.execute_query(
+                    "INSERT IGNORE INTO user_rewards (ledger_id, user_id, type, title, value, created_at, is_deleted) VALUES "
+                    + ",".join(["(%s, %s, %s, %s, %s, %s, 0)"] * len(rewards)),
+                    [v for r in rewards for v in r]
+                )
+        await client.xack(LEDGER_STREAM, LEDGER_GROUP, *ids)
+        await self._trim(client, ids[-1])
+
+        self.flushed += len(ids)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"📒 [积分账本] 流水已写回: {len(ids)} 条 / {len(scores)} 人 ({self.last_flush_ms:.1f} ms)")
+
+    async def _trim(self, client, last_acked: str):
+        """裁剪已写回的流水：保留最早的未确认条目及其之后的全部条目，绝不裁掉尚未写回的变动"""
+        pending = await client.xpending(LEDGER_STREAM, LEDGER_GROUP)
+        min_id = pending["min"] if pending["pending"] else last_acked
+        await client.xtrim(LEDGER_STREAM, minid=min_id, approximate=True)
+        backlog = await client.xlen(LEDGER_STREAM)
+        if backlog > self.maxlen:
+            logger.warning(f"🚨 [积分账本] 流水积压 {backlog} 条，超过告警阈值 {self.maxlen}，请检查写回者与 MySQL 状态")
+
+    async def stats(self) -> dict:
+        pending = None
+        client = redis_mgr.client
+        if client:
+            try:
+                pending = (await client.xpending(LEDGER_STREAM, LEDGER_GROUP))["pending"]
+            except Exception:
+                pass
+        return {
+            "leader": self.is_leader,
+            "pending": pending,
+            "flushed": self.flushed,
+            "fallbacks": self.fallbacks,
+            "pending_fallbacks": len(self._pending),
+            "last_flush_ms": round(self.last_flush_ms, 1)
+        }
+
+
+score_ledger = ScoreLedger()
@@ -1,77 +1,47 @@
-import json, secrets, logging
-from tortoise.transactions import in_transaction
-from core.models import User, ViolationRecord, Notification
+import json, time, secrets, logging
+from core.models import User
+from core.pipeline import violation_pipeline, ViolationHit
+from core.word_dict import word_dict
+from core.roster import roster
+from core.score_ledger import score_ledger
 
 logger = logging.getLogger("SmartCS")
 
-async def execute_violation_workflow(username: str, keyword: str, context: str, risk_score: int, redis_client=None):
+async def execute_violation_workflow(session, keyword: str, context: str, risk_score: int) -> str:
     """
-    [工业级事务] 违规处理闭环：记录取证记录 + 扣除战术分 + 生成系统通知
+    [违规闭环] 取证记录 + 扣除战术分 + 系统通知，交由异步落库管线攒批提交
+    返回预分配的取证记录 ID，可立即用于实时推送
     """
-    try:
-        async with in_transaction() as conn:
-            # 1. 锁定并获取用户信息 (防止并发更新分数冲突)
-            user = await User.select_for_update().get(username=username)
-            
-            # 2. 插入违规取证记录
-            await ViolationRecord.create(
-                id=secrets.token_hex(12),
-                user=user,
-                keyword=keyword,
-                context=context,
-                risk_score=risk_score,
-                using_db=conn
-            )
-            
-            # 3. 更新战术评分 (逻辑：分数越低越危险)
-            user.tactical_score = max(0, user.tactical_score - risk_score)
-            await user.save(using_db=conn)
-            
-            # 4. 生成系统通知
-            await Notification.create(
-                id=secrets.token_hex(12),
-                title="战术拦截：触发高危行为",
-                content=f"坐席 {user.real_name} 命中关键词 [{keyword}]，系统已自动扣除 {risk_score} 战术分并完成取证。",
-                type="ALERT",
-                using_db=conn
-            )
-            
-            # 5. Redis 同步信号
-            if redis_client:
-                await redis_client.publish("notif_channel", json.dumps({"type": "ALERT", "target": username}))
-            
-            logger.info(f"🛡️ [事务成功] 违规闭环已完成: {username}")
-            return True
-    except Exception as e:
-        logger.error(f"❌ [事务失败] 违规处理回滚: {e}")
-        return False
+    record_id = secrets.token_hex(12)
+    await violation_pipeline.submit(ViolationHit(ViolationHit.RISK, record_id, session, keyword, context, risk_score))
+    return record_id
+
+async def record_compliance_hit(session, word: str, context: str) -> str:
+    """[合规审计] 部门规避词命中记录，同样经由落库管线"""
+    record_id = secrets.token_hex(12)
+    await violation_pipeline.submit(ViolationHit(ViolationHit.DEPT, record_id, session, word, context))
+    return record_id
 
 async def grant_user_reward(user_id: int, type: str, title: str, value: int, ws_manager=None):
     """
     [实战奖励] 为操作员注入战术奖励 (积分/勋章) 并实时推送信号
+    V5.80: 经积分账本在 Redis 中结算，奖励记录由写回者批量补录，不再锁定 users 行
     """
-    from core.models import UserReward
-    async with in_transaction() as conn:
-        user = await User.select_for_update().get(id=user_id)
-        # 如果是积分奖励
-        if type == 'SCORE':
-            user.tactical_score = min(100, user.tactical_score + value)
-            await user.save(using_db=conn)
-        
-        await UserReward.create(
-            user=user, type=type, title=title, value=value, using_db=conn
-        )
+    user = await User.get(id=user_id).values("username", "department_id")
+    score = await score_ledger.apply(user_id, user["username"], value if type == 'SCORE' else 0, reward=(type, title, value))
 
-        if ws_manager:
-            import time
-            await ws_manager.broadcast({
-                "type": "REWARD",
-                "username": user.username,
-                "reward_type": type,
-                "title": title,
-                "value": value,
-                "timestamp": time.time() * 1000
-            })
+    if ws_manager:
+        # 仅推送给本人及其所属部门的指挥节点
+        await ws_manager.broadcast_to_dept_command({
+            "type": "REWARD",
+            "username": user["username"],
+            "reward_type": type,
+            "title": title,
+            "value": value,
+            "timestamp": time.time() * 1000
+        }, user["department_id"], also=user["username"])
+    # V5.73: 修补实时花名册
+    await roster.patch(user["username"], {"tactical_score": score}, {"reward_count": 1})
     return True
 
 async def start_recruit_training(user_id: int):
@@ -87,52 +57,42 @@ class SmartScanner:
         self.ocr = None
         self.last_hash = ""
 
-    async def process(self, text, username="admin", redis_client=None, ws_manager=None):
-        if not text: return False
-        
-        # 1. 物理定位操作员
-        user = await User.get_or_none(username=username).select_related("department")
-        if not user: return False
+    async def process(self, text, session, redis_client=None, ws_manager=None):
+        """[实时扫描] session 为握手时构建的链路会话 (core.session.AgentSession)，热路径不再查库"""
+        if not text or not session.user_id: return False
+        username = session.username
 
-        # 2. 扫描高危全域敏感词
-        words = await SensitiveWord.filter(is_active=1).values("word", "risk_level")
-        for w in words:
-            if w["word"] in text:
-                await execute_violation_workflow(username, w["word"], text, w["risk_level"], redis_client=redis_client)
-                if ws_manager:
-                    await ws_manager.broadcast({
-                        "type": "VIOLATION",
-                        "username": username,
-                        "keyword": w["word"],
-                        "risk_level": w["risk_level"],
-                        "context": text,
-                        "id": secrets.token_hex(12)
-                    })
-                return True 
+        # V5.60: 自动机单次扫描，取代逐词 in 循环
+        await word_dict.ensure_ready()
 
-        # 3. 扫描部门规避词 (V3.33 静默拦截)
-        from tortoise.expressions import Q
-        dept_words = await DeptSensitiveWord.filter(
-            Q(department_id__isnull=True) | Q(department_id=user.department_id),
-            is_active=1, is_deleted=0
-        ).values("word", "suggestion")
+        # 2. 扫描高危全域敏感词 (多词命中时取风险等级最高者)
+        hit = word_dict.match_risk(text)
+        if hit:
+            record_id = await execute_violation_workflow(session, hit.word, text, hit.payload)
+            if ws_manager:
+                await ws_manager.broadcast_to_dept_command({
+                    "type": "VIOLATION",
+                    "username": username,
+                    "keyword": hit.word,
+                    "risk_level": hit.payload,
+                    "context": text,
+                    "offset": [hit.start, hit.end],
+                    "id": record_id
+                }, session.dept_id, also=username)
+            return True 
 
-        for dw in dept_words:
-            if dw["word"] in text:
-                # 记录合规审计
-                await DeptComplianceLog.create(
-                    id=secrets.token_hex(12),
-                    user=user,
-                    word=dw["word"],
-                    context=text,
-                    department_id=user.department_id
-                )
-                if ws_manager:
-                    await ws_manager.broadcast({
-                        "type": "TACTICAL_DEPT_VIOLATION",
-                        "username": username,
-                        "keyword": dw["word"],
-                        "suggestion": dw.get("suggestion") or "请注意用语规范"
-                    })
-                return True
+        # 3. 扫描部门规避词 (V3.33 静默拦截)
+        dept_hit = word_dict.match_dept(text, session.dept_id)
+        if dept_hit:
+            # 记录合规审计
+            await record_compliance_hit(session, dept_hit.word, text)
+            if ws_manager:
+                await ws_manager.broadcast_to_dept_command({
+                    "type": "TACTICAL_DEPT_VIOLATION",
+                    "username": username,
+                    "keyword": dept_hit.word,
+                    "offset": [dept_hit.start, dept_hit.end],
+                    "suggestion": dept_hit.payload or "请注意用语规范"
+                }, session.dept_id, also=username)
+            return True
         return False 
@@ -0,0 +1,100 @@
+import logging
+from typing import Optional
+from core.constants import RoleID
+from core.models import User
+from core.bus import bus
+
+logger = logging.getLogger("SmartCS")
+
+
+class AgentSession:
+    """
+    [链路会话] WS 握手时构建一次的操作员身份快照，整条链路的每条消息复用
+    资料变更时由 SessionRegistry.refresh 原地刷新，持有者无需重新获取
+    """
+    __slots__ = ("username", "user_id", "dept_id", "role_id", "real_name")
+
+    def __init__(self, username: str, user_id: Optional[int], dept_id: Optional[int], role_id: int, real_name: str):
+        self.username = username
+        self.user_id = user_id
+        self.dept_id = dept_id
+        self.role_id = role_id
+        self.real_name = real_name
+
+    @classmethod
+    def from_claims(cls, username: str, claims: dict) -> "AgentSession":
+        """以令牌载荷构建 (DB 不可用时的降级路径)"""
+        return cls(
+            username=username,
+            user_id=claims.get("id"),
+            dept_id=claims.get("dept_id") or None,
+            role_id=claims.get("role_id", RoleID.AGENT),
+            real_name=claims.get("real_name") or username
+        )
+
+    @classmethod
+    async def load(cls, username: str, claims: Optional[dict] = None) -> "AgentSession":
+        """以 DB 为准构建会话，查询失败时回退到令牌载荷"""
+        session = cls.from_claims(username, claims or {})
+        try:
+            await session.refresh()
+        except Exception as e:
+            logger.error(f"⚠️ [链路会话] 资料加载失败，沿用令牌载荷: {username} ({e})")
+        return session
+
+    async def refresh(self) -> bool:
+        row = await User.filter(username=self.username, is_deleted=0).first().values("id", "real_name", "role_id", "department_id")
+        if not row: return False
+        self.user_id = row["id"]
+        self.real_name = row["real_name"] or self.username
+        self.role_id = row["role_id"]
+        self.dept_id = row["department_id"]
+        return True
+
+
+class SessionRegistry:
+    """[会话登记簿] 当前进程内在线链路的会话索引 (username -> AgentSession)"""
+
+    def __init__(self):
+        self._sessions: dict[str, AgentSession] = {}
+        self._listeners: list = []
+
+    def add_listener(self, callback):
+        """注册资料变更回调 callback(session, old_role_id, old_dept_id)，用于维护角色/部门索引"""
+        self._listeners.append(callback)
+
+    def register(self, session: AgentSession):
+        self._sessions[session.username] = session
+
+    def unregister(self, session: AgentSession):
+        # 仅移除同一对象，避免旧链路断开时误删重连后的新会话
+        if self._sessions.get(session.username) is session:
+            del self._sessions[session.username]
+
+    def get(self, username: str) -> Optional[AgentSession]:
+        return self._sessions.get(username)
+
+    def attach_bus(self):
+        """注册跨进程总线处理器：其它 worker 发起的资料变更在本 worker 同步刷新"""
+        bus.on("session_refresh", self._on_bus_refresh)
+
+    async def _on_bus_refresh(self, envelope: dict):
+        await self.refresh(envelope["username"], propagate=False)
+
+    async def refresh(self, username: str, propagate: bool = True):
+        """[资料变更] 操作员信息/角色调整后调用，原地刷新在线会话 (链路可能在其它 worker，默认经总线通知)"""
+        if propagate: await bus.publish("session_refresh", username=username)
+        session = self._sessions.get(username)
+        if not session: return
+        old_role_id, old_dept_id = session.role_id, session.dept_id
+        try:
+            await session.refresh()
+            if (session.role_id, session.dept_id) != (old_role_id, old_dept_id):
+                for callback in self._listeners:
+                    callback(session, old_role_id, old_dept_id)
+            logger.info(f"🔄 [链路会话] 已刷新: {username} (角色 {session.role_id}, 部门 {session.dept_id})")
+        except Exception as e:
+            logger.error(f"⚠️ [链路会话] 刷新失败: {username} ({e})")
+
+
+sessions = SessionRegistry()
@@ -0,0 +1,125 @@
+import os, json, time, asyncio, logging, jwt
+from collections import OrderedDict
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+EPOCH_KEY = "auth:epochs" # HASH: username -> 撤销纪元 (秒，含小数)，"*" 为全局纪元
+ROLE_PERMS_KEY = "auth:role_perms" # HASH: role_id -> 角色当前权限集 (JSON)，覆盖令牌内签发时的权限
+EPOCH_CHANNEL = "auth_epoch"
+GLOBAL = "*"
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    """令牌签发时间早于撤销纪元"""
+
+
+class TokenCache:
+    """
+    [令牌验签缓存] 已验签的 JWT -> 解析后的载荷 (permissions 预编译为 frozenset)，有界 LRU
+    - 命中时只比对 exp 与撤销纪元，不再重复 HMAC 验签与解析
+    - 撤销纪元：签发时间 (iat) 早于 用户纪元 / 全局纪元 的令牌一律失效，
+      强制下线、角色调整时提升纪元即可批量作废，无需逐个定位令牌
+    - 角色权限变更不撤销令牌：记录角色当前权限集，验签时覆盖令牌载荷中的 permissions，该角色用户无需重新登录
+    纪元与角色权限持久化在 Redis，变更经 Pub/Sub 同步到全部 worker
+    """
+
+    def __init__(self):
+        self.maxsize = int(os.getenv("TOKEN_CACHE_SIZE", 4096))
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._epochs: dict[str, float] = {}
+        self._role_perms: dict[int, frozenset] = {}
+        self.hits = 0
+        self.misses = 0
+
+    # --- 验签 ---
+    def verify(self, token: str, secret: str, algorithm: str) -> dict:
+        """返回载荷副本；过期抛 ExpiredSignatureError，已撤销抛 TokenRevoked，其余同 jwt.decode"""
+        entry = self._entries.get(token)
+        if entry is not None:
+            payload, exp = entry
+            if exp <= time.time():
+                del self._entries[token]
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            self._entries.move_to_end(token)
+            self.hits += 1
+        else:
+            self.misses += 1
+            payload = jwt.decode(token, secret, algorithms=[algorithm])
+            payload["permissions"] = frozenset(payload.get("permissions") or ())
+            exp = float(payload.get("exp") or float("inf"))
+            self._entries[token] = (payload, exp)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        if self._is_revoked(payload):
+            self._entries.pop(token, None)
+            raise TokenRevoked("Token has been revoked")
+        payload = dict(payload)
+        perms = self._role_perms.get(payload.get("role_id"))
+        if perms is not None: payload["permissions"] = perms
+        return payload
+
+    def _is_revoked(self, payload: dict) -> bool:
+        if not self._epochs: return False
+        iat = payload.get("iat") or 0 # 旧版令牌无 iat，任何纪元提升都会使其失效
+        epoch = max(self._epochs.get(GLOBAL, 0), self._epochs.get(payload.get("username"), 0))
+        return iat < epoch
+
+    # --- 撤销纪元 ---
+    async def load_epochs(self):
+        if redis_mgr.client:
+            rows = await redis_mgr.client.hgetall(EPOCH_KEY)
+            for key, epoch in rows.items():
+                self._epochs[key] = max(float(epoch), self._epochs.get(key, 0))
+            for role_id, perms in (await redis_mgr.client.hgetall(ROLE_PERMS_KEY)).items():
+                self._role_perms[int(role_id)] = frozenset(json.loads(perms))
+
+    async def bump(self, usernames=None):
+        """提升指定用户的纪元；usernames 为 None 表示全局纪元 (全部令牌失效)"""
+        epoch = time.time() # 保留小数：同一秒内签发于提升之前的令牌也会失效
+        keys = [GLOBAL] if usernames is None else list(usernames)
+        if not keys: return
+        for key in keys: self._epochs[key] = epoch
+        if redis_mgr.client:
+            await redis_mgr.client.hset(EPOCH_KEY, mapping={key: epoch for key in keys})
+            await redis_mgr.publish(EPOCH_CHANNEL, {"keys": keys, "epoch": epoch})
+        logger.info(f"🔐 [令牌撤销] 纪元已提升: {', '.join(keys[:10])}{' ...' if len(keys) > 10 else ''}")
+
+    async def set_role_permissions(self, role_id: int, permissions):
+        """角色权限变更：该角色全部令牌立即按新权限集鉴权 (不撤销令牌)"""
+        perms = sorted({str(p) for p in permissions or ()})
+        self._role_perms[int(role_id)] = frozenset(perms)
+        if redis_mgr.client:
+            await redis_mgr.client.hset(ROLE_PERMS_KEY, int(role_id), json.dumps(perms))
+            await redis_mgr.publish(EPOCH_CHANNEL, {"role_id": int(role_id), "permissions": perms})
+        logger.info(f"🔐 [令牌鉴权] 角色 {role_id} 权限集已更新: {len(perms)} 项")
+
+    async def reconcile_loop(self, interval: float = 300):
+        """[常驻任务] 兜底对账：弥补 Redis 断线期间错过的纪元信号"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load_epochs()
+            except Exception as e:
+                logger.error(f"⚠️ [令牌缓存] 纪元对账失败: {e}")
+
+    async def on_epoch(self, data: dict):
+        if data.get("role_id") is not None:
+            self._role_perms[int(data["role_id"])] = frozenset(data.get("permissions") or ())
+            return
+        epoch = float(data.get("epoch", 0))
+        for key in data.get("keys") or []:
+            self._epochs[key] = max(epoch, self._epochs.get(key, 0))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "limit": self.maxsize,
+            "hit_rate": round(self.hits / total, 3) if total else 0,
+            "epochs": len(self._epochs),
+            "role_overrides": len(self._role_perms)
+        }
+
+
+token_cache = TokenCache()
@@ -0,0 +1,145 @@
+import asyncio, logging, time
+from typing import Optional
+from core.models import SensitiveWord, DeptSensitiveWord
+from utils.matcher import AhoCorasick, MatchHit
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+# 词库版本号与失效广播频道 (所有引擎进程共享)
+DICT_VERSION_KEY = "dict:sensitive_words:version"
+DICT_CHANNEL = "dict_invalidate"
+
+
+class _CompiledWords:
+    """
+    [只读快照] 全域敏感词自动机 + 各部门规避词自动机
+    dept[None] 仅含全域规避词，dept[部门ID] = 全域规避词 + 本部门规避词
+    """
+    __slots__ = ("risk", "dept")
+
+    def __init__(self, words: list[dict], dept_words: list[dict]):
+        self.risk = AhoCorasick((w["word"], w["risk_level"]) for w in words)
+
+        shared, by_dept = [], {}
+        for dw in dept_words:
+            item = (dw["word"], dw.get("suggestion"))
+            if dw["department_id"] is None: shared.append(item)
+            else: by_dept.setdefault(dw["department_id"], []).append(item)
+
+        self.dept = {None: AhoCorasick(shared)}
+        for dept_id, items in by_dept.items():
+            self.dept[dept_id] = AhoCorasick(shared + items)
+
+
+class SensitiveWordDict:
+    """
+    [词库引擎] 进程内常驻的版本化词库：全域敏感词与部门规避词编译为自动机，单次扫描完成全部匹配
+    写接口递增 Redis 版本号并广播失效信号，各进程后台重建后整体替换快照，扫描热路径零 DB 往返
+    """
+
+    def __init__(self):
+        self._compiled: Optional[_CompiledWords] = None
+        self._init_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self.version = 0
+        self.loaded_at = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._compiled is not None
+
+    async def _remote_version(self) -> int:
+        client = redis_mgr.client
+        if not client: return 0
+        return int(await client.get(DICT_VERSION_KEY) or 0)
+
+    async def rebuild(self):
+        """从 MySQL 拉取词库并在线程中编译，完成后原子替换 (先读版本号，保证快照不旧于所标版本)"""
+        version = await self._remote_version()
+        words = await SensitiveWord.filter(is_active=1, is_deleted=0).values("word", "risk_level")
+        dept_words = await DeptSensitiveWord.filter(is_active=1, is_deleted=0).values("word", "suggestion", "department_id")
+        compiled = await asyncio.to_thread(_CompiledWords, words, dept_words)
+        self._compiled, self.version, self.loaded_at = compiled, version, time.time()
+        logger.info(f"🧬 [词库引擎] 自动机已重建 v{version}: 敏感词 {compiled.risk.size} 条, 部门词表 {len(compiled.dept)} 组")
+
+    async def ensure_ready(self):
+        if self._compiled is not None: return
+        async with self._init_lock:
+            if self._compiled is None:
+                await self.rebuild()
+
+    def schedule_rebuild(self):
+        """[后台重建] 写接口调用；重建进行中时合并为一次补充重建"""
+        if self._rebuild_task and not self._rebuild_task.done():
+            self._dirty = True
+            return
+        self._rebuild_task = asyncio.create_task(self._rebuild_loop())
+
+    async def _rebuild_loop(self):
+        while True:
+            self._dirty = False
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error(f"❌ [词库引擎] 重建失败，继续沿用旧快照: {e}")
+            if not self._dirty: break
+
+    async def invalidate(self):
+        """[写接口调用] 递增全局版本号并广播，所有进程 (含本进程) 据此重建"""
+        client = redis_mgr.client
+        if client:
+            try:
+                version = await client.incr(DICT_VERSION_KEY)
+                await redis_mgr.publish(DICT_CHANNEL, {"name": "sensitive_words", "version": version})
+            except Exception as e:
+                logger.error(f"⚠️ [词库引擎] 失效广播失败，仅重建本进程: {e}")
+        self.schedule_rebuild()
+
+    async def on_invalidate(self, data: dict):
+        """信号总线处理器：版本号与本地不一致即重建 (含 Redis 重启导致的版本回退)"""
+        if data.get("name") == "sensitive_words" and data.get("version") != self.version:
+            self.schedule_rebuild()
+
+    async def reconcile_loop(self, interval: int = 60):
+        """[兜底校准] 订阅链路断开期间可能漏掉信号，定期比对版本号"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await self._remote_version() != self.version:
+                    self.schedule_rebuild()
+            except Exception as e:
+                logger.error(f"⚠️ [词库引擎] 版本校准失败: {e}")
+
+    async def stats(self) -> dict:
+        """本进程版本 vs 全局最新版本，二者不一致即说明该进程尚未完成同步"""
+        try:
+            latest = await self._remote_version()
+        except Exception:
+            latest = None
+        return {"version": self.version, "latest": latest, "loaded_at": int(self.loaded_at), "ready": self.ready}
+
+    def match_risk(self, text: str) -> Optional[MatchHit]:
+        """全域敏感词：返回风险等级最高的命中 (同级取最靠前的位置)"""
+        compiled = self._compiled
+        if not compiled or not text: return None
+        best = None
+        for hit in compiled.risk.iter_matches(text):
+            if best is None or hit.payload > best.payload or (hit.payload == best.payload and hit.start < best.start):
+                best = hit
+        return best
+
+    def match_dept(self, text: str, dept_id: Optional[int]) -> Optional[MatchHit]:
+        """部门规避词：返回最靠前的命中"""
+        compiled = self._compiled
+        if not compiled or not text: return None
+        automaton = compiled.dept.get(dept_id) or compiled.dept[None]
+        best = None
+        for hit in automaton.iter_matches(text):
+            if best is None or hit.start < best.start:
+                best = hit
+        return best
+
+
+word_dict = SensitiveWordDict()
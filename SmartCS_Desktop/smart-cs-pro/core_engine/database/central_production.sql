@@ -135,8 +135,14 @@ CREATE TABLE IF NOT EXISTS notifications (
     content TEXT,
     type VARCHAR(50) DEFAULT 'INFO',
     is_read TINYINT DEFAULT 0,
+    seq BIGINT NULL,
+    target_user_id INT NULL,
+    target_dept_id INT NULL,
     is_deleted TINYINT DEFAULT 0,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_notif_seq (seq),
+    INDEX idx_notif_user_ts (target_user_id, created_at),
+    INDEX idx_notif_dept_ts (target_dept_id, created_at)
 ) ENGINE=InnoDB;
 
 -- 13. 违规取证记录
@@ -223,6 +229,22 @@ CREATE TABLE IF NOT EXISTS blacklist (
     INDEX idx_user_expiry (username, expired_at)
 ) ENGINE=InnoDB;
 
+-- 20. 违规聚合 (按 日 / 部门 / 坐席 / 风险分级 / 关键词 预聚合)
+CREATE TABLE IF NOT EXISTS violation_rollups (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    day DATE NOT NULL,
+    department_id INT NOT NULL DEFAULT 0,
+    user_id INT NOT NULL,
+    risk_bucket VARCHAR(10) NOT NULL,
+    keyword VARCHAR(100) NOT NULL,
+    hits INT NOT NULL DEFAULT 0,
+    score_total INT NOT NULL DEFAULT 0,
+    is_deleted TINYINT DEFAULT 0,
+    UNIQUE KEY uk_rollup (day, department_id, user_id, risk_bucket, keyword),
+    INDEX idx_rollup_dept_day (department_id, day),
+    INDEX idx_rollup_day (day)
+) ENGINE=InnoDB;
+
 -- ==========================================
 -- 初始数据填充
 -- ==========================================
@@ -41,6 +41,12 @@ from api.auth import router as auth_router
 from api.admin import router as admin_router
 from api.violation import router as violation_router
 from core.constants import RoleID
+from core.session import AgentSession, sessions
+from core.presence import presence
+from core.revocation import revocations
+from core.token_cache import token_cache, TokenRevoked
+from core.roster import roster
+from core.connection import ConnectionManager
 from api.coach import router as coach_router
 from api.growth import router as growth_router
 from api.rbac import router as rbac_router
@@ -63,69 +69,39 @@ else:
 logger = logging.getLogger("SmartCS")
 logging.basicConfig(level=logging.INFO)
 
-# --- 2. 物理链路指挥管理器 ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, WebSocket] = {}
-        self.user_roles: dict[str, str] = {} # 存储节点角色
-
-    async def connect(self, username: str, websocket: WebSocket, role: str = "AGENT"):
-        await websocket.accept()
-        self.active_connections[username] = websocket
-        self.user_roles[username] = role
-        logger.info(f"📡 [WS] 节点已挂载: {username} ({role})")
-
-    def disconnect(self, username: str):
-        if username in self.active_connections:
-            del self.active_connections[username]
-            if username in self.user_roles: del self.user_roles[username]
-            logger.info(f"🔌 [WS] 节点已脱机: {username}")
-
-    async def broadcast_to_command(self, message: dict):
-        """
-        [物理隔离] 仅向 ADMIN 和 HQ 节点推送敏感数据 (如画面、求助)
-        """
-        for user, connection in self.active_connections.items():
-            role = self.user_roles.get(user)
-            # V5.52: 兼容性加固 - 处理数字或字符串形式的 RoleID
-            is_management = str(role) in [str(RoleID.ADMIN), str(RoleID.HQ)]
-            if is_management:
-                await connection.send_json(message)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections.values():
-            await connection.send_json(message)
-
-    async def send_personal_message(self, message: dict, username: str):
-        """
-        [战术点对点] 向指定操作员发送指令
-        """
-        if username in self.active_connections:
-            await self.active_connections[username].send_json(message)
-        else:
-            logger.warning(f"⚠️ [指令丢包] 目标节点 {username} 脱机，无法送达")
-
+# --- 2. 物理链路指挥管理器 (V5.64: 已迁移至 core.connection，按连接独立出站队列) ---
 manager = ConnectionManager()
+sessions.add_listener(manager.reindex)
 
 async def online_status_cleaner():
-    """[物理自愈] 循环检查心跳，清理异常断开的死节点"""
-    from utils.redis_utils import redis_mgr
+    """
+    [物理自愈] 清理异常断开的死节点
+    V5.69: 在线索引为按最后心跳排序的 ZSET，单次原子 ZRANGEBYSCORE + ZREM 取出过期节点，
+    开销只与过期数量相关；同一轮清扫的下线事件按部门合并为一条增量推送
+    """
+    from utils.redis_utils import redis_mgr, PRESENCE_TTL
+    interval = float(os.getenv("PRESENCE_SWEEP_INTERVAL", 15))
     while True:
         try:
             client = await redis_mgr.connect()
             if client:
-                online_set = await client.smembers("online_agents_set")
-                if online_set: # 确保 online_set 不为空且可迭代
-                    for username in online_set:
-                        # 检查心跳 Key 是否还存在
-                        has_heartbeat = await client.exists(f"agent_heartbeat:{username}")
-                        if not has_heartbeat:
-                            await redis_mgr.mark_offline(username)
-                            await manager.broadcast({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "OFFLINE"})
-                            logger.info(f"扫除僵尸节点: {username}")
+                # 原子取出并移除：多 worker 并发清扫时每个节点只会被一方取到
+                stale = await redis_mgr.sweep_offline(time.time() - PRESENCE_TTL)
+                if stale:
+                    await roster.patch_many([(u, {"is_online": False}, None) for u in stale])
+                    logger.info(f"扫除僵尸节点: {len(stale)} 个 ({', '.join(stale[:10])}{' ...' if len(stale) > 10 else ''})")
+                    # V5.65: 一次查出所属部门，仅通知对应部门的指挥节点
+                    from core.models import User
+                    rows = await User.filter(username__in=stale).values("username", "department_id")
+                    dept_of = {r["username"]: r["department_id"] for r in rows}
+                    by_dept: dict = {}
+                    for username in stale:
+                        by_dept.setdefault(dept_of.get(username), []).append(username)
+                    for dept_id, usernames in by_dept.items():
+                        await manager.broadcast_to_dept_command({"type": "TACTICAL_NODE_DELTA", "status": "OFFLINE", "usernames": usernames}, dept_id)
         except Exception as e:
             logger.error(f"⚠️ [自愈循环异常]: {e}")
-        await asyncio.sleep(45)
+        await asyncio.sleep(interval)
 
 from tortoise import Tortoise
 
@@ -150,31 +126,102 @@ async def lifespan(app: FastAPI):
         app.state.redis = client
         logger.info("✅ Redis 战术缓存已激活")
         
-        # V3.26: 启动自愈 - 强制清空在线状态集
-        await client.delete("online_agents_set")
-        
-        # V5.40: 物理黑名单自愈 - 从 MySQL 加载未过期的封禁记录
-        try:
-            from datetime import datetime
-            conn = Tortoise.get_connection("default")
-            active_bans = await conn.execute_query_dict(
-                "SELECT username, expired_at FROM blacklist WHERE expired_at > %s", 
-                [datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
-            )
-            for ban in active_bans:
-                duration = int((ban['expired_at'] - datetime.now()).total_seconds())
-                if duration > 0:
-                    await client.setex(f"blacklist:{ban['username']}", duration, "1")
-            logger.info(f"🛡️ [黑名单自愈] 已成功加载 {len(active_bans)} 条封禁载荷")
-        except Exception as ban_err:
-            logger.error(f"⚠️ [黑名单加载失败]: {ban_err}")
+        # V5.67: 多 worker 部署下单个进程重启不能清空全局在线集，残留节点交由 online_status_cleaner 按心跳清扫
         
         logger.info("扫除僵尸节点: 等待新链路注入")
         asyncio.create_task(online_status_cleaner())
     
+    # V5.70: 进程内封禁表 - 从 MySQL 加载未过期的封禁记录，鉴权时纯内存判定
+    from core.revocation import REVOCATION_CHANNEL
+    try:
+        count = await revocations.load()
+        logger.info(f"🛡️ [黑名单自愈] 已成功加载 {count} 条封禁载荷")
+    except Exception as ban_err:
+        logger.error(f"⚠️ [黑名单加载失败]: {ban_err}")
+    asyncio.create_task(revocations.reconcile_loop())
+
+    # V5.71: 令牌撤销纪元
+    from core.token_cache import EPOCH_CHANNEL
+    try:
+        await token_cache.load_epochs()
+    except Exception as e:
+        logger.error(f"⚠️ [令牌缓存] 纪元加载失败: {e}")
+
+    # V5.74: 拼音检索索引
+    from core.pinyin_index import pinyin_index, PINYIN_CHANNEL
+    try:
+        await pinyin_index.rebuild()
+    except Exception as e:
+        logger.error(f"⚠️ [拼音索引] 构建失败，检索回退到模糊匹配: {e}")
+    asyncio.create_task(pinyin_index.reconcile_loop())
+
+    # V5.60: 预编译敏感词自动机，避免首条消息承担构建开销
+    from core.word_dict import word_dict, DICT_CHANNEL
+    try:
+        await word_dict.rebuild()
+    except Exception as e:
+        logger.error(f"⚠️ [词库引擎] 预热失败，将在首次扫描时重试: {e}")
+
+    # V5.79: 带教话术自动机
+    from core.knowledge import knowledge_matcher
+    try:
+        await knowledge_matcher.rebuild()
+    except Exception as e:
+        logger.error(f"⚠️ [带教检索] 预热失败，将在首次检索时重试: {e}")
+
+    # V5.81: 通知投递通道自检
+    from core.notifications import notification_center
+    try:
+        await notification_center.bootstrap()
+    except Exception as e:
+        logger.error(f"⚠️ [通知投递] 通道恢复失败: {e}")
+
+    # V5.61: 信号总线 - 各模块先注册频道处理器，再启动单条订阅链路
+    redis_mgr.subscribe(DICT_CHANNEL, word_dict.on_invalidate)
+    redis_mgr.subscribe(DICT_CHANNEL, knowledge_matcher.on_invalidate)
+    redis_mgr.subscribe(REVOCATION_CHANNEL, revocations.on_message)
+    redis_mgr.subscribe(EPOCH_CHANNEL, token_cache.on_epoch)
+    redis_mgr.subscribe(PINYIN_CHANNEL, pinyin_index.on_message)
+    # V5.78: 参考数据两级缓存的 L1 失效信号
+    from utils.cache import static_cache, CACHE_CHANNEL
+    redis_mgr.subscribe(CACHE_CHANNEL, static_cache.on_invalidate)
+    # V5.67: 跨进程总线 - 广播 / 点对点指令 / 画面订阅 / 会话刷新在 worker 间转发
+    from core.bus import bus
+    manager.attach_bus()
+    sessions.attach_bus()
+    if client: bus.attach()
+    if client:
+        asyncio.create_task(redis_mgr.listen())
+        asyncio.create_task(word_dict.reconcile_loop())
+        asyncio.create_task(knowledge_matcher.reconcile_loop())
+        asyncio.create_task(token_cache.reconcile_loop())
+
+    # V5.63: 违规/合规异步落库管线
+    from core.pipeline import violation_pipeline
+    violation_pipeline.start()
+
+    # V5.68: 心跳/活跃时间合并写入
+    presence.start()
+
+    # V5.83: 审计足迹缓冲批量落库
+    from core.audit import audit_sink
+    audit_sink.start()
+
+    # V5.84: 冷数据归档 (RETENTION_ENABLED=1 时定期执行)
+    from core.retention import retention
+    if retention.enabled: asyncio.create_task(retention.schedule_loop())
+
+    # V5.80: 积分账本写回 (多 worker 中仅 leader 消费流水)
+    from core.score_ledger import score_ledger
+    score_ledger.start()
+
     app.state.ws_manager = manager
     yield
-    # 释放资源
+    # 释放资源 (先排空落库管线，再断开数据库)
+    await violation_pipeline.stop()
+    await presence.stop()
+    await score_ledger.stop()
+    await audit_sink.stop()
     await Tortoise.close_connections()
     await redis_mgr.disconnect()
 
@@ -184,11 +231,33 @@ app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], all
 # 核心：系统级接口 (确保路径与 CONFIG.API_BASE 对齐)
 @app.get("/api/health")
 async def health(request: Request): 
+    from core.word_dict import word_dict
+    from core.pipeline import violation_pipeline
+    from core.pinyin_index import pinyin_index
+    from utils.cache import static_cache
+    from core.knowledge import knowledge_matcher
+    from core.score_ledger import score_ledger
+    from core.events import event_log
+    from core.audit import audit_sink
+    from core.retention import retention
     return {
         "status": "ok", 
         "redis": hasattr(request.app.state, 'redis'),
         "engine": "SmartCS-Pro-V2",
-        "nodes": len(manager.active_connections)
+        "nodes": len(manager.active_connections),
+        "ws": manager.stats(),
+        "dict": await word_dict.stats(),
+        "pipeline": violation_pipeline.stats(),
+        "presence": presence.stats(),
+        "score_ledger": await score_ledger.stats(),
+        "revocations": revocations.stats(),
+        "token_cache": token_cache.stats(),
+        "pinyin_index": pinyin_index.stats(),
+        "static_cache": static_cache.stats(),
+        "knowledge": knowledge_matcher.stats(),
+        "events": event_log.stats(),
+        "audit": audit_sink.stats(),
+        "retention": retention.stats()
     }
 
 @app.post("/api/system/lock")
@@ -231,7 +300,7 @@ app.include_router(ai_router)
 
 # --- 4. WebSocket 战术链路 ---
 @app.websocket("/api/ws/risk")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), username: str = Query(...)):
+async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), username: str = Query(...), last_event_id: str = Query(None)):
     # V5.00: 使用无状态 JWT 执行物理握手校验
     from api.auth import JWT_SECRET, JWT_ALGORITHM
     import jwt
@@ -240,8 +309,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), user
         if not token.count('.') == 2:
             raise jwt.exceptions.DecodeError("Not a JWT format")
             
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        role = payload.get("role_id", RoleID.AGENT)
+        payload = token_cache.verify(token, JWT_SECRET, JWT_ALGORITHM)
         
         # 严格校验：确保令牌中的用户与链路请求一致
         if payload.get("username") != username:
@@ -251,14 +319,18 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), user
         
         logger.info(f"✅ [WS 鉴权成功] 操作员 {username} (JWT模式) 已建立链路")
 
+    except (TokenRevoked, jwt.exceptions.ExpiredSignatureError) as jwt_err:
+        # V5.71: 已撤销或过期的 JWT 不再回退旧版令牌校验
+        logger.error(f"🚫 [鉴权熔断] 令牌已撤销或过期: {username} ({jwt_err})")
+        await websocket.close(code=1008)
+        return
     except (jwt.exceptions.DecodeError, jwt.exceptions.InvalidTokenError) as jwt_err:
         # 过渡期兼容：如果不是 JWT 或解码失败，尝试在 Redis 中找旧版 token
         redis = app.state.redis
         if redis:
             cached = await redis.get(f"token:{token}")
             if cached:
-                user_info = json.loads(cached)
-                role = user_info.get("role_id", RoleID.AGENT)
+                payload = json.loads(cached)
                 logger.info(f"✅ [WS 兼容模式] 操作员 {username} 使用旧版令牌建立链路")
             else:
                 logger.error(f"🚫 [鉴权熔断] 令牌无效或已过期: {token[:15]}... (用户: {username})")
@@ -274,37 +346,73 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), user
         await websocket.close(code=1008)
         return
 
-    await manager.connect(username, websocket, role=role)
+    # V5.70: 封禁节点禁止建立链路
+    if revocations.is_revoked(username):
+        logger.warning(f"🚫 [物理拦截] 处于黑名单的用户尝试建立链路: {username}")
+        await websocket.close(code=1008)
+        return
+
+    # V5.62: 链路会话 - 握手时一次性锁定身份，整条链路复用，不再逐条消息查库
+    session = await AgentSession.load(username, payload)
+    from core.services import SmartScanner, grant_user_reward
+    scanner = SmartScanner()
+
+    await manager.connect(username, websocket, session)
+    sessions.register(session)
+    # V5.82: 断线续传 - 按本节点作用域补发 last_event_id 之后错过的广播事件
+    if last_event_id:
+        from core.events import event_log
+        try:
+            missed, truncated = await event_log.replay(session, last_event_id)
+            for event in missed:
+                await manager.send_personal_message(event, username)
+            await manager.send_personal_message({"type": "EVENT_REPLAY", "count": len(missed), "truncated": truncated}, username)
+        except Exception as e:
+            logger.error(f"⚠️ [事件续传] 补发失败: {username} ({e})")
     from utils.redis_utils import redis_mgr
     await redis_mgr.mark_online(username)
-    await manager.broadcast({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "ONLINE"})
+    await roster.patch(username, {"is_online": True})
+    await manager.broadcast_to_dept_command({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "ONLINE"}, session.dept_id)
     
     try:
         while True:
             # 战术心跳：由前端定时发送 SCREEN_SYNC 或其他消息维持
-            data = await websocket.receive_text()
-            # 每次收到消息都刷新心跳 TTL
-            await redis_mgr.mark_online(username)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            # V5.68: 每次收到消息都刷新心跳，由 presence 合并后批量写入 Redis
+            presence.touch(username)
+
+            # V5.66: 二进制帧即画面数据，免 JSON 编解码，直接投递给订阅者 (仅保留最新帧)
+            if frame.get("bytes") is not None:
+                await manager.publish_screen(session, image=frame["bytes"])
+                continue
             
-            msg = json.loads(data)
+            msg = json.loads(frame["text"])
             if msg.get("type") == "HEARTBEAT":
-                # V3.37: 静默心跳响应
-                await redis_mgr.mark_online(username)
+                # V3.37: 静默心跳响应 (心跳已在收帧时记录)
+                continue
+
+            if msg.get("type") == "SCREEN_SUBSCRIBE":
+                # 指挥节点声明当前打开的坐席画面
+                await manager.subscribe_screens(username, msg.get("targets", []))
+                continue
+
+            if msg.get("type") == "SCREEN_UNSUBSCRIBE":
+                await manager.unsubscribe_screens(username, msg.get("targets"))
                 continue
 
             if msg.get("type") == "ACTIVITY_SYNC":
                 # V3.76: 物理活跃同步 (键盘/鼠标动作)
-                await redis_mgr.update_activity(username)
+                presence.activity(username)
                 continue
 
             if msg.get("type") == "CHAT_TRANSMISSION":
                 # 战术加固：实时扫描内容敏感词
-                from core.services import SmartScanner, grant_user_reward
-                scanner = SmartScanner()
                 content = msg.get("content", "")
                 
                 # 1. 执行扫描并检查是否命中
-                is_violated = await scanner.process(content, username=username, redis_client=app.state.redis, ws_manager=manager)
+                is_violated = await scanner.process(content, session, redis_client=app.state.redis, ws_manager=manager)
                 
                 # 2. 自愈机制：如果本次无违规，增加净空计数
                 if not is_violated and app.state.redis:
@@ -312,49 +420,52 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), user
                     count = await app.state.redis.incr(counter_key)
                     if count >= 50:
                         # 达到阈值，触发自愈奖励 (+1 PT)
-                        from core.models import User
-                        u_obj = await User.get_or_none(username=username)
-                        if u_obj:
-                            await grant_user_reward(u_obj.id, 'SCORE', '净空自愈奖励', 1, ws_manager=manager)
+                        if session.user_id:
+                            await grant_user_reward(session.user_id, 'SCORE', '净空自愈奖励', 1, ws_manager=manager)
                             await app.state.redis.set(counter_key, 0) # 重置计数
                             logger.info(f"🌿 [自愈] 操作员 {username} 已完成 50 条净空对话，奖励 1 PT")
                 elif is_violated and app.state.redis:
                     # 如果违规，重置净空计数
                     await app.state.redis.set(f"clean_msg_count:{username}", 0)
 
-                await manager.broadcast({
+                # V5.65: 实时对话仅推送给能看到该坐席的指挥节点
+                await manager.broadcast_to_dept_command({
                     "type": "LIVE_CHAT",
                     "username": username,
                     "content": content,
                     "target": msg.get("target")
-                })
+                }, session.dept_id)
             elif msg.get("type") == "SCREEN_SYNC":
-                # 物理隔离：仅向指挥中心同步画面
-                await manager.broadcast_to_command({
-                    "type": "SCREEN_SYNC",
-                    "username": username,
-                    "payload": msg.get("payload")
-                })
+                # 旧版文本画面帧：同样走订阅 + 最新帧通道
+                await manager.publish_screen(session, data_url=msg.get("payload"))
             elif msg.get("type") == "EMERGENCY_HELP":
-                # 物理隔离：仅向指挥中心推送求助信号
-                await manager.broadcast_to_command({
+                # 物理隔离：仅向本部门指挥节点与总部推送求助信号
+                await manager.broadcast_to_dept_command({
                     "type": "EMERGENCY_HELP",
                     "username": username,
                     "content": msg.get("content"),
                     "image": msg.get("image"),
                     "subType": msg.get("subType")
-                })
+                }, session.dept_id)
     except WebSocketDisconnect:
-        manager.disconnect(username)
-        from utils.redis_utils import redis_mgr
-        await redis_mgr.mark_offline(username)
-        await manager.broadcast({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "OFFLINE"})
+        sessions.unregister(session)
+        # 链路已被同名新连接顶替时，下线处理会误伤仍在线的新会话，直接跳过
+        if await manager.disconnect(username, websocket):
+            presence.forget(username)
+            from utils.redis_utils import redis_mgr
+            await redis_mgr.mark_offline(username)
+            await roster.patch(username, {"is_online": False})
+            await manager.broadcast_to_dept_command({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "OFFLINE"}, session.dept_id)
     except Exception as e:
         logger.error(f"⚠️ WS 链路异常: {e}")
-        manager.disconnect(username)
-        from utils.redis_utils import redis_mgr
-        await redis_mgr.mark_offline(username)
-        await manager.broadcast({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "OFFLINE"})
+        sessions.unregister(session)
+        # 链路已被同名新连接顶替时，下线处理会误伤仍在线的新会话，直接跳过
+        if await manager.disconnect(username, websocket):
+            presence.forget(username)
+            from utils.redis_utils import redis_mgr
+            await redis_mgr.mark_offline(username)
+            await roster.patch(username, {"is_online": False})
+            await manager.broadcast_to_dept_command({"type": "TACTICAL_NODE_SYNC", "username": username, "status": "OFFLINE"}, session.dept_id)
 
 # --- 物理资产托管：Web 态势舱支持 ---
 # V4.10: 增加自动化资产目录初始化
@@ -387,4 +498,9 @@ if __name__ == "__main__":
         print("  ❌ [自检失败] 缺失 websockets 库，正在尝试回退...")
         ws_driver = "auto"
 
-    uvicorn.run(app, host=host, port=port, ws=ws_driver, log_level="info")
+    # V5.67: SERVER_WORKERS > 1 时以多进程启动，各 worker 经 Redis 总线互通
+    workers = int(os.getenv("SERVER_WORKERS", 1))
+    if workers > 1:
+        uvicorn.run("engine:app", host=host, port=port, ws=ws_driver, log_level="info", workers=workers)
+    else:
+        uvicorn.run(app, host=host, port=port, ws=ws_driver, log_level="info")
@@ -0,0 +1,36 @@
+import os
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+
+# V5.81: 通知定向投递 - 全局投递序号与目标用户 / 目标部门字段，历史通知保持全员广播
+COLUMNS = [
+    ("seq", "ADD COLUMN seq BIGINT NULL, ADD INDEX idx_notif_seq (seq)"),
+    ("target_user_id", "ADD COLUMN target_user_id INT NULL, ADD INDEX idx_notif_user_ts (target_user_id, created_at)"),
+    ("target_dept_id", "ADD COLUMN target_dept_id INT NULL, ADD INDEX idx_notif_dept_ts (target_dept_id, created_at)"),
+]
+
+async def run_migration():
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    conn = Tortoise.get_connection("default")
+
+    for name, clause in COLUMNS:
+        exists = await conn.execute_query_dict(
+            "SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'notifications' AND COLUMN_NAME = %s LIMIT 1",
+            [name]
+        )
+        if exists:
+            print(f"  ⏭️ [字段] notifications.{name} 已存在")
+            continue
+        await conn.execute_script(f"ALTER TABLE notifications {clause}")
+        print(f"  ✅ [字段] notifications.{name} 已创建")
+
+    print("✅ [通知投递] 定向投递字段已同步")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_migration())
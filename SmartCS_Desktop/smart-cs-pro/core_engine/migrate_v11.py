@@ -0,0 +1,47 @@
+import os
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+
+# V5.77: 违规聚合表 - 落库管线按 (日期, 部门, 坐席, 风险档, 关键词) 累加，统计接口只读聚合
+# 历史数据由 backfill_rollups.py 回填
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS violation_rollups (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    day DATE NOT NULL,
+    department_id INT NOT NULL DEFAULT 0,
+    user_id INT NOT NULL,
+    risk_bucket VARCHAR(10) NOT NULL,
+    keyword VARCHAR(100) NOT NULL,
+    hits INT NOT NULL DEFAULT 0,
+    score_total INT NOT NULL DEFAULT 0,
+    is_deleted TINYINT DEFAULT 0,
+    UNIQUE KEY uk_rollup (day, department_id, user_id, risk_bucket, keyword),
+    INDEX idx_rollup_dept_day (department_id, day),
+    INDEX idx_rollup_day (day)
+) ENGINE=InnoDB
+"""
+
+async def run_migration():
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    conn = Tortoise.get_connection("default")
+
+    exists = await conn.execute_query_dict(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'violation_rollups' LIMIT 1"
+    )
+    if exists:
+        print("  ⏭️ [数据表] violation_rollups 已存在")
+    else:
+        await conn.execute_script(CREATE_SQL)
+        print("  ✅ [数据表] violation_rollups 已创建")
+
+    print("✅ [违规聚合] 聚合表已同步，如需历史统计请执行 backfill_rollups.py")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_migration())
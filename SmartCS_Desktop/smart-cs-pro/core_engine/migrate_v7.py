@@ -0,0 +1,38 @@
+import os
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+
+# V5.75: keyset 分页依赖 (时间, 主键) 复合索引，保证按游标翻页为索引范围扫描
+INDEXES = [
+    ("violation_records", "idx_violation_ts_id", "(timestamp, id)"),
+    ("audit_logs", "idx_audit_created_id", "(created_at, id)"),
+    ("notifications", "idx_notif_created_id", "(created_at, id)"),
+    ("dept_compliance_logs", "idx_compliance_ts_id", "(timestamp, id)"),
+    ("dept_compliance_logs", "idx_compliance_dept_ts_id", "(department_id, timestamp, id)"),
+]
+
+async def run_migration():
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    conn = Tortoise.get_connection("default")
+
+    for table, name, columns in INDEXES:
+        exists = await conn.execute_query_dict(
+            "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+            [table, name]
+        )
+        if exists:
+            print(f"  ⏭️ [索引] {table}.{name} 已存在")
+            continue
+        await conn.execute_script(f"ALTER TABLE {table} ADD INDEX {name} {columns}")
+        print(f"  ✅ [索引] {table}.{name} {columns} 已创建")
+
+    print("✅ [游标分页] 日志类表复合索引已同步")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_migration())
@@ -0,0 +1,36 @@
+import os
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+
+# V5.76: 违规记录全文检索 (ngram 分词，支持中文) 与角色隔离筛选所需的复合索引
+INDEXES = [
+    ("ft_violation_text", "ADD FULLTEXT INDEX ft_violation_text (context, keyword, solution) WITH PARSER ngram"),
+    ("idx_violation_user_ts", "ADD INDEX idx_violation_user_ts (user_id, timestamp)"),
+    ("idx_violation_status_ts", "ADD INDEX idx_violation_status_ts (status, timestamp)"),
+]
+
+async def run_migration():
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    conn = Tortoise.get_connection("default")
+
+    for name, clause in INDEXES:
+        exists = await conn.execute_query_dict(
+            "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'violation_records' AND INDEX_NAME = %s LIMIT 1",
+            [name]
+        )
+        if exists:
+            print(f"  ⏭️ [索引] violation_records.{name} 已存在")
+            continue
+        await conn.execute_script(f"ALTER TABLE violation_records {clause}")
+        print(f"  ✅ [索引] violation_records.{name} 已创建")
+
+    print("✅ [全文检索] 违规记录 ngram 全文索引与复合索引已同步 (大表建议在低峰期执行)")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_migration())
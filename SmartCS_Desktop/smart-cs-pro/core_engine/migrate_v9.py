@@ -0,0 +1,28 @@
+import os
+import asyncio
+from tortoise import Tortoise, run_async
+from dotenv import load_dotenv
+
+# V5.80: 积分账本写回 - user_rewards 增加流水 ID 唯一键，重放未确认流水时据此去重
+async def run_migration():
+    load_dotenv()
+    await Tortoise.init(
+        db_url=f"mysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        modules={"models": ["core.models"]}
+    )
+    conn = Tortoise.get_connection("default")
+
+    exists = await conn.execute_query_dict(
+        "SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'user_rewards' AND COLUMN_NAME = 'ledger_id' LIMIT 1"
+    )
+    if exists:
+        print("  ⏭️ [字段] user_rewards.ledger_id 已存在")
+    else:
+        await conn.execute_script("ALTER TABLE user_rewards ADD COLUMN ledger_id VARCHAR(32) NULL, ADD UNIQUE KEY uk_reward_ledger (ledger_id)")
+        print("  ✅ [字段] user_rewards.ledger_id 已创建")
+
+    print("✅ [积分账本] 奖励流水去重键已同步")
+    await Tortoise.close_connections()
+
+if __name__ == "__main__":
+    run_async(run_migration())
@@ -0,0 +1,134 @@
+import os, json, time, asyncio, logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+from fastapi.encoders import jsonable_encoder
+from utils.redis_utils import redis_mgr
+
+logger = logging.getLogger("SmartCS")
+
+CACHE_PREFIX = "cache:static:"
+CACHE_CHANNEL = "cache_invalidate"
+
+
+class TieredCache:
+    """
+    [两级缓存] 参考数据 (角色 / 权限 / 部门 / 商品 / 平台 / 情绪 / 分类) 的统一读缓存
+    - L1：进程内 LRU，条目按 min(L2 TTL, L1 上限) 过期，兜底吸收错过的失效信号
+    - L2：Redis cache:static:{key}，跨 worker 共享；cache:static:tag:{tag} 记录标签下的全部键
+    - 标签失效：写接口按标签清除 L2 并经 Pub/Sub 通知全部 worker 丢弃 L1
+    - 防击穿：同一进程内同键只有一个回源协程；跨进程以 SET NX 短锁串行回源，其余等待 L2 回填
+    """
+
+    def __init__(self):
+        self.maxsize = int(os.getenv("L1_CACHE_SIZE", 1024))
+        self.l1_ttl = float(os.getenv("L1_CACHE_TTL", 60))
+        self._entries: OrderedDict[str, tuple[Any, float, frozenset]] = OrderedDict()
+        self._flights: dict[str, asyncio.Future] = {}
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: int = 300, tags: tuple = ()) -> Any:
+        """命中 L1 / L2 直接返回，否则执行 loader 回源并回填两级缓存；返回值已转换为 JSON 兼容结构"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at, _ = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.l1_hits += 1
+                return value
+            del self._entries[key]
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            value = await self._load(key, loader, ttl, frozenset(tags))
+            self._store(key, value, ttl, frozenset(tags))
+            flight.set_result(value)
+            return value
+        except BaseException as e:
+            flight.set_exception(e)
+            flight.exception() # 无等待方时避免 "exception was never retrieved" 告警
+            raise
+        finally:
+            self._flights.pop(key, None)
+
+    async def _load(self, key: str, loader, ttl: int, tags: frozenset):
+        client = redis_mgr.client
+        if not client:
+            self.misses += 1
+            return jsonable_encoder(await loader())
+
+        raw = await client.get(CACHE_PREFIX + key)
+        if raw is not None:
+            self.l2_hits += 1
+            return json.loads(raw)
+
+        # 跨进程串行回源：抢锁失败的 worker 短暂轮询 L2，超时后自行回源
+        lock_key = f"{CACHE_PREFIX}lock:{key}"
+        owner = bool(await client.set(lock_key, 1, nx=True, ex=10))
+        if not owner:
+            for _ in range(20):
+                await asyncio.sleep(0.05)
+                raw = await client.get(CACHE_PREFIX + key)
+                if raw is not None:
+                    self.l2_hits += 1
+                    return json.loads(raw)
+
+        try:
+            self.misses += 1
+            value = jsonable_encoder(await loader())
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.setex(CACHE_PREFIX + key, ttl, json.dumps(value, ensure_ascii=False))
+                for tag in tags:
+                    pipe.sadd(f"{CACHE_PREFIX}tag:{tag}", key)
+                    pipe.expire(f"{CACHE_PREFIX}tag:{tag}", 86400)
+                await pipe.execute()
+            return value
+        finally:
+            if owner: await client.delete(lock_key)
+
+    def _store(self, key: str, value: Any, ttl: int, tags: frozenset):
+        self._entries[key] = (value, time.monotonic() + min(ttl, self.l1_ttl), tags)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _drop_local(self, tags):
+        tags = set(tags)
+        for key in [k for k, (_, _, t) in self._entries.items() if t & tags]:
+            del self._entries[key]
+
+    async def invalidate(self, *tags: str):
+        """[标签失效] 写接口在事务提交后调用：清除 L2 中标签下的全部键，并通知全部 worker 丢弃 L1"""
+        if not tags: return
+        self._drop_local(tags)
+        client = redis_mgr.client
+        if not client: return
+        try:
+            for tag in tags:
+                tag_key = f"{CACHE_PREFIX}tag:{tag}"
+                keys = await client.smembers(tag_key)
+                await client.delete(tag_key, *[CACHE_PREFIX + k for k in keys])
+            await redis_mgr.publish(CACHE_CHANNEL, {"tags": list(tags)})
+        except Exception as e:
+            logger.error(f"⚠️ [两级缓存] 失效 {tags} 失败: {e}")
+
+    async def on_invalidate(self, data: dict):
+        self._drop_local(data.get("tags") or [])
+
+    def stats(self) -> dict:
+        total = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "l1_size": len(self._entries),
+            "l1_hit_rate": round(self.l1_hits / total, 3) if total else 0,
+            "l2_hit_rate": round(self.l2_hits / total, 3) if total else 0,
+            "misses": self.misses
+        }
+
+
+static_cache = TieredCache()
@@ -0,0 +1,72 @@
+from collections import deque
+from typing import Any, Iterable, Iterator, NamedTuple
+
+
+class MatchHit(NamedTuple):
+    """单个命中：[start, end) 为命中词在原文中的偏移"""
+    start: int
+    end: int
+    word: str
+    payload: Any
+
+
+class AhoCorasick:
+    """
+    [多模匹配] Aho-Corasick 自动机
+    构建一次后，对任意文本只需单次扫描即可找出全部命中词，耗时与词库规模无关
+    """
+    __slots__ = ("_goto", "_fail", "_out", "size")
+
+    def __init__(self, patterns: Iterable[tuple[str, Any]]):
+        goto: list[dict] = [{}]
+        out: list[list] = [[]]
+        size = 0
+
+        # 1. 构建 Trie 跳转表
+        for word, payload in patterns:
+            if not word: continue
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append((len(word), word, payload))
+            size += 1
+
+        # 2. BFS 计算失配指针，并沿失配链合并输出
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt].extend(out[fail[nxt]])
+
+        self._goto = goto
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+        self.size = size
+
+    def iter_matches(self, text: str) -> Iterator[MatchHit]:
+        """单次扫描文本，按结束位置顺序产出全部命中 (含重叠命中)"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, word, payload in out[state]:
+                    yield MatchHit(i - length + 1, i + 1, word, payload)
+
+    def find_all(self, text: str) -> list[MatchHit]:
+        if not text or not self.size: return []
+        return list(self.iter_matches(text))
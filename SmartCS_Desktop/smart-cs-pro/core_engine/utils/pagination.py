@@ -0,0 +1,65 @@
+import json, base64, binascii
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from tortoise.expressions import Q
+
+
+def encode_cursor(ts: datetime, pk, direction: str) -> str:
+    """游标 = base64url([时间, 主键, 方向])，对客户端不透明"""
+    raw = json.dumps([ts.isoformat() if ts else None, pk, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        ts, pk, direction = json.loads(raw)
+        if direction not in ("next", "prev"): raise ValueError(direction)
+        return datetime.fromisoformat(ts) if ts else None, pk, direction
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="分页游标无效")
+
+
+async def approximate_count(query) -> Optional[int]:
+    """[估算总数] 取 EXPLAIN 的预估行数，代替逐页 COUNT(*)；失败时返回 None"""
+    try:
+        plan = await query.explain()
+        return max((int(row.get("rows") or 0) for row in plan), default=0)
+    except Exception:
+        return None
+
+
+async def keyset_page(query, cursor: str, size: int, fields: tuple, ts_field: str = "timestamp",
+                      pk_field: str = "id", approx_total: bool = False) -> dict:
+    """
+    [游标分页] 按 (ts_field, pk_field) 倒序的 keyset 分页，翻页代价与页码无关
+    cursor 为空串表示第一页；返回 next_cursor (更早的一页) / prev_cursor (更新的一页) 与 has_more，
+    approx_total=True 时附带 EXPLAIN 估算总数 (不执行 COUNT)
+    """
+    page_query = query
+    direction = "next"
+    if cursor:
+        ts, pk, direction = decode_cursor(cursor)
+        if direction == "next":
+            page_query = query.filter(Q(**{f"{ts_field}__lt": ts}) | Q(**{ts_field: ts, f"{pk_field}__lt": pk}))
+        else:
+            page_query = query.filter(Q(**{f"{ts_field}__gt": ts}) | Q(**{ts_field: ts, f"{pk_field}__gt": pk}))
+
+    order = (f"-{ts_field}", f"-{pk_field}") if direction == "next" else (ts_field, pk_field)
+    rows = await page_query.order_by(*order).limit(size + 1).values(*fields)
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if direction == "prev": rows.reverse()
+
+    # 向后翻页时 has_more 表示还有更早的数据；向前翻页时表示还有更新的数据
+    older = has_more if direction == "next" else bool(rows)
+    newer = bool(cursor) and bool(rows) if direction == "next" else has_more
+    result = {
+        "data": rows,
+        "has_more": older,
+        "next_cursor": encode_cursor(rows[-1][ts_field], rows[-1][pk_field], "next") if rows and older else None,
+        "prev_cursor": encode_cursor(rows[0][ts_field], rows[0][pk_field], "prev") if rows and newer else None
+    }
+    if approx_total: result["approx_total"] = await approximate_count(query)
+    return result
@@ -1,8 +1,17 @@
-import os, json, logging, time, redis.asyncio as redis
-from typing import Optional, Any
+import os, json, logging, time, asyncio, redis.asyncio as redis
+from typing import Optional, Any, Awaitable, Callable
 
 logger = logging.getLogger("SmartCS")
 
+PRESENCE_KEY = "presence:online" # ZSET: username -> 最后心跳时间戳
+PRESENCE_TTL = 90 # V5.22: 容错 TTL 90s，配合前端 5s 心跳
+
+_SWEEP_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #stale > 0 then redis.call('ZREM', KEYS[1], unpack(stale)) end
+return stale
+"""
+
 class RedisManager:
     _instance = None
     
@@ -10,6 +19,7 @@ class RedisManager:
         if cls._instance is None:
             cls._instance = super(RedisManager, cls).__new__(cls)
             cls._instance.client = None
+            cls._instance._handlers = {}
         return cls._instance
 
     async def connect(self):
@@ -54,17 +64,22 @@ class RedisManager:
             return json.loads(data) if data else None
         return None
 
-    # --- 辅助方法：在线坐席管理 (Set 模式) ---
+    # --- 辅助方法：在线坐席管理 (V5.69: Sorted Set 模式，score 为最后心跳时间) ---
     async def mark_online(self, username: str):
         if self.client:
-            await self.client.sadd("online_agents_set", username)
-            # V5.22: 增加容错 TTL 至 90s，配合前端 5s 心跳实现极致稳定的在线状态
-            await self.client.setex(f"agent_heartbeat:{username}", 90, "1")
+            await self.client.zadd(PRESENCE_KEY, {username: time.time()})
 
-    async def mark_offline(self, username: str):
+    async def mark_offline(self, username: str) -> bool:
+        """返回该节点此前是否在线 (多 worker 并发下线时仅有一方为 True)"""
         if self.client:
-            await self.client.srem("online_agents_set", username)
-            await self.client.delete(f"agent_heartbeat:{username}")
+            return bool(await self.client.zrem(PRESENCE_KEY, username))
+        return False
+
+    async def sweep_offline(self, cutoff: float) -> list[str]:
+        """[原子清扫] 取出并移除最后心跳早于 cutoff 的节点，开销只与过期数量相关"""
+        if self.client:
+            return await self.client.eval(_SWEEP_SCRIPT, 1, PRESENCE_KEY, cutoff)
+        return []
 
     # --- 活跃度监控增强 ---
     async def update_activity(self, username: str):
@@ -80,10 +95,53 @@ class RedisManager:
             return int(val) if val else None
         return None
 
-    async def get_online_list(self):
+    # --- V5.61: 信号总线 (单条订阅连接，按频道分发给进程内处理器) ---
+    def subscribe(self, channel: str, handler: Callable[[dict], Awaitable[None]]):
+        """注册频道处理器，需在 listen() 启动前完成注册"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, payload: dict) -> int:
+        """返回收到消息的订阅者数量 (Redis 未连接时为 0)"""
+        if not self.client: return 0
+        return await self.client.publish(channel, json.dumps(payload, ensure_ascii=False))
+
+    async def listen(self):
+        """[常驻任务] 订阅全部已注册频道并分发消息，断线后自动重连"""
+        while True:
+            pubsub = None
+            try:
+                client = await self.connect()
+                if not client or not self._handlers:
+                    await asyncio.sleep(5)
+                    continue
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(*self._handlers.keys())
+                logger.info(f"📶 [信号总线] 已订阅频道: {', '.join(self._handlers.keys())}")
+                async for message in pubsub.listen():
+                    if message.get("type") != "message": continue
+                    try:
+                        data = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    for handler in self._handlers.get(message["channel"], []):
+                        try:
+                            await handler(data)
+                        except Exception as e:
+                            logger.error(f"⚠️ [信号总线] 处理器异常 ({message['channel']}): {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"⚠️ [信号总线] 订阅链路中断，3 秒后重连: {e}")
+                await asyncio.sleep(3)
+            finally:
+                if pubsub:
+                    try: await pubsub.reset()
+                    except Exception: pass
+
+    async def get_online_list(self) -> set:
+        """心跳仍在 TTL 内的在线节点 (尚未被清扫的过期成员同样排除)"""
         if self.client:
-            # 这里的优化：如果需要更精确，可以结合心跳 Key 过滤
-            return await self.client.smembers("online_agents_set")
+            return set(await self.client.zrangebyscore(PRESENCE_KEY, time.time() - PRESENCE_TTL, "+inf"))
         return set()
 
 redis_mgr = RedisManager()
@@ -1,4 +1,5 @@
 import { useEffect } from 'react'
+import { useQueryClient } from '@tanstack/react-query'
 import { useRiskStore } from '../store/useRiskStore'
 import { useAuthStore } from '../store/useAuthStore'
 import { CONFIG } from '../lib/config'
@@ -7,12 +8,21 @@ export const useRiskSocket = () => {
   const { user, token } = useAuthStore()
   const addViolation = useRiskStore((s) => s.addViolation)
   const setAlerting = useRiskStore((s) => s.setAlerting)
+  const queryClient = useQueryClient()
 
   useEffect(() => {
     let socket: WebSocket | null = null;
     let reconnectTimeout: NodeJS.Timeout;
     let graceTimer: NodeJS.Timeout;
     let retryCount = 0;
+    // V5.82: 断线续传 - 记录最后收到的 event_id，重连握手时携带以补发错过的事件
+    let lastEventId: string | null = null;
+    const seenEventIds = new Set<string>(); // 补发与实时推送可能重叠，按 event_id 去重
+    const isNewerEvent = (a: string, b: string | null) => {
+      if (!b) return true;
+      const [aMs, aSeq] = a.split('-').map(Number), [bMs, bSeq] = b.split('-').map(Number);
+      return aMs > bMs || (aMs === bMs && aSeq > bSeq);
+    };
 
     const runLoop = (fn: () => Promise<void> | void, delay: number, timerKey: string) => {
       if (socket?.readyState !== WebSocket.OPEN) return;
@@ -27,7 +37,8 @@ export const useRiskSocket = () => {
 
     const connect = () => {
       if (!user || !token || !CONFIG.WS_BASE) return;
-      const wsUrl = `${CONFIG.WS_BASE}/risk?token=${encodeURIComponent(token)}&username=${encodeURIComponent(user.username)}`;
+      const resume = lastEventId ? `&last_event_id=${encodeURIComponent(lastEventId)}` : '';
+      const wsUrl = `${CONFIG.WS_BASE}/risk?token=${encodeURIComponent(token)}&username=${encodeURIComponent(user.username)}${resume}`;
       socket = new WebSocket(wsUrl)
 
       socket.onopen = () => {
@@ -54,6 +65,19 @@ export const useRiskSocket = () => {
 
       socket.onmessage = (event) => {
         const data = JSON.parse(event.data)
+
+        if (data.event_id) {
+          if (seenEventIds.has(data.event_id)) return;
+          seenEventIds.add(data.event_id);
+          if (seenEventIds.size > 1000) seenEventIds.delete(seenEventIds.values().next().value as string);
+          if (isNewerEvent(data.event_id, lastEventId)) lastEventId = data.event_id;
+        }
+
+        // 续传结束：错过的事件超出补发窗口时整体刷新数据
+        if (data.type === 'EVENT_REPLAY') {
+          if (data.truncated) queryClient.invalidateQueries();
+          return;
+        }
         
         // 1. 基础链路转发
         if (data.type === 'SCREEN_SYNC') window.dispatchEvent(new CustomEvent('ws-screen-sync', { detail: data }));
@@ -100,6 +124,11 @@ export const useRiskSocket = () => {
           window.dispatchEvent(new CustomEvent('api-response-error', { detail: { status: 403 } }));
           return;
         }
+        // 4001: 同一账号已在别处建立新链路，本链路被顶替，不再重连以免互相挤占
+        if (e.code === 4001) {
+          console.warn('⚠️ [WS链路] 当前链路已被同账号的新连接顶替');
+          return;
+        }
 
         // V3.82: 增加断开缓冲，避免瞬间闪断导致 UI 剧烈抖动
         clearTimeout(graceTimer);
@@ -111,15 +111,25 @@ export default function DashboardLayout({ children }: { children: React.ReactNod
       const res = await window.api.callApi({ url: `${CONFIG.API_BASE}/admin/notifications?size=5`, method: 'GET', headers: { 'Authorization': `Bearer ${token}` } })
       return res.data.data as Notification[]
     },
-    enabled: !!token,
+    enabled: !!token && showNotif, // 列表仅在展开通知面板时拉取
     refetchInterval: 30000 
   })
 
+  // V5.81: 未读角标走 Redis 统计接口，轮询不再访问 MySQL
+  const { data: unreadCount = 0 } = useQuery({
+    queryKey: ['notifications_unread'],
+    queryFn: async () => {
+      const res = await window.api.callApi({ url: `${CONFIG.API_BASE}/admin/notifications/unread`, method: 'GET', headers: { 'Authorization': `Bearer ${token}` } })
+      return (res.data?.data?.unread ?? 0) as number
+    },
+    enabled: !!token,
+    refetchInterval: 30000
+  })
+
   // V3.75: 指挥中心状态同步引擎
   const { data: sysStatus } = useSystemStatus()
 
   const pendingSyncCount = sysStatus?.pendingSyncCount ?? 0
-  const unreadCount = notifications.filter(n => n.is_read === 0).length
 
   // V3.71: 401 自动熔断逻辑 (已降级：仅提示不强制跳转)
   useEffect(() => {
@@ -292,7 +302,7 @@ export default function DashboardLayout({ children }: { children: React.ReactNod
                </div>
                <div className="max-h-[320px] overflow-y-auto custom-scrollbar bg-white">
                   {notifications.map(n => (
-                    <div key={n.id} onClick={() => { setSelectedMsg(n); if(n.is_read===0) window.api.callApi({ url: `${CONFIG.API_BASE}/admin/notifications/read`, method: 'POST', headers: { 'Authorization': `Bearer ${token}` }, data: { id: n.id } }).then(() => queryClient.invalidateQueries({ queryKey: ['notifications_recent'] })) }} className={cn("p-4 border-b border-slate-50 cursor-pointer group transition-all", n.is_read === 1 ? "opacity-40" : "hover:bg-slate-50")}>
+                    <div key={n.id} onClick={() => { setSelectedMsg(n); if(n.is_read===0) window.api.callApi({ url: `${CONFIG.API_BASE}/admin/notifications/read`, method: 'POST', headers: { 'Authorization': `Bearer ${token}` }, data: { id: n.id } }).then(() => { queryClient.invalidateQueries({ queryKey: ['notifications_recent'] }); queryClient.invalidateQueries({ queryKey: ['notifications_unread'] }) }) }} className={cn("p-4 border-b border-slate-50 cursor-pointer group transition-all", n.is_read === 1 ? "opacity-40" : "hover:bg-slate-50")}>
                        <div className="flex items-start gap-3">
                           <div className={cn("w-8 h-8 rounded-xl flex items-center justify-center shrink-0 border shadow-inner", n.is_read === 1 ? "bg-slate-50 text-slate-400" : "bg-cyan-50 text-cyan-600 border-cyan-100")}>
                              {n.is_read === 1 ? <MailOpen size={14}/> : <Bell size={14}/>}
@@ -106,6 +106,7 @@ export default function NotificationsPage() {
     onSuccess: (res) => {
       if (res.status === 200 || res.data?.status === 'ok') {
         queryClient.invalidateQueries({ queryKey: ['notifications'] })
+        queryClient.invalidateQueries({ queryKey: ['notifications_unread'] })
         if (selectedMsg && selectedMsg.id !== 'ALL') setSelectedMsg(prev => prev ? { ...prev, is_read: 1 } : null)
         else setSelectedMsg(null)
         toast.success('同步成功')